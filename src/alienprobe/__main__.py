@@ -0,0 +1,9 @@
+"""
+So that the command line also runs as 'python -m alienprobe ...'.
+"""
+import sys
+
+from alienprobe.cli import main
+
+
+sys.exit(main())
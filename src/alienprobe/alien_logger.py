@@ -1,20 +1,44 @@
 """
 A logging library which allows for rapid logging development, debugging and analysis by downstream log analysis systems.
 """
+import asyncio
+import atexit
 import datetime
-import importlib
 import random
 import socket
-import threading
+import tempfile
 import os
+import time
 from pathlib import Path
-from typing import Optional, Any, Union, List
+from typing import Optional, Any, Union, List, Tuple, Callable
 
-import tomli
-
-from alienprobe.dispatchers.base_dispatcher import BaseDispatcher
+from alienprobe.async_writer import AsyncWriter
+from alienprobe.collector import COLLECTOR_PID_ENV, COLLECTOR_SOCKET_ENV, LogCollector, worker_collector_socket
+from alienprobe.config_watcher import ConfigWatcher, ReloadMetrics, read_config_file
+from alienprobe.dispatchers.base_dispatcher import BaseDispatcher, create_dispatcher
+from alienprobe.dispatchers.async_base_dispatcher import AsyncBaseDispatcher, running_loop
+from alienprobe.dispatchers.collector_dispatcher import CollectorDispatcher
+from alienprobe.exception_text import EXCEPTION_TEXT_CACHE, exception_text
+from alienprobe.lazy import LazyParams, is_lazy, wrap_params
+from alienprobe.level_trie import LevelTrie, get_source_name
 from alienprobe.log_levels import LogLevels, LogLevel
-from alienprobe.message import Message
+from alienprobe.loop_writer import LoopWriter
+from alienprobe.message import Message, new_message
+from alienprobe.rate_limiter import SUMMARY_MESSAGE, RateLimiter, create_rate_limiter
+from alienprobe.serializers import DEFAULT_SERIALIZERS, load_serializers
+
+
+"""
+The level ids, bound once at import so that the level methods do not have to look them up for every call.
+"""
+_TRACE_ID: int = LogLevels.TRACE.level_id
+_DEBUG_ID: int = LogLevels.DEBUG.level_id
+_INFO_ID: int = LogLevels.INFO.level_id
+_NOTICE_ID: int = LogLevels.NOTICE.level_id
+_WARNING_ID: int = LogLevels.WARNING.level_id
+_ERROR_ID: int = LogLevels.ERROR.level_id
+_CRITICAL_ID: int = LogLevels.CRITICAL.level_id
+_FATAL_ID: int = LogLevels.FATAL.level_id
 
 
 class AlienLogger:
@@ -30,7 +54,7 @@ class AlienLogger:
     """
     The complete configuration for this logger, loaded from the TOML file.
     """
-    logger_config: dict
+    logger_config: dict = None
 
     """
     The path that we loaded the config from.
@@ -49,14 +73,68 @@ class AlienLogger:
     machine_name: str = "Unknown"
 
     """
-    Default log level, either 'debug', 'info', 'notice', 'error', 'critical'.
+    Default log level, either 'debug', 'info', 'notice', 'error', 'critical'.  Set it through the
+    default_log_level property, so that the threshold below is resolved again.
+    """
+    _default_log_level: LogLevel = LogLevels.DEBUG
+
+    """
+    The effective threshold (a level id) that a message has to reach to be dispatched.  We resolve it once, whenever
+    the configuration or the default level changes, so that the level methods can throw away a message with a single
+    integer compare, before we build anything.
+    """
+    _threshold_id: int = LogLevels.DEBUG.level_id
+
+    """
+    The per module log levels from the [log_levels] section, as a dotted prefix trie.
+    """
+    _level_trie: LevelTrie
+
+    """
+    The resolved level id per log source (the __name__ string, or the class of the object that logged).  This is
+    what makes a per module lookup a single dict hit on the hot path.  Cleared whenever the levels change.
+    """
+    _level_cache: dict
+
+    """
+    The background thread that watches the config file for changes, None if reloading is turned off.
     """
-    default_log_level: LogLevel = LogLevels.DEBUG
+    _config_watcher: Optional[ConfigWatcher] = None
+
+    """
+    How often (and how fast) the config file was reloaded.
+    """
+    reload_metrics: ReloadMetrics
+
+    """
+    The queue and writer thread of the asynchronous dispatch mode, None when we dispatch on the calling thread.
+    Turned on with async_mode = true in the [common] section.
+    """
+    _async_writer: Optional[AsyncWriter] = None
+
+    """
+    The collector that receives the messages of the worker processes, when this is the parent process that started
+    it.  See start_collector().
+    """
+    _collector: Optional[LogCollector] = None
+
+    """
+    The queue and writer task of the asyncio mode, None when it is off.  See start_loop_writer().
+    """
+    _loop_writer: Optional[LoopWriter] = None
+
+    """
+    The token buckets per message key, from the [rate_limits] section.  None when nothing is rate limited.
+    """
+    _rate_limiter: Optional[RateLimiter] = None
 
     def __init__(self):
         """
         Initialize the logging engine.
         """
+        self._level_trie = LevelTrie()
+        self._level_cache = {}
+        self.reload_metrics = ReloadMetrics()
         self.instance_id = self._generate_instance_id()
         config_file_str = os.getenv('ALIENLOGGER__CONFIG_FILE_PATH')
         if not config_file_str:
@@ -67,33 +145,96 @@ class AlienLogger:
 
         self.load_config(config_path=config_file_str)
 
+    @property
+    def default_log_level(self) -> LogLevel:
+        """
+        The default log level for every log source.
+        :return: The current default log level.
+        """
+        return self._default_log_level
 
+    @default_log_level.setter
+    def default_log_level(self, log_level: LogLevel):
+        """
+        Sets the default log level, and resolves the effective threshold used for the level gating.
+        :param log_level: The new default log level, like LogLevels.INFO
+        """
+        if not isinstance(log_level, LogLevel):
+            raise ValueError(f"The default log level must be a LogLevel, got '{log_level}'.")
 
-    """
-    We need a mutex so that we don't have two loggers cobbling over themselves, especially when using stuff like syslog.
-    """
-    _output_mutex: threading.Lock = None
+        self._default_log_level = log_level
+        self._level_trie.default_level = log_level
+        self._resolve_threshold()
+
+    def _resolve_threshold(self):
+        """
+        Resolves the effective threshold once, so the hot path is only an integer compare.  The threshold is the
+        lowest level configured anywhere, since a module can log below the default level.  We also drop the resolved
+        levels per source, since they may have changed.
+        """
+        self._level_cache = {}
+        self._threshold_id = self._level_trie.min_level_id()
+
+    def _resolve_source_level(self, cache_key: Union[str, type]) -> int:
+        """
+        Resolves the level of a log source in the level trie, and remembers it for the next time.
+        :param cache_key: The __name__ string, or the class of the object that is logging.
+        :return: The level id of this source.
+        """
+        level_trie = self._level_trie
+        level_id = level_trie.resolve(get_source_name(cache_key)).level_id
+
+        #
+        # If the config was reloaded while we resolved, don't put a stale level in the new cache.
+        #
+        level_cache = self._level_cache
+        if self._level_trie is level_trie:
+            level_cache[cache_key] = level_id
+        return level_id
+
+    def is_enabled(self, log_level: LogLevel) -> bool:
+        """
+        Is anything, from any source, going to be dispatched at this level?  Use it to skip building an expensive
+        log_params dict, for example:  if logger.is_enabled(LogLevels.TRACE): logger.trace(self, 'Dumped state', {...})
+        Use enabled_for() if you have module levels in the [log_levels] section and want the answer for one source.
+        :param log_level: The level we want to log at.
+        :return: True if a message at this level would be dispatched.
+        """
+        return log_level.level_id >= self._threshold_id
+
+    def enabled_for(self, log_source: Union[str, object], log_level: LogLevel) -> bool:
+        """
+        Is a message at this level, coming from this log source, going to be dispatched?
+        :param log_source: The source that would log.  Pass 'self' if you are in a class, or __name__ if you are in
+        a python module.
+        :param log_level: The level we want to log at.
+        :return: True if a message from this source at this level would be dispatched.
+        """
+        level_id = log_level.level_id
+        if level_id < self._threshold_id:
+            return False
+
+        cache_key = log_source if isinstance(log_source, (str, type)) else type(log_source)
+        source_level_id = self._level_cache.get(cache_key)
+        if source_level_id is None:
+            source_level_id = self._resolve_source_level(cache_key)
+
+        return level_id >= source_level_id
 
     def load_config(self, config_path: Union[Path, str]):
         """
         Loads this logger configuration from the given Path (or str).  Throws an exception if the
-        path is not found.
+        path is not found.  Unless config_reload_seconds is 0 in the [common] section, we then keep watching the
+        file, and apply any change to the levels and dispatchers without a restart.
         :param config_path: The path to the toml config file for this logger.
         """
         self.logger_config_path = Path(config_path)
         if not self.logger_config_path.exists():
             raise ValueError(f"Could not find Logger TOML config file in {self.logger_config_path}")
 
-        #
-        # We use 'rb' with no encoding, in case that other encodings are used for the config file.  Apparently,
-        # tomli is able to handle this.  I hope its not just utf-8 or ascii.
-        #
-        with open(self.logger_config_path, "rb") as f:
-            self.logger_config = tomli.load(f)
-
-        self.default_log_level = LogLevels().get_level_by_name(self.logger_config.get('default_log_level', 'info'))
-
-        self._init_dispatchers()
+        config, signature, digest = read_config_file(self.logger_config_path)
+        self._apply_config(config)
+        self._start_config_watcher(signature=signature, digest=digest)
 
         self.info(self, "Logger Initialized", {
             "machine_name": self.machine_name,
@@ -101,38 +242,479 @@ class AlienLogger:
             "utc_start_time": datetime.datetime.utcnow()
         })
 
-    def _init_dispatchers(self):
+    def check_config_changes(self) -> bool:
+        """
+        Checks the config file for changes right now, instead of waiting for the watcher thread.  Applies the new
+        config if it changed.
+        :return: True if the config changed and was applied.
+        """
+        if not self._config_watcher:
+            return False
+
+        return self._config_watcher.check_now()
+
+    def stop_config_watcher(self):
+        """
+        Stops watching the config file for changes.
+        """
+        if self._config_watcher:
+            self._config_watcher.stop()
+            self._config_watcher = None
+
+    def _start_config_watcher(self, signature: Optional[tuple], digest: bytes):
+        """
+        Starts the background thread that watches the config file, if reloading is turned on.
+        :param signature: The file signature of the config we just loaded.
+        :param digest: The digest of the config we just loaded.
+        """
+        self.stop_config_watcher()
+
+        reload_seconds = float(self.logger_config.get('common', {}).get('config_reload_seconds', 60))
+        if reload_seconds <= 0:
+            return
+
+        self._config_watcher = ConfigWatcher(config_path=self.logger_config_path, interval_seconds=reload_seconds,
+                                             on_change=self._reload_config, on_error=self._on_reload_error)
+        self._config_watcher.prime(signature=signature, digest=digest)
+        self._config_watcher.start()
+
+    def _retune_config_watcher(self):
+        """
+        Applies a changed config_reload_seconds of the reloaded config to the watcher.  The new interval starts with
+        the next check, and 0 stops watching (only load_config() starts it again).
+        """
+        watcher = self._config_watcher
+        if not watcher:
+            return
+
+        reload_seconds = float(self.logger_config.get('common', {}).get('config_reload_seconds', 60))
+        if reload_seconds <= 0:
+            #
+            # We are in the check of the watcher, which its thread may be waiting for:  don't wait for the thread.
+            #
+            watcher.stop(wait=False)
+            self._config_watcher = None
+        else:
+            watcher.interval_seconds = reload_seconds
+
+    def _reload_config(self, config: dict):
+        """
+        Called by the config watcher when the content of the config file changed.
+        :param config: The newly parsed config.
+        """
+        start_time = time.perf_counter()
+        rebuilt = self._apply_config(config, reuse_dispatchers=True)
+        self._retune_config_watcher()
+
+        metrics = self.reload_metrics
+        metrics.last_reload_seconds = time.perf_counter() - start_time
+        metrics.last_dispatchers_rebuilt = rebuilt
+        metrics.total_dispatchers_rebuilt += rebuilt
+        metrics.reload_count += 1
+
+        self.notice(self, "Logger configuration reloaded", {
+            "config_path": self.logger_config_path,
+            "reload_seconds": metrics.last_reload_seconds,
+            "dispatchers_rebuilt": rebuilt
+        })
+
+    def _on_reload_error(self, ex: BaseException):
+        """
+        Called by the config watcher when the changed config could not be read or applied.  We keep the previous
+        configuration.
+        :param ex: What went wrong.
+        """
+        self.reload_metrics.failed_reload_count += 1
+        self.reload_metrics.last_error = ex
+        self.error(self, "Could not reload the logger configuration, keeping the previous one",
+                   {"config_path": self.logger_config_path}, exception=ex)
+
+    def _apply_config(self, config: dict, reuse_dispatchers: bool = False) -> int:
+        """
+        Applies a parsed configuration: the levels and the dispatchers.  Everything is built on the side, and only
+        published at the end with plain reference assignments, so logging threads never take a lock and never see a
+        half built dispatchers dict.  If anything fails, the previous configuration stays in place.
+        :param config: The parsed TOML configuration.
+        :param reuse_dispatchers: Keep the dispatchers whose section did not change, instead of rebuilding them all.
+        :return: The number of dispatchers that were built.
+        """
+        #
+        # The per module levels, then the default level.  The default level lives in the [log_levels] section, but
+        # older config files put it in [common] or at the top of the file, so we still look there.
+        #
+        level_trie = LevelTrie()
+        level_trie.load_levels(config.get('log_levels', {}))
+
+        level_name = config.get('log_levels', {}).get('default_log_level') \
+            or config.get('common', {}).get('default_log_level') \
+            or config.get('default_log_level', 'info')
+        default_log_level = LogLevels().get_level_by_name(level_name)
+        if not default_log_level:
+            raise ValueError(f"Unknown default_log_level '{level_name}' in config file {self.logger_config_path}")
+        level_trie.default_level = default_log_level
+        threshold_id = level_trie.min_level_id()
+
+        #
+        # Your own parameter encoders.  They are only imported here, and published with the dispatchers.
+        #
+        serializers = load_serializers(config.get('serializers', {}))
+
+        exception_dedup_seconds = float(config.get('common', {}).get('exception_dedup_seconds', 0))
+
+        #
+        # The buckets (and what they suppressed) are kept when the [rate_limits] section did not change.
+        #
+        previous_rate_limiter = self._rate_limiter
+        if previous_rate_limiter and self.logger_config \
+                and config.get('rate_limits') == self.logger_config.get('rate_limits'):
+            rate_limiter = previous_rate_limiter
+        else:
+            rate_limiter = create_rate_limiter(config.get('rate_limits', {}))
+
+        #
+        # The writer of the async mode is built (and its settings checked) here, it is only started once published.
+        #
+        async_writer = self._build_async_writer(config.get('common', {}))
+
+        #
+        # The dispatchers last, they hold files, sockets and threads:  nothing that can fail comes after them.
+        #
+        previous_config = self.logger_config if reuse_dispatchers else None
+        dispatchers, rebuilt = self._init_dispatchers(config=config, previous_config=previous_config)
+
+        previous_dispatchers = self.dispatchers
+        self.logger_config = config
+        #
+        # The trie goes first, complete with its default level, then a new cache:  a thread that resolved a source
+        # in the old trie sees that the trie changed, and does not store its stale level in the new cache.
+        #
+        self._default_log_level = default_log_level
+        self._level_trie = level_trie
+        self._level_cache = {}
+        self._threshold_id = threshold_id
+        self.dispatchers = dispatchers
+        DEFAULT_SERIALIZERS.replace_config_encoders(serializers)
+        if exception_dedup_seconds != EXCEPTION_TEXT_CACHE.dedup_seconds:
+            EXCEPTION_TEXT_CACHE.configure(dedup_seconds=exception_dedup_seconds)
+        self._rate_limiter = rate_limiter
+        self._publish_async_writer(async_writer)
+        if previous_rate_limiter and previous_rate_limiter is not rate_limiter:
+            self.log_rate_summaries(rate_limiter=previous_rate_limiter)
+
+        #
+        # The dispatchers that were replaced (or removed) can let go of their files, sockets and threads.
+        #
+        for disp in previous_dispatchers.values():
+            if all(disp is not new_disp for new_disp in dispatchers.values()):
+                disp.close()
+
+        return rebuilt
+
+    def _configure_async_writer(self, common_config: dict):
+        """
+        Starts (or stops) the asynchronous dispatch mode, according to the [common] section.
+        async_mode: Put the messages on a queue, and let a writer thread hand them to the dispatchers.
+        async_queue_size: The most messages we hold in the queue.  Default is 10000.
+        async_overflow_policy: What we do when the queue is full, 'block', 'drop_newest', 'drop_oldest' or 'sample'.
+        async_sample_every: For the 'sample' policy, keep one in this many overflowing messages.  Default is 10.
+        :param common_config: The [common] section of the config.
+        """
+        self._publish_async_writer(self._build_async_writer(common_config))
+
+    def _build_async_writer(self, common_config: dict) -> Optional[AsyncWriter]:
+        """
+        Builds the writer of the async mode from the [common] section (see _configure_async_writer()), without
+        starting it.  Raises ValueError on bad settings, before anything was changed.
+        :param common_config: The [common] section of the config.
+        :return: The current writer if its settings did not change, a new one (not started yet), or None if the async
+        mode is off.
+        """
+        async_mode = bool(common_config.get('async_mode', False))
+        queue_size = int(common_config.get('async_queue_size', 10000))
+        overflow_policy = str(common_config.get('async_overflow_policy', 'block')).strip().lower()
+        sample_every = int(common_config.get('async_sample_every', 10))
+        if not async_mode:
+            return None
+
+        async_writer = self._async_writer
+        if async_writer and (async_writer.queue_size, async_writer.overflow_policy,
+                             async_writer.sample_every) == (queue_size, overflow_policy, sample_every):
+            return async_writer
+
+        return AsyncWriter(get_dispatchers=lambda: self.dispatchers, queue_size=queue_size,
+                           overflow_policy=overflow_policy, sample_every=sample_every)
+
+    def _publish_async_writer(self, new_writer: Optional[AsyncWriter]):
+        """
+        Starts the writer built by _build_async_writer() and swaps it in, then lets the previous one write what it
+        still holds and stop.
+        :param new_writer: The writer to use, None to turn the async mode off.
+        """
+        async_writer = self._async_writer
+        if new_writer is async_writer:
+            return
+
+        if new_writer:
+            new_writer.start()
+            if not async_writer:
+                atexit.register(self.shutdown)
+        self._async_writer = new_writer
+
+        if async_writer:
+            async_writer.shutdown()
+
+    def flush(self, timeout: Optional[float] = None):
+        """
+        Waits until every message logged so far has been handed to the dispatchers, and asks the dispatchers to flush
+        whatever they buffer.
+        :param timeout: The most seconds to wait for the async queue, None to wait as long as it takes.
+        """
+        self.log_rate_summaries()
+        if self._async_writer:
+            self._async_writer.flush(timeout=timeout)
+
+        #
+        # The loop writer can only be waited for from another thread, on the loop use 'await logger.aflush()'.
+        #
+        loop_writer = self._loop_writer
+        if loop_writer and loop_writer.loop.is_running() and running_loop() is not loop_writer.loop:
+            asyncio.run_coroutine_threadsafe(loop_writer.flush(), loop_writer.loop).result(timeout=timeout)
+
+        for disp in self.dispatchers.values():
+            disp: BaseDispatcher
+            disp.flush()
+
+    def shutdown(self, timeout: Optional[float] = None):
+        """
+        Flushes everything, stops the async writer thread and the config watcher, and closes the dispatchers.  This
+        is registered with atexit when the async mode is on.  You can keep logging after this, the messages are then
+        dispatched on the calling thread.
+        :param timeout: The most seconds to wait for the async queue, None to wait as long as it takes.
+        """
+        atexit.unregister(self.shutdown)
+        self.stop_config_watcher()
+        self.stop_collector(timeout=timeout)
+        self.log_rate_summaries()
+
+        async_writer = self._async_writer
+        self._async_writer = None
+        if async_writer:
+            async_writer.shutdown(timeout=timeout)
+
+        for disp in self.dispatchers.values():
+            disp: BaseDispatcher
+            disp.close()
+
+    def log_rate_summaries(self, rate_limiter: Optional[RateLimiter] = None):
+        """
+        Logs a summary for every message key that the rate limits suppressed since its last summary, at the level
+        and from the source of the key.  This happens on its own every summary_interval_seconds of the [rate_limits]
+        section, and on flush() and shutdown().  There is no timer:  once the interval is over, the summaries wait for
+        the next message that is logged (whatever its key), so a logger that went quiet only writes them on flush() or
+        shutdown().  The summaries are not rate limited.
+        :param rate_limiter: The limiter to summarize, default is the current one.
+        """
+        rate_limiter = rate_limiter or self._rate_limiter
+        if not rate_limiter:
+            return
+
+        for bucket in rate_limiter.take_summaries():
+            suppressed_count = bucket.suppressed_count - bucket.reported_count
+            bucket.reported_count += suppressed_count
+            if suppressed_count <= 0:
+                continue
+            params = {'message': bucket.message_static, 'suppressed_count': suppressed_count,
+                      'rate_per_second': bucket.rate_per_second, 'burst': bucket.burst}
+            params.update(zip(rate_limiter.key_params, bucket.key_values))
+            self.log_message(log_level=bucket.log_level, log_source=bucket.log_source,
+                             log_message_static=SUMMARY_MESSAGE, log_params=params)
+
+    def start_loop_writer(self, queue_size: int = 10000) -> LoopWriter:
+        """
+        Turns on the asyncio mode, call it from a coroutine on your event loop.  The logger methods called on the loop
+        (and on any other thread) then only put the message on a queue owned by the loop, and a writer task hands
+        it to the dispatchers:  an AsyncBaseDispatcher is awaited on the loop, the other dispatchers write on a
+        thread of their own, so a slow console or disk never stalls the loop.  Use the awaitable methods
+        (await logger.ainfo(...)) where you would rather wait than drop a message when the queue is full.  Call
+        'await logger.stop_loop_writer()' before the loop ends.  The async_mode of the [common] section is not used
+        for the messages that go through the loop writer.
+        :param queue_size: The most messages we hold in the queue.  Past that, the synchronous logger methods drop
+        the message, and the awaitable ones wait.
+        :return: The loop writer, with its counters.
+        """
+        loop = asyncio.get_running_loop()
+        loop_writer = self._loop_writer
+        if loop_writer and loop_writer.loop is loop:
+            return loop_writer
+
+        loop_writer = LoopWriter(loop=loop, get_dispatchers=lambda: self.dispatchers, queue_size=queue_size)
+        for disp in self.dispatchers.values():
+            if isinstance(disp, AsyncBaseDispatcher):
+                disp.bind_loop(loop)
+        loop_writer.start()
+        self._loop_writer = loop_writer
+        return loop_writer
+
+    async def stop_loop_writer(self):
+        """
+        Writes what is left on the queue of the asyncio mode, and turns it off.  The messages are then dispatched on
+        the calling thread again (or by the async writer thread, in the async mode).
+        """
+        loop_writer = self._loop_writer
+        if not loop_writer:
+            return
+        self._loop_writer = None
+        await loop_writer.shutdown()
+
+        for disp in self.dispatchers.values():
+            if isinstance(disp, AsyncBaseDispatcher):
+                await disp.aflush()
+
+    async def aflush(self):
+        """
+        Waits, on the event loop, until every message logged so far has been written by the dispatchers of the
+        asyncio mode, and asks the dispatchers to flush whatever they buffer.  The plain dispatchers are flushed on
+        a thread, not on the loop.
+        """
+        loop_writer = self._loop_writer
+        if loop_writer:
+            await loop_writer.flush()
+
+        loop = asyncio.get_running_loop()
+        for disp in self.dispatchers.values():
+            if isinstance(disp, AsyncBaseDispatcher):
+                await disp.aflush()
+            else:
+                await loop.run_in_executor(None, disp.flush)
+
+    def start_collector(self, socket_path: Optional[str] = None) -> str:
+        """
+        Makes this process the collector of its worker processes:  the processes it starts from now on (spawned or
+        forked, like the workers of a ProcessPoolExecutor) send their messages here, and our dispatchers write them.
+        See alienprobe.collector.
+        :param socket_path: The Unix domain socket to listen on.  Default is a new one in the temp folder.
+        :return: The socket path.
+        """
+        if self._collector:
+            return self._collector.socket_path
+
+        if not socket_path:
+            socket_path = os.path.join(tempfile.gettempdir(),
+                                       f"alienprobe-{os.getpid()}-{random.randrange(16 ** 8):08x}.sock")
+        collector = LogCollector(socket_path=socket_path, dispatch=self.dispatch_messages)
+        collector.start()
+        self._collector = collector
+        os.environ[COLLECTOR_SOCKET_ENV] = socket_path
+        os.environ[COLLECTOR_PID_ENV] = str(os.getpid())
+        return socket_path
+
+    def stop_collector(self, timeout: Optional[float] = None):
+        """
+        Dispatches what the workers already sent, and stops the collector.  The processes started after this keep
+        their own dispatchers.
+        :param timeout: The most seconds to wait for the collector thread, None to wait as long as it takes.
+        """
+        collector = self._collector
+        if not collector:
+            return
+        self._collector = None
+        if os.environ.get(COLLECTOR_SOCKET_ENV) == collector.socket_path:
+            os.environ.pop(COLLECTOR_SOCKET_ENV, None)
+            os.environ.pop(COLLECTOR_PID_ENV, None)
+        collector.stop(timeout=timeout)
+
+    def dispatch_messages(self, batch: List[Message]):
+        """
+        Dispatches messages that were already logged (and gated), like the ones the collector receives from the
+        workers.  They go through the loop writer or the async writer when they are on.
+        :param batch: The messages.
+        """
+        for writer in (self._loop_writer, self._async_writer):
+            if writer:
+                batch = [msg_obj for msg_obj in batch if not writer.put(msg_obj)]
+                if not batch:
+                    return
+
+        for disp in self.dispatchers.values():
+            disp: BaseDispatcher
+            disp.submit_messages(batch)
+
+    def _after_fork_in_child(self):
+        """
+        Runs in a forked child.  Our threads did not come along:  the collector stays the parent's, the async writer
+        is started again, and if the parent is a collector, we send everything to it.  The dispatchers we inherited
+        are dropped without closing them, they share their files and buffers with the parent.  The child gets its
+        own instance id.
+        """
+        self.instance_id = self._generate_instance_id()
+        self._collector = None
+        self._config_watcher = None
+        self._loop_writer = None
+        if self._async_writer:
+            self._async_writer = None
+            self._configure_async_writer(self.logger_config.get('common', {}))
+        if worker_collector_socket() and self.logger_config:
+            self.dispatchers, _ = self._init_dispatchers(config=self.logger_config)
+
+    def _init_dispatchers(self, config: dict, previous_config: Optional[dict] = None) -> Tuple[dict, int]:
         """
         Go through the list of dispatchers configured in the config file, and instantiate them all.
-        This sets up the current array of dispatchers that is used to broadcast messages.
+        This builds the dict of dispatchers that is used to broadcast messages.
+        :param config: The parsed TOML configuration.
+        :param previous_config: The configuration that is currently applied.  If given, a dispatcher whose section
+        did not change is kept as is, instead of being rebuilt.
+        :return: The new dict of dispatcher names to dispatchers, and how many of them were built.
         """
-        self.dispatchers = {}
+        new_dispatchers = {}
+        rebuilt = 0
 
-        dispatchers = self.logger_config['common']['dispatchers']
-        for dispatcher_name in dispatchers:
-            if dispatcher_name not in self.logger_config.keys():
-                raise ValueError(f"Could not find dispatcher {dispatcher_name} configuration "
-                                 f"in config file {self.logger_config_path}")
+        #
+        # In a worker process of a collector, everything goes to the collector, whatever the config file says.
+        #
+        collector_socket = worker_collector_socket()
+        if collector_socket:
+            current = self.dispatchers.get('collector')
+            if isinstance(current, CollectorDispatcher) and current.socket_path == collector_socket:
+                return {'collector': current}, 0
+            return {'collector': create_dispatcher(dispatcher_name='collector', dispatcher_config={
+                'dispatcher_class_name': 'alienprobe.dispatchers.collector_dispatcher.CollectorDispatcher',
+                'socket_path': collector_socket})}, 1
+
+        dispatchers = config['common']['dispatchers']
+        try:
+            for dispatcher_name in dispatchers:
+                if dispatcher_name not in config.keys():
+                    raise ValueError(f"Could not find dispatcher {dispatcher_name} configuration "
+                                     f"in config file {self.logger_config_path}")
+
+                dispatcher_config = config[dispatcher_name]
+                if previous_config and dispatcher_name in self.dispatchers \
+                        and previous_config.get(dispatcher_name) == dispatcher_config:
+                    new_dispatchers[dispatcher_name] = self.dispatchers[dispatcher_name]
+                    continue
 
-            dispatcher_config = self.logger_config[dispatcher_name]
+                #
+                # For each logger that is configured, instantiate the logger.
+                # You can write your own!
+                #
+                new_dispatchers[dispatcher_name] = create_dispatcher(dispatcher_name=dispatcher_name,
+                                                                     dispatcher_config=dispatcher_config)
+                rebuilt += 1
+        except Exception:
             #
-            # For each logger that is configured, instantiate the logger.
-            # You can write your own!
+            # The config is not applied, so the dispatchers we already built in this pass are never used:  let go of
+            # their files, sockets and threads.  The ones we kept belong to the current config.
             #
-            dispatcher_cls_name = dispatcher_config.get('dispatcher_class_name')
-            if not dispatcher_cls_name:
-                raise ValueError(f'Dispatcher {dispatcher_name} does not have a class name entry in config '
-                                 f'(dispatcher_class_name)")')
-
-            module_name, class_name = dispatcher_cls_name.rsplit(".", 1)
-            MyDispatcher = getattr(importlib.import_module(module_name), class_name)
-            dispatcher_instance = MyDispatcher()
-            self.dispatchers[dispatcher_name] = dispatcher_instance
-            dispatcher_instance: BaseDispatcher
-            dispatcher_instance.config_dispatcher(config=dispatcher_config)
+            for disp in new_dispatchers.values():
+                if all(disp is not current for current in self.dispatchers.values()):
+                    disp.close()
+            raise
+
+        return new_dispatchers, rebuilt
 
     def log_internal(self, log_level: LogLevel, log_source: Union[str, object], log_message_static: str,
-                     log_params: dict = None, exception: Optional[BaseException] = None) -> None:
+                     log_params: Union[dict, Callable[[], dict]] = None,
+                     exception: Optional[BaseException] = None) -> None:
         """
         Logs something at the given level.  We open this up in case you want to do some custom logging shennanigans.
         Ordinarily, you should not be using this method.
@@ -148,22 +730,93 @@ class AlienLogger:
         With this, you can actually make a query (or graph!) in a downstream system of how many times a
         client sent a file and sum up how much data is being processed from this client per day.  Default is empty
         if you are just outputting a message and don't have any variant details like "System Started".
+        An expensive value can be a function or lambda (or lazy(...)), and so can the whole dictionary, see
+        alienprobe.lazy.  They are only called if the message passes the level gating, and a dispatcher renders it.
         :param exception: The exception that we are logging.  Default is None, if not, the stack trace will be obtained
         and outputted as part of the message.
         :return: None
         """
+        if not self.enabled_for(log_source, log_level):
+            return
+
+        #
+        # The params are wrapped before the rate limits, so that a lazy key param is computed once, for the key, and
+        # the message then carries the very same computed values.
+        #
+        log_params = self._prepare_params(log_source=log_source, log_message_static=log_message_static,
+                                          log_params=log_params)
+
+        rate_limiter = self._rate_limiter
+        if rate_limiter:
+            allowed = rate_limiter.allow(log_source, log_level, log_message_static, log_params)
+            if rate_limiter.summary_due:
+                self.log_rate_summaries(rate_limiter=rate_limiter)
+            if not allowed:
+                return
+
+        self._dispatch_message(log_level=log_level, log_source=log_source, log_message_static=log_message_static,
+                               log_params=log_params, exception=exception)
+
+    def log_message(self, log_level: LogLevel, log_source: Union[str, object], log_message_static: str,
+                    log_params: Union[dict, Callable[[], dict]] = None,
+                    exception: Optional[BaseException] = None) -> None:
+        """
+        Builds and dispatches a message that already passed the level gating and the rate limits.  Like
+        log_internal(), you should not ordinarily be using this.
+        :param log_level: The logging level that we are dispatching this message.
+        :param log_source: The source that called the operation.
+        :param log_message_static: The static part of the log, like 'Read input file'.
+        :param log_params: The variable details of the message, see log_internal().
+        :param exception: The exception that we are logging.  Default is None.
+        :return: None
+        """
+        log_params = self._prepare_params(log_source=log_source, log_message_static=log_message_static,
+                                          log_params=log_params)
+        self._dispatch_message(log_level=log_level, log_source=log_source, log_message_static=log_message_static,
+                               log_params=log_params, exception=exception)
+
+    def _prepare_params(self, log_source: Union[str, object], log_message_static: str,
+                        log_params: Union[dict, Callable[[], dict], None]) -> Union[dict, LazyParams, None]:
+        """
+        Checks the params, copies them if the message is queued, and wraps the lazy ones.
+        :param log_source: The source that called the operation, for the error.
+        :param log_message_static: The static part of the log, for the error.
+        :param log_params: The params, as passed to the logger.
+        :return: The params to put on the message.
+        """
         if log_params and not isinstance(log_params, dict):
-            raise ValueError(f"Message log params for message '{log_message_static} in class "
-                             f"{log_source} is not a dictionary!  Pass in a dictionary or None.")
-
-        msg_obj = Message()
-        msg_obj.level = log_level
-        msg_obj.class_name = log_source
-        msg_obj.message_static = log_message_static
-        msg_obj.params = log_params
-        msg_obj.ex = exception
-        msg_obj.instance_id = self.instance_id
-        msg_obj.machine_name = self.machine_name
+            if not is_lazy(log_params):
+                raise ValueError(f"Message log params for message '{log_message_static} in class "
+                                 f"{log_source} is not a dictionary!  Pass in a dictionary, a function returning "
+                                 f"one or None.")
+        elif log_params and (self._async_writer or self._loop_writer):
+            #
+            # The caller may change its params dict as soon as we return, so the queued message gets its own copy.
+            #
+            log_params = dict(log_params)
+
+        #
+        # Lazy values are only computed when a dispatcher renders the message, and only once for all of them.
+        #
+        return wrap_params(log_params)
+
+    def _dispatch_message(self, log_level: LogLevel, log_source: Union[str, object], log_message_static: str,
+                          log_params: Union[dict, LazyParams, None], exception: Optional[BaseException]):
+        """
+        Builds the message, with params that went through _prepare_params(), and hands it to the writers or the
+        dispatchers.
+        """
+        async_writer = self._async_writer
+        loop_writer = self._loop_writer
+
+        msg_obj = new_message(Message, (log_level, log_source, log_message_static, log_params, exception,
+                                        self.instance_id, self.machine_name, time.time_ns(), time.monotonic_ns(),
+                                        exception_text(exception) if exception is not None else None))
+
+        if loop_writer and loop_writer.put(msg_obj):
+            return
+        if async_writer and async_writer.put(msg_obj):
+            return
 
         for disp in self.dispatchers.values():
             disp: BaseDispatcher
@@ -179,7 +832,8 @@ class AlienLogger:
         instance_id = ''.join(random.choice('0123456789ABCDEF') for i in range(5))
         return cur_date + "_" + instance_id
 
-    def trace(self, log_source: Union[str, object], log_message_static: str, log_params: dict = None,
+    def trace(self, log_source: Union[str, object], log_message_static: str,
+              log_params: Union[dict, Callable[[], dict]] = None,
               exception: Optional[BaseException] = None) -> None:
         """
         Logs something at the LogLevels.TRACE level. This is the lowest level and is used when performing excessively detailed
@@ -199,10 +853,14 @@ class AlienLogger:
         and outputted as part of the message.
         :return: None
         """
+        if _TRACE_ID < self._threshold_id:
+            return
+
         self.log_internal(log_level=LogLevels.TRACE, log_source=log_source, log_message_static=log_message_static,
                           log_params=log_params, exception=exception)
 
-    def debug(self, log_source: Union[str, object], log_message_static: str, log_params: dict = None,
+    def debug(self, log_source: Union[str, object], log_message_static: str,
+              log_params: Union[dict, Callable[[], dict]] = None,
               exception: Optional[BaseException] = None) -> None:
         """
         Logs something at the LogLevels.DEBUG level. The debug level is a bit less than the "trace" level.
@@ -224,10 +882,14 @@ class AlienLogger:
         and outputted as part of the message.
         :return: None
         """
+        if _DEBUG_ID < self._threshold_id:
+            return
+
         self.log_internal(log_level=LogLevels.DEBUG, log_source=log_source, log_message_static=log_message_static,
                           log_params=log_params, exception=exception)
 
-    def info(self, log_source: Union[str, object], log_message_static: str, log_params: dict = None,
+    def info(self, log_source: Union[str, object], log_message_static: str,
+             log_params: Union[dict, Callable[[], dict]] = None,
              exception: Optional[BaseException] = None) -> None:
         """
         Logs something at the LogLevels.INFO level.
@@ -249,10 +911,14 @@ class AlienLogger:
         and outputted as part of the message.
         :return: None
         """
+        if _INFO_ID < self._threshold_id:
+            return
+
         self.log_internal(log_level=LogLevels.INFO, log_source=log_source, log_message_static=log_message_static,
                           log_params=log_params, exception=exception)
 
-    def notice(self, log_source: Union[str, object], log_message_static: str, log_params: dict = None,
+    def notice(self, log_source: Union[str, object], log_message_static: str,
+               log_params: Union[dict, Callable[[], dict]] = None,
                exception: Optional[BaseException] = None) -> None:
         """
         Logs something at the LogLevels.NOTICE level.
@@ -274,10 +940,14 @@ class AlienLogger:
         and outputted as part of the message.
         :return: None
         """
+        if _NOTICE_ID < self._threshold_id:
+            return
+
         self.log_internal(log_level=LogLevels.NOTICE, log_source=log_source, log_message_static=log_message_static,
                           log_params=log_params, exception=exception)
 
-    def warning(self, log_source: Union[str, object], log_message_static: str, log_params: dict = None,
+    def warning(self, log_source: Union[str, object], log_message_static: str,
+                log_params: Union[dict, Callable[[], dict]] = None,
                 exception: Optional[BaseException] = None) -> None:
         """
         Logs something at the LogLevels.Warning level.
@@ -299,10 +969,14 @@ class AlienLogger:
         and outputted as part of the message.
         :return: None
         """
+        if _WARNING_ID < self._threshold_id:
+            return
+
         self.log_internal(log_level=LogLevels.WARNING, log_source=log_source, log_message_static=log_message_static,
                           log_params=log_params, exception=exception)
 
-    def warn(self, log_source: Union[str, object], log_message_static: str, log_params: dict = None,
+    def warn(self, log_source: Union[str, object], log_message_static: str,
+                log_params: Union[dict, Callable[[], dict]] = None,
                 exception: Optional[BaseException] = None) -> None:
         """
         Logs something at the LogLevels.Warning level.  This is a shortcut for logger.warning().
@@ -324,10 +998,14 @@ class AlienLogger:
         and outputted as part of the message.
         :return: None
         """
+        if _WARNING_ID < self._threshold_id:
+            return
+
         self.log_internal(log_level=LogLevels.WARNING, log_source=log_source, log_message_static=log_message_static,
                           log_params=log_params, exception=exception)
 
-    def error(self, log_source: Union[str, object], log_message_static: str, log_params: dict = None,
+    def error(self, log_source: Union[str, object], log_message_static: str,
+              log_params: Union[dict, Callable[[], dict]] = None,
               exception: Optional[BaseException] = None) -> None:
         """
         Logs something at the LogLevels.ERROR level.
@@ -350,10 +1028,14 @@ class AlienLogger:
         and outputted as part of the message.
         :return: None
         """
+        if _ERROR_ID < self._threshold_id:
+            return
+
         self.log_internal(log_level=LogLevels.ERROR, log_source=log_source, log_message_static=log_message_static,
                           log_params=log_params, exception=exception)
 
-    def critical(self, log_source: Union[str, object], log_message_static: str, log_params: dict = None,
+    def critical(self, log_source: Union[str, object], log_message_static: str,
+              log_params: Union[dict, Callable[[], dict]] = None,
               exception: Optional[BaseException] = None) -> None:
         """
         Logs something at the LogLevels.CRITICAL level.
@@ -378,10 +1060,14 @@ class AlienLogger:
         and outputted as part of the message.
         :return: None
         """
+        if _CRITICAL_ID < self._threshold_id:
+            return
+
         self.log_internal(log_level=LogLevels.CRITICAL, log_source=log_source, log_message_static=log_message_static,
                           log_params=log_params, exception=exception)
 
-    def fatal(self, log_source: Union[str, object], log_message_static: str, log_params: dict = None,
+    def fatal(self, log_source: Union[str, object], log_message_static: str,
+              log_params: Union[dict, Callable[[], dict]] = None,
               exception: Optional[BaseException] = None) -> None:
         """
         This is the level that you never want to see in production.  The FATAL level means the system has stopped,
@@ -403,9 +1089,145 @@ class AlienLogger:
         and outputted as part of the message.
         :return: None
         """
+        if _FATAL_ID < self._threshold_id:
+            return
+
         self.log_internal(log_level=LogLevels.FATAL, log_source=log_source, log_message_static=log_message_static,
                           log_params=log_params, exception=exception)
 
+    async def alog_internal(self, log_level: LogLevel, log_source: Union[str, object], log_message_static: str,
+                            log_params: Union[dict, Callable[[], dict]] = None,
+                            exception: Optional[BaseException] = None) -> None:
+        """
+        The awaitable log_internal(), for coroutines.  In the asyncio mode (see start_loop_writer()), when the queue
+        is full, it waits for the writer task to make some room instead of dropping the message.  Otherwise it is
+        the same as log_internal(), which never awaits anything.
+        :param log_level: The logging level that we are dispatching this message.
+        :param log_source: The source that called the operation.  Pass 'self' if you are in a class, or __name__ if you
+        are in a python module.
+        :param log_message_static: The static part of the log, like 'Read input file'.
+        :param log_params: The variable details of the message, see log_internal().
+        :param exception: The exception that we are logging.  Default is None.
+        :return: None
+        """
+        if not self.enabled_for(log_source, log_level):
+            return
+
+        loop_writer = self._loop_writer
+        if loop_writer and running_loop() is loop_writer.loop:
+            await loop_writer.wait_for_room()
+
+        self.log_internal(log_level=log_level, log_source=log_source, log_message_static=log_message_static,
+                          log_params=log_params, exception=exception)
+
+    async def atrace(self, log_source: Union[str, object], log_message_static: str,
+                     log_params: Union[dict, Callable[[], dict]] = None,
+                     exception: Optional[BaseException] = None) -> None:
+        """
+        The awaitable trace(), see alog_internal().
+        """
+        if _TRACE_ID < self._threshold_id:
+            return
+
+        await self.alog_internal(log_level=LogLevels.TRACE, log_source=log_source,
+                                 log_message_static=log_message_static, log_params=log_params, exception=exception)
+
+    async def adebug(self, log_source: Union[str, object], log_message_static: str,
+                     log_params: Union[dict, Callable[[], dict]] = None,
+                     exception: Optional[BaseException] = None) -> None:
+        """
+        The awaitable debug(), see alog_internal().
+        """
+        if _DEBUG_ID < self._threshold_id:
+            return
+
+        await self.alog_internal(log_level=LogLevels.DEBUG, log_source=log_source,
+                                 log_message_static=log_message_static, log_params=log_params, exception=exception)
+
+    async def ainfo(self, log_source: Union[str, object], log_message_static: str,
+                    log_params: Union[dict, Callable[[], dict]] = None,
+                    exception: Optional[BaseException] = None) -> None:
+        """
+        The awaitable info(), see alog_internal().
+        """
+        if _INFO_ID < self._threshold_id:
+            return
+
+        await self.alog_internal(log_level=LogLevels.INFO, log_source=log_source,
+                                 log_message_static=log_message_static, log_params=log_params, exception=exception)
+
+    async def anotice(self, log_source: Union[str, object], log_message_static: str,
+                      log_params: Union[dict, Callable[[], dict]] = None,
+                      exception: Optional[BaseException] = None) -> None:
+        """
+        The awaitable notice(), see alog_internal().
+        """
+        if _NOTICE_ID < self._threshold_id:
+            return
+
+        await self.alog_internal(log_level=LogLevels.NOTICE, log_source=log_source,
+                                 log_message_static=log_message_static, log_params=log_params, exception=exception)
+
+    async def awarning(self, log_source: Union[str, object], log_message_static: str,
+                       log_params: Union[dict, Callable[[], dict]] = None,
+                       exception: Optional[BaseException] = None) -> None:
+        """
+        The awaitable warning(), see alog_internal().
+        """
+        if _WARNING_ID < self._threshold_id:
+            return
+
+        await self.alog_internal(log_level=LogLevels.WARNING, log_source=log_source,
+                                 log_message_static=log_message_static, log_params=log_params, exception=exception)
+
+    async def awarn(self, log_source: Union[str, object], log_message_static: str,
+                    log_params: Union[dict, Callable[[], dict]] = None,
+                    exception: Optional[BaseException] = None) -> None:
+        """
+        The awaitable warn(), see alog_internal().
+        """
+        if _WARNING_ID < self._threshold_id:
+            return
+
+        await self.alog_internal(log_level=LogLevels.WARNING, log_source=log_source,
+                                 log_message_static=log_message_static, log_params=log_params, exception=exception)
+
+    async def aerror(self, log_source: Union[str, object], log_message_static: str,
+                     log_params: Union[dict, Callable[[], dict]] = None,
+                     exception: Optional[BaseException] = None) -> None:
+        """
+        The awaitable error(), see alog_internal().
+        """
+        if _ERROR_ID < self._threshold_id:
+            return
+
+        await self.alog_internal(log_level=LogLevels.ERROR, log_source=log_source,
+                                 log_message_static=log_message_static, log_params=log_params, exception=exception)
+
+    async def acritical(self, log_source: Union[str, object], log_message_static: str,
+                        log_params: Union[dict, Callable[[], dict]] = None,
+                        exception: Optional[BaseException] = None) -> None:
+        """
+        The awaitable critical(), see alog_internal().
+        """
+        if _CRITICAL_ID < self._threshold_id:
+            return
+
+        await self.alog_internal(log_level=LogLevels.CRITICAL, log_source=log_source,
+                                 log_message_static=log_message_static, log_params=log_params, exception=exception)
+
+    async def afatal(self, log_source: Union[str, object], log_message_static: str,
+                     log_params: Union[dict, Callable[[], dict]] = None,
+                     exception: Optional[BaseException] = None) -> None:
+        """
+        The awaitable fatal(), see alog_internal().
+        """
+        if _FATAL_ID < self._threshold_id:
+            return
+
+        await self.alog_internal(log_level=LogLevels.FATAL, log_source=log_source,
+                                 log_message_static=log_message_static, log_params=log_params, exception=exception)
+
 
 """
 Global logger so we only keep one instance in the process for speed and config reasons.
@@ -425,3 +1247,15 @@ def get_logger():
 
     _GLOBAL_LOGGER = AlienLogger()
     return _GLOBAL_LOGGER
+
+
+def _after_fork_in_child():
+    """
+    Fixes up the global logger in a forked child, see AlienLogger._after_fork_in_child()
+    """
+    if _GLOBAL_LOGGER:
+        _GLOBAL_LOGGER._after_fork_in_child()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
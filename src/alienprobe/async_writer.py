@@ -0,0 +1,267 @@
+"""
+The asynchronous dispatch mode.  The logging threads only put the message on a bounded queue, and a single writer
+thread takes the messages off the queue and hands them to the dispatchers.  That way, the formatting and the console
+(or network) I/O don't land on the latency of the code that is logging.
+"""
+import sys
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+from alienprobe.dispatchers.base_dispatcher import BaseDispatcher
+from alienprobe.message import Message
+
+
+class OverflowPolicies:
+    """
+    What we do when the queue is full.  Set with async_overflow_policy in the [common] section.
+    """
+
+    """
+    Wait until the writer made some room.  Nothing is lost, but the logging thread is slowed down to the speed of
+    the dispatchers.
+    """
+    BLOCK = 'block'
+
+    """
+    Drop the message that is being logged, keep what is already queued.
+    """
+    DROP_NEWEST = 'drop_newest'
+
+    """
+    Drop the oldest queued message to make room for the new one.  You keep the most recent messages.
+    """
+    DROP_OLDEST = 'drop_oldest'
+
+    """
+    Keep one in every async_sample_every overflowing messages (in place of the oldest queued one), and drop the rest.
+    You still get an idea of what is going on during a flood, without slowing anything down.
+    """
+    SAMPLE = 'sample'
+
+    """
+    All the policies, to check the config.
+    """
+    all_policies = (BLOCK, DROP_NEWEST, DROP_OLDEST, SAMPLE)
+
+
+class AsyncWriter:
+    """
+    A bounded queue of messages, and the writer thread that drains it into the dispatchers.
+    """
+
+    """
+    The most messages we hold in the queue.
+    """
+    queue_size: int
+
+    """
+    What we do when the queue is full, one of OverflowPolicies.
+    """
+    overflow_policy: str
+
+    """
+    For the 'sample' policy, keep one in this many overflowing messages.
+    """
+    sample_every: int
+
+    """
+    How many messages were put on the queue.
+    """
+    enqueued_count: int = 0
+
+    """
+    How many messages were dropped because the queue was full.
+    """
+    dropped_count: int = 0
+
+    """
+    How many times a dispatcher raised an exception on the writer thread.
+    """
+    error_count: int = 0
+
+    def __init__(self, get_dispatchers: Callable[[], Dict[str, BaseDispatcher]], queue_size: int = 10000,
+                 overflow_policy: str = OverflowPolicies.BLOCK, sample_every: int = 10):
+        """
+        Constructor for the writer.  Call start() to start the writer thread.
+        :param get_dispatchers: Returns the current dispatchers.  We call it for every batch, so that a hot reload of
+        the config is picked up by the writer thread as well.
+        :param queue_size: The most messages we hold in the queue.
+        :param overflow_policy: What we do when the queue is full, one of OverflowPolicies.
+        :param sample_every: For the 'sample' policy, keep one in this many overflowing messages.
+        """
+        if overflow_policy not in OverflowPolicies.all_policies:
+            raise ValueError(f"Unknown async_overflow_policy '{overflow_policy}', "
+                             f"use one of {OverflowPolicies.all_policies}")
+        if queue_size < 1:
+            raise ValueError(f"The async_queue_size must be at least 1, was {queue_size}")
+
+        self.get_dispatchers = get_dispatchers
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.sample_every = max(1, sample_every)
+
+        self._queue: Deque[Message] = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._busy = False
+        self._flush_requested = False
+        self._overflow_count = 0
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """
+        Starts the writer thread.  It is a daemon thread, call shutdown() (we register it with atexit) so that the
+        queued messages are written before the process exits.
+        """
+        self._thread = threading.Thread(target=self._run, name='alienprobe-async-writer', daemon=True)
+        self._thread.start()
+
+    def put(self, message_object: Message) -> bool:
+        """
+        Puts a message on the queue, applying the overflow policy if the queue is full.
+        :param message_object: The message to dispatch.
+        :return: False if the writer is shut down (or we are on the writer thread), and the caller has to dispatch
+        the message itself.  True if the message was queued, or dropped by the overflow policy.
+        """
+        if self._closed or threading.current_thread() is self._thread:
+            return False
+
+        with self._lock:
+            queue = self._queue
+            if len(queue) >= self.queue_size:
+                policy = self.overflow_policy
+                if policy == OverflowPolicies.BLOCK:
+                    while len(queue) >= self.queue_size and not self._closed:
+                        self._not_full.wait()
+                    if self._closed:
+                        return False
+                elif policy == OverflowPolicies.DROP_NEWEST:
+                    self.dropped_count += 1
+                    return True
+                elif policy == OverflowPolicies.DROP_OLDEST:
+                    queue.popleft()
+                    self.dropped_count += 1
+                else:
+                    self._overflow_count += 1
+                    self.dropped_count += 1
+                    if self._overflow_count % self.sample_every:
+                        return True
+                    queue.popleft()
+
+            queue.append(message_object)
+            self.enqueued_count += 1
+            self._not_empty.notify()
+
+        return True
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until everything that was queued has been handed to the dispatchers, including the partial batches
+        the writer thread is holding.
+        :param timeout: The most seconds to wait, None to wait as long as it takes.
+        :return: True if everything was written, False if we timed out.
+        """
+        if not self._thread or threading.current_thread() is self._thread:
+            return not self._queue
+
+        with self._lock:
+            self._flush_requested = True
+            self._not_empty.notify()
+            return self._idle.wait_for(lambda: not self._queue and not self._busy and not self._flush_requested,
+                                       timeout=timeout)
+
+    def shutdown(self, timeout: Optional[float] = None):
+        """
+        Writes what is left on the queue, and stops the writer thread.  After this, put() returns False and the
+        logger dispatches on the calling thread again.
+        :param timeout: The most seconds to wait for the queue to drain.
+        """
+        if self._closed:
+            return
+
+        self.flush(timeout=timeout)
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=timeout)
+
+    def _run(self):
+        """
+        The writer thread.  Takes everything that is queued in one go, and groups it per dispatcher.  A dispatcher
+        gets its messages in batches of its batch_size, and a partial batch is written once it is older than the
+        max_batch_latency_ms of the dispatcher (or when we flush).  We write outside of the lock, so that the logging
+        threads can keep queueing while we write.
+        """
+        pending: Dict[BaseDispatcher, List[Message]] = {}
+        pending_since: Dict[BaseDispatcher, float] = {}
+        deadline: Optional[float] = None
+
+        while True:
+            with self._lock:
+                while not self._queue and not self._closed and not self._flush_requested:
+                    timeout = None if deadline is None else deadline - time.monotonic()
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self._not_empty.wait(timeout)
+
+                batch = list(self._queue)
+                self._queue.clear()
+                force = self._flush_requested or self._closed
+                self._flush_requested = False
+                self._busy = True
+                self._not_full.notify_all()
+
+            now = time.monotonic()
+            if batch:
+                for disp in self.get_dispatchers().values():
+                    pending.setdefault(disp, []).extend(batch)
+                    pending_since.setdefault(disp, now)
+
+            deadline = None
+            for disp in list(pending.keys()):
+                messages = pending[disp]
+                batch_size = disp.batch_size
+                while len(messages) >= batch_size:
+                    self._write_batch(disp, messages[:batch_size])
+                    messages = messages[batch_size:]
+
+                disp_deadline = pending_since[disp] + disp.max_batch_latency_ms / 1000
+                if messages and (force or disp_deadline <= now):
+                    self._write_batch(disp, messages)
+                    messages = []
+
+                if messages:
+                    pending[disp] = messages
+                    deadline = disp_deadline if deadline is None else min(deadline, disp_deadline)
+                else:
+                    del pending[disp]
+                    del pending_since[disp]
+
+            with self._lock:
+                self._busy = bool(pending)
+                if not self._queue and not pending:
+                    self._idle.notify_all()
+                    if self._closed:
+                        return
+
+    def _write_batch(self, disp: BaseDispatcher, batch: List[Message]):
+        """
+        Hands a batch of messages to a dispatcher.  An exception in a dispatcher must not kill the writer thread,
+        and we cannot log it through the logger (it would land on this very queue), so it goes to stderr.
+        :param disp: The dispatcher to write to.
+        :param batch: The messages to write, in order.
+        """
+        try:
+            disp.submit_messages(batch)
+        except Exception as ex:
+            self.error_count += 1
+            print(f"alienprobe: dispatcher {type(disp).__name__} failed on the writer thread: {ex!r}",
+                  file=sys.stderr)
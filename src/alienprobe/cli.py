@@ -0,0 +1,56 @@
+"""
+The alienprobe command line.
+
+    alienprobe read-ring /var/log/myapp/myapp.ring      prints the records that survived in a ring file, in order
+
+Also runs as 'python -m alienprobe ...'.
+"""
+import argparse
+import sys
+from typing import List, Optional
+
+from alienprobe.dispatchers.mmap_ring_dispatcher import read_ring_file
+
+
+def read_ring(args: argparse.Namespace) -> int:
+    """
+    The read-ring command, prints the records of a ring file written by the MmapRingDispatcher, oldest first.
+    :param args: The parsed arguments.
+    :return: The exit code.
+    """
+    try:
+        records = read_ring_file(args.file_path)
+    except (OSError, ValueError) as ex:
+        print(f"alienprobe: {ex}", file=sys.stderr)
+        return 1
+
+    if args.last:
+        records = records[-args.last:]
+    for sequence, payload in records:
+        text = payload.decode(errors='replace')
+        print(f"{sequence} {text}" if args.sequence else text)
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Runs the command line.
+    :param argv: The arguments, without the program name.  Default is sys.argv.
+    :return: The exit code.
+    """
+    parser = argparse.ArgumentParser(prog='alienprobe', description='Tools for the alienprobe logs.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    read_ring_parser = commands.add_parser('read-ring',
+                                           help='Print the records that survived in a ring file, in order.')
+    read_ring_parser.add_argument('file_path', help='The file_path of the MmapRingDispatcher.')
+    read_ring_parser.add_argument('--last', type=int, default=0, help='Only print the last LAST records.')
+    read_ring_parser.add_argument('--sequence', action='store_true', help='Start every line with its sequence number.')
+    read_ring_parser.set_defaults(run=read_ring)
+
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
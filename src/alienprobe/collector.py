@@ -0,0 +1,451 @@
+"""
+Cross process log collection.  With a process pool, every worker would run its own dispatchers, format its own
+messages, and fight the others for stdout and the log files.  Instead, the workers send their messages, as they are
+(nothing is formatted), to a single collector in the parent process, which owns the real dispatchers:
+
+    logger = get_logger()
+    logger.start_collector()
+    with ProcessPoolExecutor() as pool:
+        ...                         # get_logger() in the workers sends everything to the collector
+    logger.stop_collector()
+
+The messages go over a Unix domain socket, as length prefixed binary frames (see encode_message).  A worker writes
+every batch straight to the socket, so once a log call returned (or the async writer handed the batch over), the
+records are in the kernel:  if the worker crashes right after, the collector still reads them.  A frame cut short by
+a crash in the middle of a send is dropped.
+
+The params are sent as their computed values.  Strings, numbers, booleans, None and dates go through exactly, the
+dicts, lists and tuples go as JSON when they can (so tuples arrive as lists), and anything else as its str().  The
+exception is sent as its rendered stack trace, the collector gets a RemoteException that renders as that text.
+"""
+import datetime
+import json
+import os
+import selectors
+import socket
+import struct
+import threading
+import traceback
+from typing import Callable, Dict, List, Optional, Tuple
+
+from alienprobe.log_levels import LogLevels, LogLevel
+from alienprobe.message import Message, new_message
+
+
+"""
+The collector sets these in the environment, for the processes it starts (spawned or forked):  the socket to send
+the messages to, and its own pid, so that it does not send messages to itself.
+"""
+COLLECTOR_SOCKET_ENV = 'ALIENLOGGER__COLLECTOR_SOCKET'
+COLLECTOR_PID_ENV = 'ALIENLOGGER__COLLECTOR_PID'
+
+"""
+A frame is the payload length, then the payload.
+"""
+FRAME_HEADER = struct.Struct('<I')
+
+"""
+The payload starts with:  the level id, the flags, the timestamp_ns, the monotonic_ns and how many params there are.
+Then come the strings (a length, then UTF-8):  class name, message static, instance id, machine name, and the
+exception summary and text when FLAG_EXCEPTION is set.  Then, for every param:  its name, a type tag, and its value.
+"""
+MESSAGE_HEADER = struct.Struct('<BBqqI')
+FLAG_EXCEPTION = 0x01
+
+"""
+The largest frame we accept, a bigger one means the stream is corrupted.
+"""
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+_LENGTH = struct.Struct('<I')
+_INT64 = struct.Struct('<q')
+_DOUBLE = struct.Struct('<d')
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+
+_LEVELS_BY_ID: Dict[int, LogLevel] = {}
+for _level in vars(LogLevels).values():
+    if isinstance(_level, LogLevel):
+        _LEVELS_BY_ID.setdefault(_level.level_id, _level)
+
+
+class RemoteException(Exception):
+    """
+    An exception that was logged in a worker process.  It renders as the stack trace the worker sent.
+    """
+
+    def __init__(self, summary: str, text: str):
+        """
+        Constructor.
+        :param summary: The last line of the stack trace, like 'ValueError: bad input'.
+        :param text: The rendered stack trace.
+        """
+        super().__init__(summary)
+        self.text = text
+
+
+def worker_collector_socket() -> Optional[str]:
+    """
+    The socket of the collector this process should send its messages to.
+    :return: The socket path, or None if there is no collector, or this process is the collector.
+    """
+    socket_path = os.environ.get(COLLECTOR_SOCKET_ENV)
+    if not socket_path or os.environ.get(COLLECTOR_PID_ENV) == str(os.getpid()):
+        return None
+    return socket_path
+
+
+def _pack_str(chunks: List[bytes], value: str):
+    """
+    Appends a string, its length then its UTF-8 bytes.
+    """
+    data = value.encode('utf-8', 'surrogatepass')
+    chunks.append(_LENGTH.pack(len(data)))
+    chunks.append(data)
+
+
+def _pack_value(chunks: List[bytes], value):
+    """
+    Appends a param value, its type tag then the value.
+    """
+    value_class = value.__class__
+    if value_class is str:
+        chunks.append(b's')
+        _pack_str(chunks, value)
+    elif value_class is bool:
+        chunks.append(b'T' if value else b'F')
+    elif value_class is int:
+        if _INT64_MIN <= value <= _INT64_MAX:
+            chunks.append(b'i')
+            chunks.append(_INT64.pack(value))
+        else:
+            chunks.append(b'I')
+            _pack_str(chunks, str(value))
+    elif value_class is float:
+        chunks.append(b'f')
+        chunks.append(_DOUBLE.pack(value))
+    elif value is None:
+        chunks.append(b'N')
+    elif value_class is datetime.datetime:
+        chunks.append(b'd')
+        _pack_str(chunks, value.isoformat())
+    elif value_class is datetime.date:
+        chunks.append(b'D')
+        _pack_str(chunks, value.isoformat())
+    else:
+        if isinstance(value, (dict, list, tuple)):
+            try:
+                text = json.dumps(value, ensure_ascii=False, allow_nan=True)
+            except (TypeError, ValueError, RecursionError):
+                text = None
+            if text is not None:
+                chunks.append(b'j')
+                _pack_str(chunks, text)
+                return
+        chunks.append(b'r')
+        _pack_str(chunks, str(value))
+
+
+def encode_message(message_object: Message) -> bytes:
+    """
+    Encodes a message into a frame.  Lazy params are computed here.
+    :param message_object: The message.
+    :return: The frame, with its length prefix.
+    """
+    class_name = message_object.class_name
+    if not isinstance(class_name, str):
+        class_name = str(type(class_name))
+    ex = message_object.ex
+    params = message_object.params
+
+    chunks: List[bytes] = [b'', b'']
+    _pack_str(chunks, class_name)
+    _pack_str(chunks, message_object.message_static)
+    _pack_str(chunks, message_object.instance_id)
+    _pack_str(chunks, message_object.machine_name)
+    if ex is not None:
+        _pack_str(chunks, traceback.format_exception_only(type(ex), ex)[-1].rstrip('\n'))
+        _pack_str(chunks, message_object.exception_text)
+
+    param_count = 0
+    if params:
+        for param_name, param_val in params.items():
+            _pack_str(chunks, str(param_name))
+            _pack_value(chunks, param_val)
+            param_count += 1
+
+    chunks[1] = MESSAGE_HEADER.pack(message_object.level.level_id, FLAG_EXCEPTION if ex is not None else 0,
+                                    message_object.timestamp_ns, message_object.monotonic_ns, param_count)
+    payload_length = sum(len(chunk) for chunk in chunks)
+    chunks[0] = FRAME_HEADER.pack(payload_length)
+    return b''.join(chunks)
+
+
+def _unpack_str(payload, offset: int) -> Tuple[str, int]:
+    """
+    Reads a string at the offset.
+    :return: The string, and the offset after it.
+    """
+    (length,) = _LENGTH.unpack_from(payload, offset)
+    offset += 4
+    end = offset + length
+    if end > len(payload):
+        raise ValueError("A string runs past the end of the frame.")
+    return str(payload[offset:end], 'utf-8', 'surrogatepass'), end
+
+
+def _unpack_value(payload, offset: int):
+    """
+    Reads a param value at the offset.
+    :return: The value, and the offset after it.
+    """
+    tag = payload[offset:offset + 1]
+    offset += 1
+    if tag == b's' or tag == b'r':
+        return _unpack_str(payload, offset)
+    if tag == b'i':
+        return _INT64.unpack_from(payload, offset)[0], offset + 8
+    if tag == b'f':
+        return _DOUBLE.unpack_from(payload, offset)[0], offset + 8
+    if tag == b'T':
+        return True, offset
+    if tag == b'F':
+        return False, offset
+    if tag == b'N':
+        return None, offset
+    text, offset = _unpack_str(payload, offset)
+    if tag == b'I':
+        return int(text), offset
+    if tag == b'd':
+        return datetime.datetime.fromisoformat(text), offset
+    if tag == b'D':
+        return datetime.date.fromisoformat(text), offset
+    if tag == b'j':
+        return json.loads(text), offset
+    raise ValueError(f"Unknown param type tag {tag!r}")
+
+
+def decode_message(payload) -> Message:
+    """
+    Decodes the payload of a frame (without its length prefix) back into a message.
+    :param payload: The payload bytes.
+    :return: The message.
+    """
+    level_id, flags, timestamp_ns, monotonic_ns, param_count = MESSAGE_HEADER.unpack_from(payload, 0)
+    level = _LEVELS_BY_ID.get(level_id)
+    if level is None:
+        raise ValueError(f"Unknown level id {level_id}")
+
+    offset = MESSAGE_HEADER.size
+    class_name, offset = _unpack_str(payload, offset)
+    message_static, offset = _unpack_str(payload, offset)
+    instance_id, offset = _unpack_str(payload, offset)
+    machine_name, offset = _unpack_str(payload, offset)
+    ex = None
+    text = None
+    if flags & FLAG_EXCEPTION:
+        summary, offset = _unpack_str(payload, offset)
+        text, offset = _unpack_str(payload, offset)
+        ex = RemoteException(summary, text)
+
+    params = None
+    if param_count:
+        params = {}
+        for _ in range(param_count):
+            param_name, offset = _unpack_str(payload, offset)
+            params[param_name], offset = _unpack_value(payload, offset)
+
+    return new_message(Message, (level, class_name, message_static, params, ex, instance_id, machine_name,
+                                 timestamp_ns, monotonic_ns, text))
+
+
+class LogCollector:
+    """
+    Listens on a Unix domain socket, decodes the messages the workers send, and hands them over in batches.  A single
+    thread serves every connection.
+    """
+
+    """
+    The path of the Unix domain socket.
+    """
+    socket_path: str
+
+    """
+    Gets every batch of decoded messages, on the collector thread.
+    """
+    dispatch: Callable[[List[Message]], None]
+
+    """
+    How many messages we received.
+    """
+    received_count: int = 0
+
+    """
+    How many workers connected.
+    """
+    connection_count: int = 0
+
+    """
+    How many frames were cut short by a worker that went away in the middle of a send.
+    """
+    torn_count: int = 0
+
+    """
+    How many connections we dropped because their stream could not be decoded, or the dispatch failed.
+    """
+    error_count: int = 0
+
+    def __init__(self, socket_path: str, dispatch: Callable[[List[Message]], None]):
+        """
+        Constructor.  Call start() to listen.
+        :param socket_path: The path of the Unix domain socket.  A stale socket file there is replaced.
+        :param dispatch: Gets every batch of decoded messages.
+        """
+        self.socket_path = socket_path
+        self.dispatch = dispatch
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+    def start(self):
+        """
+        Binds the socket (only the current user can connect to it), and starts the collector thread.
+        """
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        self._listener.listen(128)
+        self._listener.setblocking(False)
+
+        self._wake_reader, self._wake_writer = socket.socketpair()
+        self._wake_reader.setblocking(False)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='alienprobe-collector', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """
+        Reads what the connected workers already sent, then stops the collector thread and removes the socket.
+        :param timeout: The most seconds to wait for the thread, None to wait as long as it takes.
+        """
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping = True
+        self._wake_writer.send(b'\0')
+        thread.join(timeout)
+        self._thread = None
+        self._wake_writer.close()
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+    def _run(self):
+        """
+        The collector thread:  accepts the workers, and reads their frames until we are stopped.
+        """
+        selector = selectors.DefaultSelector()
+        selector.register(self._listener, selectors.EVENT_READ, None)
+        selector.register(self._wake_reader, selectors.EVENT_READ, None)
+        buffers: Dict[socket.socket, bytearray] = {}
+        try:
+            while not self._stopping:
+                for key, _ in selector.select():
+                    sock = key.fileobj
+                    if sock is self._listener:
+                        self._accept(selector, buffers)
+                    elif sock is self._wake_reader:
+                        self._wake_reader.recv(64)
+                    else:
+                        self._read(selector, buffers, sock)
+
+            #
+            # Stopping:  what the workers already sent is in the socket buffers, read it all before we go.
+            #
+            self._accept(selector, buffers)
+            for sock in list(buffers):
+                while sock in buffers and self._read(selector, buffers, sock):
+                    pass
+        finally:
+            for sock in list(buffers):
+                self._drop(selector, buffers, sock)
+            selector.close()
+            self._listener.close()
+            self._wake_reader.close()
+
+    def _accept(self, selector: selectors.BaseSelector, buffers: Dict[socket.socket, bytearray]):
+        """
+        Accepts the workers that are waiting to connect.
+        """
+        while True:
+            try:
+                conn, _ = self._listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            conn.setblocking(False)
+            selector.register(conn, selectors.EVENT_READ, None)
+            buffers[conn] = bytearray()
+            self.connection_count += 1
+
+    def _read(self, selector: selectors.BaseSelector, buffers: Dict[socket.socket, bytearray],
+              sock: socket.socket) -> bool:
+        """
+        Reads what a worker sent, and dispatches the complete frames.  A frame cut short by the end of the stream is
+        dropped.
+        :return: True if there may be more to read.
+        """
+        try:
+            data = sock.recv(256 * 1024)
+        except (BlockingIOError, InterruptedError):
+            return False
+        except OSError:
+            data = b''
+
+        buffer = buffers[sock]
+        if not data:
+            if buffer:
+                self.torn_count += 1
+            self._drop(selector, buffers, sock)
+            return False
+
+        buffer += data
+        batch = []
+        offset = 0
+        try:
+            while len(buffer) - offset >= FRAME_HEADER.size:
+                (payload_length,) = FRAME_HEADER.unpack_from(buffer, offset)
+                if payload_length > MAX_FRAME_BYTES:
+                    raise ValueError(f"A frame of {payload_length} bytes, the stream is corrupted.")
+                end = offset + FRAME_HEADER.size + payload_length
+                if end > len(buffer):
+                    break
+                batch.append(decode_message(bytes(buffer[offset + FRAME_HEADER.size:end])))
+                offset = end
+        except (ValueError, struct.error):
+            #
+            # We can't find the next frame in a corrupted stream, so we give up on this worker.
+            #
+            self.error_count += 1
+            self._drop(selector, buffers, sock)
+            return False
+        del buffer[:offset]
+
+        if batch:
+            self.received_count += len(batch)
+            try:
+                self.dispatch(batch)
+            except Exception:
+                self.error_count += 1
+        return True
+
+    @staticmethod
+    def _drop(selector: selectors.BaseSelector, buffers: Dict[socket.socket, bytearray], sock: socket.socket):
+        """
+        Closes a worker connection.
+        """
+        buffers.pop(sock, None)
+        selector.unregister(sock)
+        sock.close()
+
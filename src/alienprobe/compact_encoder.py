@@ -0,0 +1,160 @@
+"""
+A compact, single line, bounded encoder for the container parameters (dicts, lists, tuples, sets).  It replaces the
+pprint.pformat we used to do, which was slow, spread over many lines, and unbounded:  one big payload could turn a
+log line into megabytes of output and stall the console.
+
+    {'name': 'Andre', 'tags': ['a', 'b', ...(+98 items)], 'nested': {'deeper': {...}}}
+
+Everything that is cut is cut explicitly:  '...(+98 items)' when a container has more than max_items, '{...}' or
+'[...]' below max_depth, '<cycle>' when a container contains itself, and '...(truncated)' when the whole value goes
+over max_bytes.
+"""
+import datetime
+from collections.abc import Mapping
+from typing import Any, List, Set
+
+
+"""
+The common leaf types, checked first with a single set lookup.
+"""
+_SCALAR_TYPES = frozenset((str, int, float, bool, type(None)))
+
+
+class _OutOfBudget(Exception):
+    """
+    Raised internally when the output went over max_bytes, to stop the walk right away.
+    """
+    pass
+
+
+class CompactEncoder:
+    """
+    Encodes nested containers on a single line, within limits.  It holds no state between calls, so one encoder can
+    be shared by every thread of a dispatcher.
+    """
+
+    """
+    How deep we go into nested containers.  Below that, a container is shown as '{...}' or '[...]'.
+    """
+    max_depth: int
+
+    """
+    How many items we show per container.  The rest is counted, like '...(+123 items)'.
+    """
+    max_items: int
+
+    """
+    The most characters of output for one value (that is bytes, for plain ASCII).  Past that, the output is cut and
+    ends with '...(truncated)'.
+    """
+    max_bytes: int
+
+    def __init__(self, max_depth: int = 4, max_items: int = 100, max_bytes: int = 4096):
+        """
+        Constructor with the limits.
+        :param max_depth: How deep we go into nested containers.
+        :param max_items: How many items we show per container.
+        :param max_bytes: The most characters of output for one value.
+        """
+        if max_depth < 1 or max_items < 1 or max_bytes < 1:
+            raise ValueError(f"The param limits must be at least 1, got max_depth={max_depth}, "
+                             f"max_items={max_items}, max_bytes={max_bytes}")
+
+        self.max_depth = max_depth
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+
+    def encode(self, value: Any) -> str:
+        """
+        Encodes a value, in a single pass.
+        :param value: The value, usually a container.
+        :return: The single line text, at most max_bytes long (plus the truncation marker).
+        """
+        out: List[str] = []
+        budget = [self.max_bytes]
+        try:
+            self._write(value, out, budget, 0, set())
+        except _OutOfBudget:
+            return ''.join(out)[:self.max_bytes] + '...(truncated)'
+
+        return ''.join(out)
+
+    @staticmethod
+    def _append(text: str, out: List[str], budget: List[int]):
+        """
+        Adds text to the output, and stops the walk if we are over budget.
+        """
+        out.append(text)
+        budget[0] -= len(text)
+        if budget[0] < 0:
+            raise _OutOfBudget()
+
+    def _write(self, value: Any, out: List[str], budget: List[int], depth: int, path_ids: Set[int]):
+        """
+        Writes a value, going into the containers.
+        :param value: The value to write.
+        :param out: The output parts.
+        :param budget: How many characters we have left, in a list so that we can change it.
+        :param depth: How deep we are in the containers.
+        :param path_ids: The ids of the containers we are in, to detect cycles.
+        """
+        append = self._append
+        value_class = value.__class__
+        if value_class in _SCALAR_TYPES:
+            append(repr(value) if value_class is str else str(value), out, budget)
+            return
+        if isinstance(value, Mapping):
+            opening, closing, items = '{', '}', value.items()
+        elif isinstance(value, list):
+            opening, closing, items = '[', ']', value
+        elif isinstance(value, tuple):
+            opening, closing, items = '(', ',)' if len(value) == 1 else ')', value
+        elif isinstance(value, (set, frozenset)):
+            if not value:
+                append(f"{type(value).__name__}()", out, budget)
+                return
+            opening, closing, items = '{', '}', value
+        else:
+            append(self.encode_leaf(value), out, budget)
+            return
+
+        value_id = id(value)
+        if value_id in path_ids:
+            append('<cycle>', out, budget)
+            return
+        if depth >= self.max_depth:
+            append(opening + '...' + closing, out, budget)
+            return
+
+        path_ids.add(value_id)
+        append(opening, out, budget)
+        is_mapping = opening == '{' and isinstance(value, Mapping)
+        for index, item in enumerate(items):
+            if index >= self.max_items:
+                append(f", ...(+{len(value) - index} items)", out, budget)
+                break
+            if index:
+                append(', ', out, budget)
+            if is_mapping:
+                item_key, item_value = item
+                append(self.encode_leaf(item_key), out, budget)
+                append(': ', out, budget)
+                self._write(item_value, out, budget, depth + 1, path_ids)
+            else:
+                self._write(item, out, budget, depth + 1, path_ids)
+        append(closing, out, budget)
+        path_ids.discard(value_id)
+
+    @staticmethod
+    def encode_leaf(value: Any) -> str:
+        """
+        Encodes a value that is not a container:  strings and bytes with their repr (so you can see where they end),
+        dates in ISO format, and everything else with str().
+        :param value: The value.
+        :return: The text.
+        """
+        if isinstance(value, (str, bytes)):
+            return repr(value)
+        if isinstance(value, (datetime.date, datetime.time)):
+            return value.isoformat()
+        return str(value)
@@ -0,0 +1,214 @@
+"""
+Watches the logger TOML config file, so that you can hot-change the log levels (and dispatchers) of a running
+application without restarting it.  We check the modification time and size of the file on every tick, and only read
+and hash the file when those changed.  We only parse the TOML when the content actually changed.
+"""
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional, Tuple, Union
+
+import tomli
+
+
+class ReloadMetrics:
+    """
+    Some numbers about the config reloads, so that you can see how often (and how fast) we reloaded.
+    """
+
+    """
+    How many times the config was reloaded and applied.
+    """
+    reload_count: int = 0
+
+    """
+    How many times a changed config could not be read or applied.  The previous config is kept when that happens.
+    """
+    failed_reload_count: int = 0
+
+    """
+    How long the last reload took, from reading the file to publishing the new dispatchers, in seconds.
+    """
+    last_reload_seconds: float = 0.0
+
+    """
+    How many dispatchers were rebuilt by the last reload.  Dispatchers whose section did not change are kept.
+    """
+    last_dispatchers_rebuilt: int = 0
+
+    """
+    How many dispatchers were rebuilt, over all the reloads.
+    """
+    total_dispatchers_rebuilt: int = 0
+
+    """
+    The error of the last failed reload, if any.
+    """
+    last_error: Optional[BaseException] = None
+
+    def __str__(self):
+        """
+        String representation for debugging.
+        :return: The reload numbers.
+        """
+        return f"reloads={self.reload_count} failed={self.failed_reload_count} " \
+               f"last_reload_seconds={self.last_reload_seconds:.6f} " \
+               f"last_dispatchers_rebuilt={self.last_dispatchers_rebuilt}"
+
+
+def get_file_signature(config_path: Path) -> Optional[Tuple[int, int]]:
+    """
+    The cheap part of the change check, the modification time and the size of the file.
+    :param config_path: The config file path.
+    :return: (mtime in ns, size), or None if the file is gone.
+    """
+    try:
+        stat = os.stat(config_path)
+    except OSError:
+        return None
+
+    return stat.st_mtime_ns, stat.st_size
+
+
+def read_config_file(config_path: Path) -> Tuple[dict, Optional[Tuple[int, int]], bytes]:
+    """
+    Reads and parses the TOML config file.
+    :param config_path: The config file path.
+    :return: The config, the file signature that was read, and the digest of the content.
+    """
+    signature = get_file_signature(config_path)
+
+    #
+    # We use 'rb' with no encoding, in case that other encodings are used for the config file.  Apparently,
+    # tomli is able to handle this.  I hope its not just utf-8 or ascii.
+    #
+    with open(config_path, "rb") as f:
+        raw = f.read()
+
+    return tomli.loads(raw.decode()), signature, hashlib.sha1(raw).digest()
+
+
+class ConfigWatcher:
+    """
+    A background thread that checks the config file every few seconds and calls back with the new config when it
+    changed.
+    """
+
+    """
+    The config file we are watching.
+    """
+    config_path: Path
+
+    """
+    How often we check the file, in seconds.
+    """
+    interval_seconds: float
+
+    """
+    Called with the newly parsed config when the content of the file changed.
+    """
+    on_change: Callable[[dict], None]
+
+    """
+    Called with the exception when the changed file could not be parsed, or on_change failed.
+    """
+    on_error: Optional[Callable[[BaseException], None]]
+
+    """
+    The modification time and size from the last check.
+    """
+    _signature: Optional[Tuple[int, int]]
+
+    """
+    The digest of the content we last applied.
+    """
+    _digest: Optional[bytes]
+
+    def __init__(self, config_path: Union[Path, str], interval_seconds: float, on_change: Callable[[dict], None],
+                 on_error: Optional[Callable[[BaseException], None]] = None):
+        """
+        Constructor for the watcher.  Call start() to start watching.
+        :param config_path: The config file we are watching.
+        :param interval_seconds: How often we check the file, in seconds.
+        :param on_change: Called with the newly parsed config when the content of the file changed.
+        :param on_error: Called with the exception when the changed file could not be parsed, or on_change failed.
+        """
+        self.config_path = Path(config_path)
+        self.interval_seconds = interval_seconds
+        self.on_change = on_change
+        self.on_error = on_error
+        self._signature = None
+        self._digest = None
+        self._check_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def prime(self, signature: Optional[Tuple[int, int]], digest: bytes):
+        """
+        Tells the watcher what was already loaded, so that it does not reload it on the first check.
+        :param signature: The file signature of the loaded file.
+        :param digest: The digest of the loaded content.
+        """
+        self._signature = signature
+        self._digest = digest
+
+    def check_now(self) -> bool:
+        """
+        Checks the file once.  The stat is cheap, we only read the file if the modification time or the size changed,
+        and only parse it if the content changed (touching the file does not reload anything).  The watcher thread
+        and a caller of check_now() take turns, so a change is applied exactly once.
+        :return: True if the config changed and on_change was called.
+        """
+        with self._check_lock:
+            signature = get_file_signature(self.config_path)
+            if signature is None or signature == self._signature:
+                return False
+
+            try:
+                with open(self.config_path, "rb") as f:
+                    raw = f.read()
+                self._signature = signature
+                digest = hashlib.sha1(raw).digest()
+                if digest == self._digest:
+                    return False
+
+                config = tomli.loads(raw.decode())
+                self._digest = digest
+                self.on_change(config)
+            except Exception as ex:
+                if self.on_error:
+                    self.on_error(ex)
+                return False
+
+            return True
+
+    def start(self):
+        """
+        Starts the background thread.  It is a daemon thread, it will not keep your application alive.
+        """
+        if self._thread:
+            return
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='alienprobe-config-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = True):
+        """
+        Stops the background thread, and waits for it.
+        :param wait: Wait for the thread to end.  Pass False from on_change:  the thread may be waiting for the check
+        that called us to finish.
+        """
+        self._stop_event.set()
+        if wait and self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        """
+        The watcher thread, checks the file every interval until we are stopped.
+        """
+        while not self._stop_event.wait(self.interval_seconds):
+            self.check_now()
@@ -0,0 +1,175 @@
+"""
+The base of the dispatchers that write from the event loop, with coroutines:  a network sink can then use asyncio
+streams, and thousands of slow writes cost no threads.  Its write_messages is a coroutine, which the loop writer of
+the logger awaits (see AlienLogger.start_loop_writer()):
+
+    class MyStreamDispatcher(AsyncBaseDispatcher):
+        def config_dispatcher(self, config: dict):
+            self.host, self.port = config['host'], int(config['port'])
+            self.compiled_format = self.compile_message_format(message_format='[[LOG_MESSAGE_STATIC]] [[LOG_PARAMS]]',
+                                                               exception_format='', datetime_format='', log_utc=True)
+            self.writer = None
+
+        async def write_messages(self, batch) -> int:
+            if self.writer is None:
+                _, self.writer = await asyncio.open_connection(self.host, self.port)
+            self.writer.write(''.join(self.compiled_format.render(msg) + '\\n' for msg in batch).encode())
+            await self.writer.drain()
+            return len(batch)
+
+The synchronous paths (the writer thread of the async mode, a ring buffer in front of it...) schedule the coroutine
+on the loop the dispatcher was bound to, and never wait for it.
+"""
+import asyncio
+import sys
+from abc import abstractmethod
+from typing import Optional, Sequence, Set
+
+from alienprobe.dispatchers.base_dispatcher import BaseDispatcher
+from alienprobe.message import Message
+
+
+def running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    """
+    The event loop running on this thread.
+    :return: The loop, or None if we are not on an event loop.
+    """
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class AsyncBaseDispatcher(BaseDispatcher):
+    """
+    A dispatcher whose writes are coroutines, run on an event loop.
+    """
+
+    """
+    The event loop the coroutines run on.  The loop writer binds it when it starts, until then the messages written
+    from synchronous code are dropped.
+    """
+    loop: Optional[asyncio.AbstractEventLoop] = None
+
+    """
+    How many messages we dropped, because no loop was bound (or it was closed).
+    """
+    dropped_count: int = 0
+
+    """
+    How many scheduled writes raised an exception.
+    """
+    error_count: int = 0
+
+    """
+    How long (in seconds) flush() and close() wait for the loop, when called from another thread.
+    """
+    flush_timeout_seconds: float = 10
+
+    @abstractmethod
+    async def write_messages(self, batch: Sequence[Message]) -> int:
+        """
+        Writes a batch of messages, in order, from the event loop.  Override it.
+        :param batch: The messages to write.
+        :return: How many messages were written.
+        """
+        pass
+
+    async def aflush(self):
+        """
+        Writes out anything this dispatcher is holding in a buffer, from the event loop.  The default does nothing.
+        """
+        pass
+
+    async def aclose(self):
+        """
+        Releases the connections of the dispatcher, from the event loop.  The default just flushes.
+        """
+        await self.aflush()
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        """
+        Sets the event loop that runs the writes scheduled from synchronous code.
+        :param loop: The event loop.
+        """
+        self.loop = loop
+        self._tasks: Set[asyncio.Task] = set()
+
+    def write_message(self, message_object: Message) -> bool:
+        """
+        Schedules the write of a message on the event loop.
+        :param message_object: The log message values we need to write.
+        :return: True if the write was scheduled.
+        """
+        return self.submit_messages([message_object]) == 1
+
+    def submit_messages(self, batch: Sequence[Message]) -> int:
+        """
+        Schedules write_messages on the event loop, from any thread.  We don't wait for it.
+        :param batch: The messages to write.
+        :return: How many messages were scheduled.
+        """
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            self.dropped_count += len(batch)
+            return 0
+
+        batch = list(batch)
+        if running_loop() is loop:
+            task = loop.create_task(self.write_messages(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._write_done)
+        else:
+            asyncio.run_coroutine_threadsafe(self.write_messages(batch), loop).add_done_callback(self._write_done)
+        return len(batch)
+
+    def flush(self):
+        """
+        Runs aflush() on the event loop, and waits for it, unless we are on the loop ourselves (we can't block it).
+        """
+        self._run_on_loop(self.aflush())
+
+    def close(self):
+        """
+        Runs aclose() on the event loop, and waits for it, unless we are on the loop ourselves (it is then scheduled).
+        """
+        self._run_on_loop(self.aclose())
+
+    def _write_done(self, future):
+        """
+        Counts (and reports on stderr) a scheduled write that failed.  It can't go through the logger, it would land
+        on this very dispatcher.
+        """
+        if isinstance(future, asyncio.Task):
+            self._tasks.discard(future)
+        if future.cancelled():
+            return
+        ex = future.exception()
+        if ex is not None:
+            self.error_count += 1
+            print(f"alienprobe: dispatcher {type(self).__name__} failed on the event loop: {ex!r}", file=sys.stderr)
+
+    def _run_on_loop(self, coroutine):
+        """
+        Runs a coroutine on the bound loop, and waits for it when we are on another thread.  Once the loop has
+        stopped, there is nothing left to run it.
+        """
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            coroutine.close()
+            return
+
+        if running_loop() is loop:
+            task = loop.create_task(coroutine)
+            self._tasks.add(task)
+            task.add_done_callback(self._write_done)
+        elif loop.is_running():
+            future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+            try:
+                future.result(timeout=self.flush_timeout_seconds)
+            except Exception as ex:
+                self.error_count += 1
+                print(f"alienprobe: dispatcher {type(self).__name__} failed on the event loop: {ex!r}",
+                      file=sys.stderr)
+        else:
+            coroutine.close()
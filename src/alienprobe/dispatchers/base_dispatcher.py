@@ -1,9 +1,11 @@
-import datetime
-import traceback
+import importlib
 from abc import ABC, abstractmethod
+from typing import Sequence
 
-from alienprobe.log_levels import LogLevel
+from alienprobe.compact_encoder import CompactEncoder
+from alienprobe.dispatchers.message_template import CompiledMessageFormat
 from alienprobe.message import Message
+from alienprobe.serializers import create_dispatcher_serializers
 
 
 class BaseDispatcher(ABC):
@@ -11,6 +13,43 @@ class BaseDispatcher(ABC):
     A base logger for all loggers, and provides the methods that you have to overload.
     """
 
+    """
+    The formats we already compiled, by (message_format, exception_format, datetime_format, log_utc).  Shared by
+    the class until a dispatcher compiles its first format.
+    """
+    _compiled_formats: dict = {}
+
+    """
+    In the async mode, the most messages we hand to write_messages in one call.  Set with batch_size in the
+    dispatcher section of the config.
+    """
+    batch_size: int = 100
+
+    """
+    In the async mode, how long (in milliseconds) the writer thread may hold messages to fill up a batch, before it
+    writes a partial one.  0 writes whatever is queued right away.  Set with max_batch_latency_ms in the dispatcher
+    section of the config.
+    """
+    max_batch_latency_ms: float = 0
+
+    """
+    How deep we render nested dicts and lists in the params, below that they show as '{...}'.  Set with
+    param_max_depth in the dispatcher section of the config.
+    """
+    param_max_depth: int = 4
+
+    """
+    How many items we render per dict or list in the params, the rest shows as '...(+123 items)'.  Set with
+    param_max_items in the dispatcher section of the config.
+    """
+    param_max_items: int = 100
+
+    """
+    The most characters we render for one dict or list param, past that it is cut with '...(truncated)'.  Set with
+    param_max_bytes in the dispatcher section of the config.
+    """
+    param_max_bytes: int = 4096
+
     @abstractmethod
     def config_dispatcher(self, config: dict):
         """
@@ -31,11 +70,102 @@ class BaseDispatcher(ABC):
         """
         pass
 
+    def write_messages(self, batch: Sequence[Message]) -> int:
+        """
+        Writes a batch of messages, in order.  The default just calls write_message for each one, override it if
+        your resource can do better with a bulk write (one syscall, one network round trip, one insert...).
+        In the async mode the writer thread groups the messages per dispatcher (see batch_size and
+        max_batch_latency_ms), in the synchronous mode every message is a batch of one.
+        :param batch: The messages to write.
+        :return: How many messages were written.
+        """
+        written = 0
+        for message_object in batch:
+            if self.write_message(message_object=message_object):
+                written += 1
+
+        return written
+
+    def submit_messages(self, batch: Sequence[Message]) -> int:
+        """
+        Hands a batch to the dispatcher from synchronous code, like the writer thread of the async mode.  For a
+        plain dispatcher this is write_messages, an AsyncBaseDispatcher schedules its coroutine on its event loop.
+        :param batch: The messages to write.
+        :return: How many messages were written (or scheduled).
+        """
+        return self.write_messages(batch)
+
+    def config_batching(self, config: dict):
+        """
+        Reads the batching settings (batch_size, max_batch_latency_ms) from the section of the dispatcher.  The
+        logger calls this before config_dispatcher, so you don't have to.
+        :param config: The configuration that we are using for this dispatcher.
+        """
+        self.batch_size = int(config.get('batch_size', self.batch_size))
+        self.max_batch_latency_ms = float(config.get('max_batch_latency_ms', self.max_batch_latency_ms))
+        if self.batch_size < 1:
+            raise ValueError(f"The batch_size of dispatcher {type(self).__name__} must be at least 1, "
+                             f"was {self.batch_size}")
+
+    def config_param_limits(self, config: dict):
+        """
+        Reads the limits of the dict and list params (param_max_depth, param_max_items, param_max_bytes) from the
+        section of the dispatcher.  The logger calls this before config_dispatcher, so you don't have to.
+        :param config: The configuration that we are using for this dispatcher.
+        """
+        self.param_max_depth = int(config.get('param_max_depth', self.param_max_depth))
+        self.param_max_items = int(config.get('param_max_items', self.param_max_items))
+        self.param_max_bytes = int(config.get('param_max_bytes', self.param_max_bytes))
+
+    def create_compact_encoder(self) -> CompactEncoder:
+        """
+        Creates the encoder of the dict and list params, with the limits of this dispatcher.
+        :return: The encoder.
+        """
+        return CompactEncoder(max_depth=self.param_max_depth, max_items=self.param_max_items,
+                              max_bytes=self.param_max_bytes)
+
+    def flush(self):
+        """
+        Writes out anything this dispatcher is holding in a buffer.  Called by AlienLogger.flush() and on shutdown.
+        The default does nothing, override it if your dispatcher buffers.
+        """
+        pass
+
+    def close(self):
+        """
+        Called when the dispatcher is not used anymore, because the config was reloaded without it, or the logger
+        was shut down.  Release your files, sockets and threads here.  The default just flushes.
+        """
+        self.flush()
+
+    def compile_message_format(self, message_format: str, exception_format: str, datetime_format: str,
+                               log_utc: bool) -> CompiledMessageFormat:
+        """
+        Compiles the formats once, so that formatting a message is a single join.  Call this in config_dispatcher,
+        and render with the returned object (or just call format_message, which finds the compiled format again).
+        :param message_format: The format of how we want the log to output.
+        :param exception_format: What we append to the message_format when there is an exception.
+        :param datetime_format: The strftime format of the [[DATE_STRING]] token.
+        :param log_utc: Do we render the date in UTC, or in the local time zone.
+        The dict and list params are rendered within the param limits of the dispatcher (see config_param_limits).
+        :return: The compiled format.
+        """
+        serializers = create_dispatcher_serializers(datetime_format=datetime_format,
+                                                    compact_encoder=self.create_compact_encoder())
+        compiled_format = CompiledMessageFormat(message_format=message_format, exception_format=exception_format,
+                                                datetime_format=datetime_format, log_utc=log_utc,
+                                                serializers=serializers)
+        if '_compiled_formats' not in self.__dict__:
+            self._compiled_formats = {}
+        self._compiled_formats[(message_format, exception_format, datetime_format, log_utc)] = compiled_format
+        return compiled_format
+
     def format_message(self, message_object: Message, datetime_format: str, log_utc: bool,
                        message_format: str, exception_format: str):
         """
-        Using the common tokens below, format the message according to the format runes.  Basically just does some
-        string replaces on the message format of your choosing.
+        Using the common tokens below, format the message according to the format runes.  The formats are compiled
+        the first time we see them (see compile_message_format), after that this is a single join.
         [[INSTANCE_ID]] This is a unique number created once per process (if you use the global
         logger) or once per logger instance.  This is VERY useful when debugging clustered environments, as you can
         do a where clause in the downstream system and see the log of the exact node that did the processing, ignoring
@@ -61,60 +191,33 @@ class BaseDispatcher(ABC):
         :param exception_format: The format of how we want to output the exception should it exist.
         """
 
-        msg = message_format
-
-        ex: BaseException = message_object.ex
-        if ex:
-            msg += exception_format
-            ex_text = ''
-            for ex_str in traceback.format_exception(value=ex):
-                ex_text += ex_str + '\n'
-
-            msg = msg.replace('[[EXCEPTION_TEXT]]', ex_text )
-        #message_format = 'class=[[CLASS_NAME]] date="[[DATE_STRING]]" level="[[LOG_LEVEL]]" message="[[LOG_MESSAGE_STATIC]]" [[LOG_PARAMS]]'
-
-        cls_name = message_object.class_name
-        if not isinstance(cls_name, str ):
-            cls_name = str(type(cls_name))
-
-        msg = msg.replace('[[CLASS_NAME]]', cls_name)
-
-        #
-        # Format Date according to the date format passed in as a parameter.
-        #
-        log_date = datetime.datetime.now()
-        if log_utc:
-            log_date = datetime.datetime.utcnow()
+        compiled_format = self._compiled_formats.get((message_format, exception_format, datetime_format, log_utc))
+        if not compiled_format:
+            compiled_format = self.compile_message_format(message_format=message_format,
+                                                          exception_format=exception_format,
+                                                          datetime_format=datetime_format, log_utc=log_utc)
 
-        if not datetime_format:
-            raise ValueError("No Valid datetime_format configured in the configuration file.  Was None.")
+        return compiled_format.render(message_object)
 
-        curtime_str = log_date.strftime(datetime_format)
-        msg = msg.replace('[[DATE_STRING]]', curtime_str)
-        msg = msg.replace('[[LOG_LEVEL]]', message_object.level.name)
-        msg = msg.replace('[[LOG_MESSAGE_STATIC]]', message_object.message_static)
-        msg = msg.replace('[[INSTANCE_ID]]', message_object.instance_id)
-        msg = msg.replace('[[MACHINE_NAME]]', message_object.machine_name)
 
-        if not message_object.params:
-            message_object.params = {}
-
-        params_msg = ''
-        for param_key, param_val in message_object.params.items():
-            params_msg += str(param_key) + '='
-
-            if isinstance(param_val, datetime.datetime):
-                date_str = param_val.strftime(message_format)
-                param_val_str = f'"{str(date_str)}"'
-            elif isinstance(param_val, int) or isinstance(param_val, float):
-                param_val_str = str(param_val)
-            elif isinstance(param_val, dict):
-                import pprint
-                param_val_str = f'"{pprint.pformat(param_val)}"'
-            else:
-                param_val_str = f'"{str(param_val)}"'
-            params_msg += param_val_str + ' '
-
-        msg = msg.replace('[[LOG_PARAMS]]', params_msg.strip())
-
-        return msg
+def create_dispatcher(dispatcher_name: str, dispatcher_config: dict) -> BaseDispatcher:
+    """
+    Instantiates and configures a dispatcher from its section of the config.  The logger builds its dispatchers with
+    this, and so can the dispatchers that wrap another one.
+    :param dispatcher_name: The name of the section, for the errors.
+    :param dispatcher_config: The section, with the dotted dispatcher_class_name of the dispatcher.
+    :return: The configured dispatcher.
+    """
+    dispatcher_cls_name = dispatcher_config.get('dispatcher_class_name')
+    if not dispatcher_cls_name:
+        raise ValueError(f'Dispatcher {dispatcher_name} does not have a class name entry in config '
+                         f'(dispatcher_class_name)")')
+
+    module_name, class_name = dispatcher_cls_name.rsplit(".", 1)
+    MyDispatcher = getattr(importlib.import_module(module_name), class_name)
+    dispatcher_instance = MyDispatcher()
+    dispatcher_instance: BaseDispatcher
+    dispatcher_instance.config_batching(config=dispatcher_config)
+    dispatcher_instance.config_param_limits(config=dispatcher_config)
+    dispatcher_instance.config_dispatcher(config=dispatcher_config)
+    return dispatcher_instance
@@ -0,0 +1,143 @@
+"""
+The dispatcher of a worker process:  it sends the messages, unformatted, to the collector of the parent process (see
+alienprobe.collector), which writes them with its own dispatchers.  The logger of a worker uses it on its own, when
+the parent started a collector, there is nothing to configure.  To send to a collector explicitly:
+
+    [common]
+    dispatchers = ['collector']
+
+    [collector]
+    dispatcher_class_name = 'alienprobe.dispatchers.collector_dispatcher.CollectorDispatcher'
+    socket_path = '/run/myapp/alienprobe.sock'
+"""
+import os
+import socket
+import threading
+import time
+from typing import Optional, Sequence
+
+from alienprobe.collector import encode_message
+from alienprobe.dispatchers.base_dispatcher import BaseDispatcher
+from alienprobe.message import Message
+
+
+class CollectorDispatcher(BaseDispatcher):
+    """
+    Sends the messages to a collector, over its Unix domain socket.
+    """
+
+    """
+    The Unix domain socket of the collector.
+    """
+    socket_path: str
+
+    """
+    When the collector can't be reached, we wait this long before we try to connect again, the messages in between
+    are dropped.
+    """
+    reconnect_interval_seconds: float = 1.0
+
+    """
+    How many messages we sent.
+    """
+    sent_count: int = 0
+
+    """
+    How many messages we dropped, because the collector could not be reached.
+    """
+    dropped_count: int = 0
+
+    def config_dispatcher(self, config: dict):
+        """
+        We pass in the section of the dispatcher from the toml config file.  This is used to configure the logger,
+        and learn more about how to set itself up.  Like target ip addresses, etc.
+        :param config: The configuration that we are using for this logger.
+        """
+        self.socket_path = config.get('socket_path')
+        if not self.socket_path:
+            raise ValueError("The collector dispatcher needs the socket_path of the collector.")
+        self.reconnect_interval_seconds = float(config.get('reconnect_interval_seconds', 1.0))
+
+        self._lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self._sock_pid = 0
+        self._next_connect = 0.0
+
+    def write_message(self, message_object: Message) -> bool:
+        """
+        Base method that writes a message to whatever resource you are writing messages to.  Like files, whatever.
+        :param message_object: The log message values we need to write.
+        :return: True if the message was written.
+        """
+        return self.write_messages([message_object]) == 1
+
+    def write_messages(self, batch: Sequence[Message]) -> int:
+        """
+        Encodes the batch outside of the lock, and sends it with a single sendall.  Once this returns, the messages
+        are in the kernel, and reach the collector even if this process dies.
+        :param batch: The messages to write.
+        :return: How many messages were sent.
+        """
+        data = b''.join([encode_message(message_object) for message_object in batch])
+
+        with self._lock:
+            sock = self._connect()
+            if sock is None:
+                self.dropped_count += len(batch)
+                return 0
+            try:
+                sock.sendall(data)
+            except OSError:
+                #
+                # The collector is gone, or went away in the middle of the batch.  It drops a frame cut short when
+                # we close, so the batch is lost as a whole.
+                #
+                self._disconnect()
+                self.dropped_count += len(batch)
+                return 0
+
+            self.sent_count += len(batch)
+        return len(batch)
+
+    def close(self):
+        """
+        Closes the connection, the collector reads what we sent before it sees the end of the stream.
+        """
+        with self._lock:
+            self._disconnect()
+
+    def _connect(self) -> Optional[socket.socket]:
+        """
+        The connection to the collector, opened on the first write.  A forked child opens its own, it never writes to
+        the connection of its parent.  The caller holds the lock.
+        :return: The connected socket, or None if the collector can't be reached right now.
+        """
+        pid = os.getpid()
+        if self._sock is not None and self._sock_pid == pid:
+            return self._sock
+        self._sock = None
+
+        now = time.monotonic()
+        if now < self._next_connect:
+            return None
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            self._next_connect = now + self.reconnect_interval_seconds
+            return None
+
+        self._sock = sock
+        self._sock_pid = pid
+        return sock
+
+    def _disconnect(self):
+        """
+        Closes the connection, if this process opened it.  The caller holds the lock.
+        """
+        sock = self._sock
+        self._sock = None
+        if sock is not None and self._sock_pid == os.getpid():
+            sock.close()
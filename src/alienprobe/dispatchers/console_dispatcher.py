@@ -1,7 +1,14 @@
 """
 A dispatcher that writes log messages to STDOUT.
 """
+import atexit
+import sys
+import threading
+import time
+from typing import Optional, Sequence
+
 from alienprobe.dispatchers.base_dispatcher import BaseDispatcher
+from alienprobe.dispatchers.message_template import CompiledMessageFormat
 from alienprobe.log_levels import LogLevels, LogLevel
 from alienprobe.message import Message
 
@@ -86,6 +93,37 @@ class ConsoleDispatcher(BaseDispatcher):
     """
     exception_format = 'exception="\n[[EXCEPTION_TEXT]]"'
 
+    """
+    The message_format and exception_format, compiled once in config_dispatcher.
+    """
+    compiled_format: CompiledMessageFormat
+
+    """
+    Do we buffer the output in memory, instead of writing every batch right away.  Under load, this saves a write
+    syscall (and the stdout contention between workers) per message.
+    """
+    buffered: bool = False
+
+    """
+    When buffered, we write out the buffer once it holds this many bytes.
+    """
+    buffer_size_bytes: int = 64 * 1024
+
+    """
+    When buffered, we write out the buffer once it has been sitting there for this many milliseconds.
+    """
+    buffer_flush_interval_ms: float = 1000
+
+    """
+    When buffered, a message at this level or above writes out the buffer right away, so you never wait for an error.
+    """
+    buffer_flush_level: LogLevel = LogLevels.ERROR
+
+    """
+    Set to stop the flusher thread of the buffered mode, None when we are not buffered.
+    """
+    _flusher_stop: Optional[threading.Event] = None
+
     def config_dispatcher(self, config: dict):
         """
         We pass in the section of the dispatcher from the toml config file.  This is used to configure the logger,
@@ -104,24 +142,160 @@ class ConsoleDispatcher(BaseDispatcher):
                                          '[[LOG_PARAMS]]'
                                          )
         self.exception_format = config.get('exception_format', 'exception="\n[[EXCEPTION_TEXT]]"')
+        self.compiled_format = self.compile_message_format(message_format=self.message_format,
+                                                           exception_format=self.exception_format,
+                                                           datetime_format=self.datetime_format,
+                                                           log_utc=self.log_utc_timezone)
+
+        self.buffered = bool(config.get('buffered', False))
+        self.buffer_size_bytes = int(config.get('buffer_size_bytes', 64 * 1024))
+        self.buffer_flush_interval_ms = float(config.get('buffer_flush_interval_ms', 1000))
+        flush_level_name = config.get('buffer_flush_level', 'error')
+        self.buffer_flush_level = LogLevels().get_level_by_name(flush_level_name)
+        if not self.buffer_flush_level:
+            raise ValueError(f"Unknown buffer_flush_level '{flush_level_name}' for the console dispatcher.")
+
+        #
+        # Encode the colour codes once, the buffered path works in bytes all the way to the stdout buffer.
+        #
+        self._encoded_prefixes = {}
+        self._encoded_reset = b''
+        if self.colorize_messages:
+            self._encoded_prefixes = {level.level_id: code.encode() for level, code in self.color_mappings.items()}
+            self._encoded_reset = self.ascii_colour_codes['reset'].encode()
+
+        if self.buffered:
+            self._output = getattr(sys.stdout, 'buffer', None)
+            if self._output is None:
+                raise ValueError("The buffered console dispatcher needs a binary sys.stdout.buffer to write to.")
+            self._buffer = bytearray()
+            self._buffer_lock = threading.Lock()
+            self._last_flush_time = time.monotonic()
+            self._flusher_stop = threading.Event()
+            threading.Thread(target=self._run_flusher, args=(self._flusher_stop,), name='alienprobe-console-flusher',
+                             daemon=True).start()
+            atexit.register(self.flush)
 
     def write_message(self, message_object: Message) -> bool:
         """
         Base method that writes a message to whatever resource you are writing messages to.  Like files, whatever.
-        :param level: The log level that we are writing at.
-        :param message_object: The log message values we need to write.  If you just want a standard render,
-        just call the format_message call in the base class.
+        :param message_object: The log message values we need to write.
         :return: True if the message was written.
         """
-        message: str = super().format_message(message_object=message_object,
-                                              datetime_format=self.datetime_format,
-                                              log_utc=self.log_utc_timezone, message_format=self.message_format,
-                                              exception_format=self.exception_format)
+        return self.write_messages([message_object]) == 1
+
+    def write_messages(self, batch: Sequence[Message]) -> int:
+        """
+        Writes a batch of messages to stdout.  Unbuffered, that is a single write and a single flush per batch,
+        instead of a flushing print per line.  Buffered, the lines go to the buffer (see write_buffered).
+        :param batch: The messages to write.
+        :return: How many messages were written.
+        """
+        if not batch:
+            return 0
+
+        if self.buffered:
+            return self.write_buffered(batch)
+
+        lines = [self.render_line(message_object) for message_object in batch]
+        lines.append('')
+        sys.stdout.write('\n'.join(lines))
+        sys.stdout.flush()
+        return len(batch)
+
+    def write_buffered(self, batch: Sequence[Message]) -> int:
+        """
+        Renders the batch to bytes, with the colour codes we encoded once, and adds it to the buffer.  The buffer
+        is written out once it is bigger than buffer_size_bytes, older than buffer_flush_interval_ms, or as soon as a
+        message at buffer_flush_level (or above) comes in.
+        :param batch: The messages to write.
+        :return: How many messages were written.
+        """
+        render = self.compiled_format.render
+        prefixes = self._encoded_prefixes
+        reset = self._encoded_reset
+        flush_level_id = self.buffer_flush_level.level_id
+
+        chunks = []
+        flush_now = False
+        for message_object in batch:
+            level_id = message_object.level.level_id
+            prefix = prefixes.get(level_id)
+            if prefix:
+                chunks.append(prefix)
+                chunks.append(render(message_object).encode())
+                chunks.append(reset)
+            else:
+                chunks.append(render(message_object).encode())
+            chunks.append(b'\n')
+            if level_id >= flush_level_id:
+                flush_now = True
+
+        with self._buffer_lock:
+            self._buffer += b''.join(chunks)
+            if flush_now or len(self._buffer) >= self.buffer_size_bytes \
+                    or time.monotonic() - self._last_flush_time >= self.buffer_flush_interval_ms / 1000:
+                self._flush_buffer()
+
+        return len(batch)
+
+    def flush(self):
+        """
+        Writes out whatever is in the buffer.
+        """
+        if not self.buffered:
+            return
+
+        with self._buffer_lock:
+            self._flush_buffer()
+
+    def close(self):
+        """
+        Writes out the buffer, and stops the flusher thread.  Anything written after this goes straight to stdout.
+        """
+        if not self.buffered:
+            return
+
+        self._flusher_stop.set()
+        atexit.unregister(self.flush)
+        with self._buffer_lock:
+            self._flush_buffer()
+            self.buffered = False
+
+    def _flush_buffer(self):
+        """
+        Writes the buffer to stdout.  The caller holds the buffer lock.  We flush the text layer of sys.stdout first,
+        so that a print() that happened before our messages still comes out before them.
+        """
+        self._last_flush_time = time.monotonic()
+        if not self._buffer:
+            return
+
+        sys.stdout.flush()
+        self._output.write(self._buffer)
+        self._output.flush()
+        self._buffer.clear()
+
+    def _run_flusher(self, stop_event: threading.Event):
+        """
+        The flusher thread, writes out the buffer when it has been sitting there for buffer_flush_interval_ms.
+        :param stop_event: Set when the dispatcher is closed.
+        """
+        interval = self.buffer_flush_interval_ms / 1000
+        while not stop_event.wait(interval):
+            with self._buffer_lock:
+                if self._buffer and time.monotonic() - self._last_flush_time >= interval:
+                    self._flush_buffer()
+
+    def render_line(self, message_object: Message) -> str:
+        """
+        Formats a message, and adds the colour of its level if we colorize.
+        :param message_object: The log message values we need to render.
+        :return: The line, without the line feed.
+        """
+        message: str = self.compiled_format.render(message_object)
         level = message_object.level
-        if level in self.color_mappings.keys():
-            msg = f"{self.color_mappings[level]}{message}{self.ascii_colour_codes['reset']}"
-            print(msg, flush=True)
-        else:
-            print(message, flush=True)
+        if self.colorize_messages and level in self.color_mappings.keys():
+            return f"{self.color_mappings[level]}{message}{self.ascii_colour_codes['reset']}"
 
-        return True
+        return message
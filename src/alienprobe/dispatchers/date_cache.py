@@ -0,0 +1,80 @@
+"""
+Formats the timestamps of the messages with a strftime format, without paying a full strftime for every message.
+At high message rates, most messages fall in the same second as the one before, so we format the second once and
+only splice in the microseconds.
+"""
+import datetime
+from typing import List, Tuple
+
+
+class DateFormatCache:
+    """
+    Formats timestamps with a strftime format, caching the formatted second.  Every dispatcher has its own cache,
+    since they all have their own datetime_format.  It is safe across threads, the cached second is replaced with a
+    single assignment.
+    """
+
+    """
+    The strftime format, like '%Y-%m-%d_%H:%M:%S.%f'
+    """
+    datetime_format: str
+
+    """
+    Do we format in UTC, or in the local time zone.
+    """
+    log_utc: bool
+
+    """
+    The format split around every %f.  None if the format has a '%%' in it, which we don't try to split, and we
+    fall back to a full strftime.
+    """
+    _format_parts: List[str]
+
+    """
+    The second we formatted last, and its formatted parts (to be joined with the microseconds).
+    """
+    _cached: Tuple[int, List[str]]
+
+    def __init__(self, datetime_format: str, log_utc: bool):
+        """
+        Constructor for the cache.
+        :param datetime_format: The strftime format.
+        :param log_utc: Do we format in UTC, or in the local time zone.
+        """
+        self.datetime_format = datetime_format
+        self.log_utc = log_utc
+        self._format_parts = None if '%%' in datetime_format else datetime_format.split('%f')
+        self._cached = (-1, [])
+
+    def to_datetime(self, seconds: int) -> datetime.datetime:
+        """
+        The (naive) datetime of a timestamp, in UTC or in local time.
+        :param seconds: Whole seconds since the epoch.
+        :return: The datetime.
+        """
+        if self.log_utc:
+            return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc).replace(tzinfo=None)
+
+        return datetime.datetime.fromtimestamp(seconds)
+
+    def format(self, timestamp_ns: int) -> str:
+        """
+        Formats a timestamp.
+        :param timestamp_ns: Nanoseconds since the epoch, like Message.timestamp_ns
+        :return: The formatted date.
+        """
+        seconds, nanoseconds = divmod(timestamp_ns, 1_000_000_000)
+        if self._format_parts is None:
+            when = self.to_datetime(seconds).replace(microsecond=nanoseconds // 1000)
+            return when.strftime(self.datetime_format)
+
+        cached_second, parts = self._cached
+        if cached_second != seconds:
+            when = self.to_datetime(seconds)
+            parts = [when.strftime(part) for part in self._format_parts]
+            self._cached = (seconds, parts)
+
+        if len(parts) == 1:
+            return parts[0]
+
+        return f"{nanoseconds // 1000:06d}".join(parts)
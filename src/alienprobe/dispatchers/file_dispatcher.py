@@ -0,0 +1,505 @@
+"""
+A dispatcher that appends the log messages to a file, and rotates it by size or by wall clock interval.  The file is
+kept open with a large buffer, so most messages cost no syscall at all.  Rotating is a rename and a reopen under the
+lock, the slow parts (compressing the rotated file, deleting the old ones) run on a background thread, so logging
+threads never wait for them.
+
+    app.log                        the file we write to
+    app.log.20240101-000000.gz     rotated, then compressed in the background
+    app.log.20231231-000000.gz     ...up to retention_count rotated files are kept
+
+With multi_process, several processes can share the same file, see FileDispatcher.multi_process.
+"""
+import atexit
+import datetime
+import gzip
+import lzma
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+from typing import List, Optional, Sequence
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from alienprobe.dispatchers.base_dispatcher import BaseDispatcher
+from alienprobe.dispatchers.message_template import CompiledMessageFormat
+from alienprobe.log_levels import LogLevels, LogLevel
+from alienprobe.message import Message
+
+
+"""
+The compressions we can run on the rotated files, and the suffix they add.
+"""
+COMPRESSIONS = {
+    'gzip': ('.gz', gzip.open),
+    'lzma': ('.xz', lzma.open),
+}
+
+
+class FileDispatcher(BaseDispatcher):
+    """
+    Appends the formatted messages to a file, with size and time based rotation.
+    """
+
+    """
+    The file we append to.  Its folder is created if it does not exist.
+    """
+    file_path: str
+
+    """
+    The size of the buffer in front of the file.  Messages are written out once it is full, every
+    flush_interval_ms, or right away for a message at flush_level (or above).
+    """
+    buffer_size_bytes: int = 1024 * 1024
+
+    """
+    How long (in milliseconds) a message may sit in the buffer before it is written out.
+    """
+    flush_interval_ms: float = 1000
+
+    """
+    A message at this level or above writes out the buffer right away, so an error is on disk before a crash.
+    """
+    flush_level: LogLevel = LogLevels.ERROR
+
+    """
+    Rotate the file once it is bigger than this.  0 never rotates on size.
+    """
+    rotate_max_bytes: int = 0
+
+    """
+    Rotate the file every this many seconds of wall clock time, on the boundaries of the interval (3600 rotates at
+    the top of every hour, 86400 at midnight UTC).  0 never rotates on time.
+    """
+    rotate_interval_seconds: int = 0
+
+    """
+    How many rotated files we keep, the older ones are deleted.  0 keeps them all.
+    """
+    retention_count: int = 7
+
+    """
+    Compress the rotated files with 'gzip' or 'lzma', in the background.  Empty to leave them as they are.
+    """
+    compression: str = ''
+
+    """
+    Several processes write to the same file (gunicorn or multiprocessing workers, each with their own logger).
+    The file is opened with O_APPEND, every flush is a single os.write of whole records, and the processes agree on
+    rotation through an fcntl lock on file_path + '.lock'.  Lines are never torn or lost, at the cost of a few more
+    syscalls per flush.  Unix only.
+    """
+    multi_process: bool = False
+
+    """
+    The strftime format of the [[DATE_STRING]] token.
+    """
+    datetime_format: str = '%Y-%m-%d_%H:%M:%S.%f'
+
+    """
+    Do we write the dates in UTC, or in the local time zone.
+    """
+    log_utc_timezone: bool = True
+
+    """
+    The format of every line, like the one of the console.
+    """
+    message_format: str = 'machine_name="[[MACHINE_NAME]]" date="[[DATE_STRING]]" level="[[LOG_LEVEL]]" ' \
+                          'message="[[LOG_MESSAGE_STATIC]]" [[LOG_PARAMS]]'
+
+    """
+    What we append to the message_format for messages with an exception.
+    """
+    exception_format: str = 'exception="\n[[EXCEPTION_TEXT]]"'
+
+    """
+    The message_format and exception_format, compiled once in config_dispatcher.
+    """
+    compiled_format: CompiledMessageFormat
+
+    """
+    Set to stop the flusher thread, None until we are configured.
+    """
+    _flusher_stop: Optional[threading.Event] = None
+
+    def config_dispatcher(self, config: dict):
+        """
+        We pass in the section of the dispatcher from the toml config file.  This is used to configure the logger,
+        and learn more about how to set itself up.  Like target ip addresses, etc.
+        :param config: The configuration that we are using for this logger.
+        """
+        self.file_path = config.get('file_path')
+        if not self.file_path:
+            raise ValueError("The file dispatcher needs a file_path to write to.")
+
+        self.buffer_size_bytes = int(config.get('buffer_size_bytes', 1024 * 1024))
+        self.flush_interval_ms = float(config.get('flush_interval_ms', 1000))
+        flush_level_name = config.get('flush_level', 'error')
+        self.flush_level = LogLevels().get_level_by_name(flush_level_name)
+        if not self.flush_level:
+            raise ValueError(f"Unknown flush_level '{flush_level_name}' for the file dispatcher.")
+
+        self.rotate_max_bytes = int(config.get('rotate_max_bytes', 0))
+        self.rotate_interval_seconds = int(config.get('rotate_interval_seconds', 0))
+        self.retention_count = int(config.get('retention_count', 7))
+        self.multi_process = bool(config.get('multi_process', False))
+        self.compression = config.get('compression', '') or ''
+        if self.compression and self.compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression '{self.compression}' for the file dispatcher, "
+                             f"use one of {sorted(COMPRESSIONS)}")
+
+        self.datetime_format = config.get('datetime_format', self.datetime_format)
+        self.log_utc_timezone = bool(config.get('log_utc_timezone', True))
+        self.message_format = config.get('message_format', self.message_format)
+        self.exception_format = config.get('exception_format', self.exception_format)
+        self.compiled_format = self.compile_message_format(message_format=self.message_format,
+                                                           exception_format=self.exception_format,
+                                                           datetime_format=self.datetime_format,
+                                                           log_utc=self.log_utc_timezone)
+
+        folder = os.path.dirname(os.path.abspath(self.file_path))
+        os.makedirs(folder, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._closed = False
+        self._file = None
+        self._fd = None
+        self._lock_fd = None
+        if self.multi_process:
+            if fcntl is None:
+                raise ValueError("The multi_process mode of the file dispatcher needs fcntl, which this platform "
+                                 "does not have.")
+            self._buffer = bytearray()
+            self._lock_fd = os.open(self.file_path + '.lock', os.O_WRONLY | os.O_CREAT, 0o644)
+        self._open_file()
+        self._last_flush_time = time.monotonic()
+
+        #
+        # The rotated files are compressed and pruned on their own thread, in the order they were rotated.
+        #
+        self._housekeeping = queue.Queue()
+        self._housekeeper = threading.Thread(target=self._run_housekeeper, name='alienprobe-file-housekeeper',
+                                             daemon=True)
+        self._housekeeper.start()
+
+        self._flusher_stop = threading.Event()
+        threading.Thread(target=self._run_flusher, args=(self._flusher_stop,), name='alienprobe-file-flusher',
+                         daemon=True).start()
+        atexit.register(self.flush)
+
+    def write_message(self, message_object: Message) -> bool:
+        """
+        Base method that writes a message to whatever resource you are writing messages to.  Like files, whatever.
+        :param message_object: The log message values we need to write.
+        :return: True if the message was written.
+        """
+        return self.write_messages([message_object]) == 1
+
+    def write_messages(self, batch: Sequence[Message]) -> int:
+        """
+        Renders the batch outside of the lock, and appends it to the file buffer.  The file is rotated first if it
+        is due.
+        :param batch: The messages to write.
+        :return: How many messages were written.
+        """
+        if not batch:
+            return 0
+
+        render = self.compiled_format.render
+        flush_level_id = self.flush_level.level_id
+        lines = []
+        flush_now = False
+        for message_object in batch:
+            lines.append(render(message_object))
+            if message_object.level.level_id >= flush_level_id:
+                flush_now = True
+        lines.append('')
+        data = '\n'.join(lines).encode()
+
+        with self._lock:
+            if self._closed:
+                return 0
+
+            if self.multi_process:
+                #
+                # Only whole records go in the buffer, and it is written with a single os.write, so the lines of
+                # the other processes can never end up in the middle of ours.
+                #
+                self._buffer += data
+                if flush_now or len(self._buffer) >= self.buffer_size_bytes:
+                    self._flush_file()
+                return len(batch)
+
+            if self._rotation_due(len(data)):
+                self._rotate()
+            self._file.write(data)
+            self._file_size += len(data)
+            if flush_now:
+                self._flush_file()
+
+        return len(batch)
+
+    def flush(self):
+        """
+        Writes out whatever is in the buffer.
+        """
+        with self._lock:
+            if not self._closed:
+                self._flush_file()
+
+    def rotate(self):
+        """
+        Rotates the file now, whatever its size or age.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            if self.multi_process:
+                self._flush_file()
+                self._rotate_shared(force=True)
+            else:
+                self._rotate()
+
+    def close(self):
+        """
+        Writes out the buffer and closes the file, then waits for the rotated files to be compressed.
+        Messages written after this are dropped.
+        """
+        if self._flusher_stop is None:
+            return
+
+        self._flusher_stop.set()
+        atexit.unregister(self.flush)
+        with self._lock:
+            if not self._closed:
+                self._flush_file()
+                self._closed = True
+                if self.multi_process:
+                    os.close(self._fd)
+                    os.close(self._lock_fd)
+                else:
+                    self._file.close()
+
+        self._housekeeping.put(None)
+        self._housekeeper.join()
+
+    def _open_file(self):
+        """
+        Opens the file in append mode, and works out when it is due for rotation.  The caller holds the lock (or we
+        are still being configured).  In the multi_process mode, it is a raw O_APPEND descriptor:  the kernel moves
+        to the end of the file and writes in one step, for every process.
+        """
+        if self.multi_process:
+            self._fd = os.open(self.file_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._file_size = os.fstat(self._fd).st_size
+        else:
+            self._file = open(self.file_path, 'ab', buffering=self.buffer_size_bytes)
+            self._file_size = self._file.tell()
+
+        self._next_rotation_time = None
+        if self.rotate_interval_seconds > 0:
+            interval = self.rotate_interval_seconds
+            self._next_rotation_time = (time.time() // interval + 1) * interval
+
+    def _rotation_due(self, incoming_bytes: int) -> bool:
+        """
+        Is the file due for rotation, before we write this many more bytes to it?
+        :param incoming_bytes: The size of what we are about to write.
+        :return: True if we rotate first.
+        """
+        if 0 < self.rotate_max_bytes < self._file_size + incoming_bytes and self._file_size > 0:
+            return True
+        return self._next_rotation_time is not None and time.time() >= self._next_rotation_time
+
+    def _rotate(self):
+        """
+        Closes the file, renames it with the time of the rotation, and opens a new one.  The rotated file is handed
+        to the housekeeper thread, to be compressed and pruned.  The caller holds the lock (and in the
+        multi_process mode, the exclusive lock of the lock file).
+        """
+        if self.multi_process:
+            os.close(self._fd)
+        else:
+            self._file.close()
+        rotated_path = None
+        if self._file_size > 0:
+            rotated_path = self._rotated_path()
+            os.replace(self.file_path, rotated_path)
+        self._open_file()
+        if rotated_path:
+            self._housekeeping.put(rotated_path)
+
+    def _rotated_path(self) -> str:
+        """
+        The path we rename the file to, like 'app.log.20240101-000000'.  A counter is added when we rotate more than
+        once in the same second.
+        :return: A path that does not exist yet.
+        """
+        stamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%d-%H%M%S')
+        suffix = COMPRESSIONS[self.compression][0] if self.compression else ''
+        rotated_path = f"{self.file_path}.{stamp}"
+        counter = 0
+        while os.path.exists(rotated_path) or os.path.exists(rotated_path + suffix):
+            counter += 1
+            rotated_path = f"{self.file_path}.{stamp}-{counter:03d}"
+        return rotated_path
+
+    def _flush_file(self):
+        """
+        Writes the buffer to the file.  The caller holds the lock.
+        """
+        self._last_flush_time = time.monotonic()
+        if not self.multi_process:
+            self._file.flush()
+            return
+
+        if not self._buffer:
+            return
+
+        #
+        # Writers hold the lock file shared, the process that rotates holds it exclusive.  So once we hold it and
+        # followed any rotation, nobody can rename the file under us until our records are in it.
+        #
+        fcntl.flock(self._lock_fd, fcntl.LOCK_SH)
+        try:
+            self._follow_rotation()
+            rotation_due = self._rotation_due(len(self._buffer))
+            if not rotation_due:
+                write_all(self._fd, self._buffer)
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+        if rotation_due:
+            self._rotate_shared()
+            fcntl.flock(self._lock_fd, fcntl.LOCK_SH)
+            try:
+                self._follow_rotation()
+                write_all(self._fd, self._buffer)
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+        self._buffer.clear()
+
+    def _follow_rotation(self):
+        """
+        In the multi_process mode, reopens the file if another process rotated it (the path is not our file anymore).
+        Also refreshes the size of the file, that all the processes write to.  The caller holds the lock file.
+        """
+        try:
+            path_inode = os.stat(self.file_path).st_ino
+        except FileNotFoundError:
+            path_inode = None
+
+        file_stat = os.fstat(self._fd)
+        if path_inode != file_stat.st_ino:
+            os.close(self._fd)
+            self._open_file()
+        else:
+            self._file_size = file_stat.st_size
+
+    def _rotate_shared(self, force: bool = False):
+        """
+        In the multi_process mode, rotates the file under the exclusive lock of the lock file.  Another process may
+        have rotated it while we waited for the lock, then we just follow it.
+        :param force: Rotate even if the file is not due (unless another process just rotated it).
+        """
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        try:
+            path_inode = os.stat(self.file_path).st_ino if os.path.exists(self.file_path) else None
+            if path_inode != os.fstat(self._fd).st_ino:
+                os.close(self._fd)
+                self._open_file()
+                return
+
+            self._file_size = os.fstat(self._fd).st_size
+            if force or self._rotation_due(len(self._buffer)):
+                self._rotate()
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _run_flusher(self, stop_event: threading.Event):
+        """
+        The flusher thread, writes out the buffer when it has been sitting there for flush_interval_ms, and rotates
+        the file on time even when nothing is logged.
+        :param stop_event: Set when the dispatcher is closed.
+        """
+        interval = self.flush_interval_ms / 1000
+        while not stop_event.wait(interval):
+            with self._lock:
+                if self._closed:
+                    return
+                if self._next_rotation_time is not None and time.time() >= self._next_rotation_time:
+                    self._flush_file()
+                    if self.multi_process:
+                        self._rotate_shared()
+                    else:
+                        self._rotate()
+                elif time.monotonic() - self._last_flush_time >= interval:
+                    self._flush_file()
+
+    def _run_housekeeper(self):
+        """
+        The housekeeper thread, compresses the rotated files and deletes the ones past retention_count.  Runs until
+        close() sends it a None.
+        """
+        while True:
+            rotated_path = self._housekeeping.get()
+            if rotated_path is None:
+                return
+
+            try:
+                if self.compression and os.path.exists(rotated_path):
+                    compress_file(rotated_path, self.compression)
+                if self.retention_count > 0:
+                    for old_path in self.rotated_files()[:-self.retention_count]:
+                        os.remove(old_path)
+            except OSError as ex:
+                print(f"alienprobe: the file dispatcher could not clean up {rotated_path}: {ex!r}", file=sys.stderr)
+
+    def rotated_files(self) -> List[str]:
+        """
+        The rotated files of our file_path, compressed or not, oldest first.
+        :return: The paths.
+        """
+        folder = os.path.dirname(os.path.abspath(self.file_path))
+        prefix = os.path.basename(self.file_path) + '.'
+        paths = [os.path.join(folder, name) for name in os.listdir(folder)
+                 if name.startswith(prefix) and not name.endswith(('.tmp', '.lock'))]
+        return sorted(paths, key=lambda path: (os.path.getmtime(path), path))
+
+
+def write_all(fd: int, data: bytes):
+    """
+    Writes the data to a file descriptor.  On a regular file opened with O_APPEND this is a single write, we only
+    loop if the kernel wrote part of it (a full disk, a signal).
+    :param fd: The file descriptor.
+    :param data: The data.
+    """
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+def compress_file(path: str, compression: str) -> str:
+    """
+    Compresses a file next to itself, and deletes the original.  The compressed file keeps the modification time of
+    the original, so the rotated files stay in order.
+    :param path: The file to compress.
+    :param compression: 'gzip' or 'lzma'.
+    :return: The path of the compressed file.
+    """
+    suffix, open_compressed = COMPRESSIONS[compression]
+    compressed_path = path + suffix
+    with open(path, 'rb') as source, open_compressed(compressed_path + '.tmp', 'wb') as target:
+        shutil.copyfileobj(source, target, 1024 * 1024)
+    modified_time = os.path.getmtime(path)
+    os.replace(compressed_path + '.tmp', compressed_path)
+    os.utime(compressed_path, (modified_time, modified_time))
+    os.remove(path)
+    return compressed_path
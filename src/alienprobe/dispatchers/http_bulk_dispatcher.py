@@ -0,0 +1,353 @@
+"""
+A dispatcher that posts the messages to an HTTP bulk ingest endpoint (Elasticsearch _bulk, Splunk HEC, Loki, Vector's
+http source...), as gzip compressed NDJSON bodies:  one JSON object per line, like the json lines dispatcher.
+
+The records are put aside on the calling thread, and sender threads post them in bodies of up to body_max_records
+records or body_max_bytes bytes, or once the oldest record waited body_max_latency_ms.  Every sender keeps its own
+keep-alive connection.  A body that gets a 429 or a 5xx (or a connection error) is posted again after a jittered
+exponential backoff (or the Retry-After of the server), up to max_retries times, then dropped.  Any other error status
+drops it right away.  Progress shows in the counters:  sent_count, retry_count, dropped_count and in_flight_count.
+"""
+import atexit
+import gzip
+import http.client
+import random
+import threading
+import time
+import urllib.parse
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from alienprobe.dispatchers.base_dispatcher import BaseDispatcher
+from alienprobe.dispatchers.json_lines_dispatcher import JsonLinesDispatcher
+from alienprobe.message import Message
+
+
+"""
+The statuses that are worth retrying:  too many requests, and the server side errors.
+"""
+RETRY_STATUSES = frozenset([429]) | frozenset(range(500, 600))
+
+
+class HttpBulkDispatcher(BaseDispatcher):
+    """
+    Posts the messages as gzip compressed NDJSON bodies, over keep-alive connections, from sender threads.
+    """
+
+    """
+    The endpoint, like 'https://logs.example.com:9200/myapp/_bulk'.
+    """
+    url: str
+
+    """
+    Extra headers of every request, like an Authorization header.
+    """
+    headers: Dict[str, str]
+
+    """
+    Do we gzip the bodies (with Content-Encoding: gzip).
+    """
+    gzip_bodies: bool = True
+
+    """
+    A line that goes before every record, like '{"index":{}}' for the Elasticsearch _bulk API.  None for plain
+    NDJSON.
+    """
+    bulk_action: Optional[str] = None
+
+    """
+    A body is posted once it holds body_max_records records, or body_max_bytes bytes (before compression), or its
+    oldest record waited body_max_latency_ms.
+    """
+    body_max_records: int = 1000
+    body_max_bytes: int = 1024 * 1024
+    body_max_latency_ms: float = 1000
+
+    """
+    How many times a body is posted again after a 429, a 5xx or a connection error, before it is dropped.
+    """
+    max_retries: int = 5
+
+    """
+    The backoff between the tries:  up to retry_min_ms after the first failure, doubling up to retry_max_ms, the
+    actual wait is random between 0 and that.  A Retry-After from the server is used instead, within retry_max_ms.
+    """
+    retry_min_ms: float = 200
+    retry_max_ms: float = 30000
+
+    """
+    How many connections (and sender threads) we keep to the server.
+    """
+    connections: int = 1
+
+    """
+    The most bytes of records waiting for a sender.  Past that, the oldest ones are dropped.
+    """
+    spool_max_bytes: int = 16 * 1024 * 1024
+
+    """
+    How long connecting, and every request, may take.
+    """
+    timeout_seconds: float = 10
+
+    """
+    How long flush() (and close()) waits for the waiting records to be posted.
+    """
+    flush_timeout_seconds: float = 10
+
+    """
+    The counters:  records posted successfully, records being posted right now, posts that were tried again, and
+    records dropped (from a full spool, a rejected body, or a body out of retries).
+    """
+    sent_count: int = 0
+    in_flight_count: int = 0
+    retry_count: int = 0
+    dropped_count: int = 0
+
+    def config_dispatcher(self, config: dict):
+        """
+        We pass in the section of the dispatcher from the toml config file.  This is used to configure the logger,
+        and learn more about how to set itself up.  Like target ip addresses, etc.
+        :param config: The configuration that we are using for this logger.  The extra headers are in its
+        'headers' table.
+        """
+        self.url = config.get('url')
+        parsed_url = urllib.parse.urlsplit(self.url or '')
+        if parsed_url.scheme not in ('http', 'https') or not parsed_url.hostname:
+            raise ValueError(f"The http bulk dispatcher needs an http:// or https:// url, was '{self.url}'")
+        self._scheme = parsed_url.scheme
+        self._host = parsed_url.hostname
+        self._port = parsed_url.port
+        self._path = (parsed_url.path or '/') + (f'?{parsed_url.query}' if parsed_url.query else '')
+
+        self.headers = {str(key): str(value) for key, value in config.get('headers', {}).items()}
+        self.gzip_bodies = bool(config.get('gzip', True))
+        self.bulk_action = config.get('bulk_action') or None
+        self.body_max_records = int(config.get('body_max_records', 1000))
+        self.body_max_bytes = int(config.get('body_max_bytes', 1024 * 1024))
+        self.body_max_latency_ms = float(config.get('body_max_latency_ms', 1000))
+        self.max_retries = int(config.get('max_retries', 5))
+        self.retry_min_ms = float(config.get('retry_min_ms', 200))
+        self.retry_max_ms = float(config.get('retry_max_ms', 30000))
+        self.connections = int(config.get('connections', 1))
+        self.spool_max_bytes = int(config.get('spool_max_bytes', 16 * 1024 * 1024))
+        self.timeout_seconds = float(config.get('timeout_seconds', 10))
+        self.flush_timeout_seconds = float(config.get('flush_timeout_seconds', 10))
+        if min(self.body_max_records, self.body_max_bytes, self.connections, self.spool_max_bytes) < 1:
+            raise ValueError("The body_max_records, body_max_bytes, connections and spool_max_bytes of the http bulk "
+                             "dispatcher must be at least 1.")
+
+        self._json_encoder = JsonLinesDispatcher()
+        self._json_encoder.config_param_limits(config)
+        self._json_encoder.config_dispatcher({'datetime_format': config.get('datetime_format',
+                                                                            '%Y-%m-%dT%H:%M:%S.%fZ'),
+                                              'log_utc_timezone': config.get('log_utc_timezone', True),
+                                              'ensure_ascii': config.get('ensure_ascii', False)})
+        self._action_line = (self.bulk_action.strip() + '\n').encode() if self.bulk_action else b''
+
+        self._cond = threading.Condition()
+        self._pending: List[bytes] = []
+        self._pending_bytes = 0
+        self._oldest_pending = 0.0
+        self._flush_requests = 0
+        self._stopping = False
+        self._senders = [threading.Thread(target=self._run_sender, name=f'alienprobe-http-sender-{index}',
+                                          daemon=True)
+                         for index in range(self.connections)]
+        for sender in self._senders:
+            sender.start()
+        atexit.register(self.flush)
+
+    def write_message(self, message_object: Message) -> bool:
+        """
+        Base method that writes a message to whatever resource you are writing messages to.  Like files, whatever.
+        :param message_object: The log message values we need to write.
+        :return: True if the message was written.
+        """
+        return self.write_messages([message_object]) == 1
+
+    def write_messages(self, batch: Sequence[Message]) -> int:
+        """
+        Encodes the records and puts them aside for the senders.  Never waits for the network.
+        :param batch: The messages to write.
+        :return: How many messages were put aside.
+        """
+        action_line = self._action_line
+        encode_line = self._json_encoder.encode_line
+        records = [action_line + encode_line(message_object).encode() for message_object in batch]
+
+        with self._cond:
+            if self._stopping:
+                return 0
+            if not self._pending:
+                self._oldest_pending = time.monotonic()
+            self._pending.extend(records)
+            self._pending_bytes += sum(len(record) for record in records)
+            if self._pending_bytes > self.spool_max_bytes:
+                dropped = 0
+                while self._pending_bytes > self.spool_max_bytes and dropped < len(self._pending):
+                    self._pending_bytes -= len(self._pending[dropped])
+                    dropped += 1
+                del self._pending[:dropped]
+                self.dropped_count += dropped
+            if len(self._pending) >= self.body_max_records or self._pending_bytes >= self.body_max_bytes:
+                self._cond.notify()
+        return len(records)
+
+    def flush(self):
+        """
+        Posts what is waiting right away, and waits (up to flush_timeout_seconds) until it is posted, or dropped.
+        """
+        deadline = time.monotonic() + self.flush_timeout_seconds
+        with self._cond:
+            self._flush_requests += 1
+            self._cond.notify_all()
+            try:
+                while self._pending or self.in_flight_count:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not any(sender.is_alive() for sender in self._senders):
+                        return
+                    self._cond.wait(remaining)
+            finally:
+                self._flush_requests -= 1
+
+    def close(self):
+        """
+        Posts what is waiting (like flush), then stops the senders and closes their connections.  Messages written
+        after this are dropped.
+        """
+        with self._cond:
+            if self._stopping:
+                return
+        atexit.unregister(self.flush)
+        self.flush()
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for sender in self._senders:
+            sender.join(self.timeout_seconds)
+
+    def backoff_seconds(self, failures: int, retry_after: Optional[str] = None) -> float:
+        """
+        How long we wait before we post a body again.
+        :param failures: How many posts of the body failed.
+        :param retry_after: The Retry-After header of the response, if any.
+        :return: The wait, in seconds.
+        """
+        if retry_after and retry_after.strip().isdigit():
+            return min(float(retry_after), self.retry_max_ms / 1000)
+        ceiling = min(self.retry_max_ms, self.retry_min_ms * 2 ** min(failures - 1, 32))
+        return random.uniform(0, ceiling) / 1000
+
+    def _run_sender(self):
+        """
+        A sender thread:  takes a body when one is due, and posts it on its keep-alive connection.
+        """
+        connection = None
+        try:
+            while True:
+                records = self._take_body()
+                if records is None:
+                    return
+                connection = self._post_records(connection, records)
+        finally:
+            if connection is not None:
+                connection.close()
+
+    def _take_body(self) -> Optional[List[bytes]]:
+        """
+        Waits until a body is due (full, old enough, flushed or closing), and takes its records.
+        :return: The records, or None when we are closing and nothing is left.
+        """
+        latency = self.body_max_latency_ms / 1000
+        with self._cond:
+            while True:
+                pending = self._pending
+                if pending and (len(pending) >= self.body_max_records or self._pending_bytes >= self.body_max_bytes
+                                or self._flush_requests or self._stopping
+                                or time.monotonic() - self._oldest_pending >= latency):
+                    break
+                if self._stopping:
+                    return None
+                self._cond.wait(self._oldest_pending + latency - time.monotonic() if pending else None)
+
+            records = []
+            size = 0
+            for record in pending:
+                if records and (len(records) >= self.body_max_records or size + len(record) > self.body_max_bytes):
+                    break
+                records.append(record)
+                size += len(record)
+            del pending[:len(records)]
+            self._pending_bytes -= size
+            self._oldest_pending = time.monotonic()
+            self.in_flight_count += len(records)
+            return records
+
+    def _post_records(self, connection: Optional[http.client.HTTPConnection],
+                      records: List[bytes]) -> Optional[http.client.HTTPConnection]:
+        """
+        Posts a body, trying again on the retryable failures.  Updates the counters when it is done.
+        :param connection: The keep-alive connection of the sender, None to open a new one.
+        :param records: The records of the body.
+        :return: The connection to keep for the next body, None if it had to be closed.
+        """
+        body = b''.join(records)
+        headers = {'Content-Type': 'application/x-ndjson'}
+        if self.gzip_bodies:
+            body = gzip.compress(body, compresslevel=6)
+            headers['Content-Encoding'] = 'gzip'
+        headers.update(self.headers)
+
+        sent = False
+        failures = 0
+        while True:
+            reused = connection is not None
+            if connection is None:
+                connection_class = http.client.HTTPSConnection if self._scheme == 'https' \
+                    else http.client.HTTPConnection
+                connection = connection_class(self._host, self._port, timeout=self.timeout_seconds)
+            status, retry_after = self._post(connection, body, headers)
+            if status is None:
+                connection.close()
+                connection = None
+                if reused:
+                    #
+                    # The server closed the idle keep-alive connection, that is not a failure of the body.
+                    #
+                    continue
+            if status is not None and 200 <= status < 300:
+                sent = True
+                break
+            if (status is not None and status not in RETRY_STATUSES) or failures >= self.max_retries:
+                break
+
+            failures += 1
+            with self._cond:
+                self.retry_count += 1
+                stopping = self._stopping
+            if stopping:
+                break
+            time.sleep(self.backoff_seconds(failures, retry_after))
+
+        with self._cond:
+            self.in_flight_count -= len(records)
+            if sent:
+                self.sent_count += len(records)
+            else:
+                self.dropped_count += len(records)
+            self._cond.notify_all()
+        return connection
+
+    def _post(self, connection: http.client.HTTPConnection, body: bytes,
+              headers: Dict[str, str]) -> Tuple[Optional[int], Optional[str]]:
+        """
+        Posts a body, and reads the whole response, so the connection can be used again.
+        :return: The status and the Retry-After header, or None and None if the connection failed.
+        """
+        try:
+            connection.request('POST', self._path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status, response.getheader('Retry-After')
+        except (OSError, http.client.HTTPException):
+            return None, None
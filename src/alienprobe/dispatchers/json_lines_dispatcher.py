@@ -0,0 +1,268 @@
+"""
+A dispatcher that writes every log message as one JSON object per line (JSON Lines), to stdout, a file or a file
+descriptor.  Downstream systems can load it as is, instead of re-parsing the key="value" text of the console.
+
+    {"machine_name":"worker-01","instance_id":"20240101_000000Z_ABCDE","level":"INFO",
+     "date":"2024-01-01T00:00:00.000000Z","class_name":"myapp.mymodule","message":"Read input file",
+     "params":{"path":"/tmp/input.csv","file_size":1024}}
+
+(on a single line).  The fields that never change (the level names, machine_name and instance_id) are encoded once,
+the common scalar params go through a fast path, and a batch is written with a single write.
+"""
+import datetime
+import json
+import math
+import os
+import sys
+import threading
+from typing import Any, Callable, Dict, Optional, Sequence
+
+from alienprobe.dispatchers.base_dispatcher import BaseDispatcher
+from alienprobe.dispatchers.date_cache import DateFormatCache
+from alienprobe.level_trie import get_source_name
+from alienprobe.log_levels import LogLevels
+from alienprobe.message import Message
+
+
+def encode_float(value: float) -> str:
+    """
+    Floats as JSON numbers.  JSON has no NaN or Infinity, so those go as strings.
+    """
+    if math.isfinite(value):
+        return float.__repr__(value)
+    return '"' + float.__repr__(value) + '"'
+
+
+def json_default(value: Any) -> Any:
+    """
+    The default of json.dumps for the values JSON does not know, inside the container params.
+    """
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+class JsonLinesDispatcher(BaseDispatcher):
+    """
+    Writes one JSON object per message, one per line.
+    """
+
+    """
+    Where we write.  The path of a file we append to, None to write to stdout (or to output_fd).
+    """
+    output_path: Optional[str] = None
+
+    """
+    A file descriptor we write to, like 2 for stderr, or a pipe set up by a supervisor.  None to write to stdout
+    (or to output_path).  We never close it, it is not ours.
+    """
+    output_fd: Optional[int] = None
+
+    """
+    The strftime format of the "date" field.
+    """
+    datetime_format: str = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+    """
+    Do we write the date in UTC, or in the local time zone.
+    """
+    log_utc_timezone: bool = True
+
+    """
+    Escape everything that is not ASCII, instead of writing UTF-8.
+    """
+    ensure_ascii: bool = False
+
+    """
+    The encoded level field for every level id, up to the opening quote of the date.
+    """
+    _level_fields: Dict[int, str]
+
+    """
+    The start of the line for every level id, with the constant fields already encoded, up to the opening quote of
+    the date.
+    """
+    _line_prefixes: Dict[int, str]
+
+    """
+    The encoders of the common scalar types, by exact type.  Anything else goes through encode_other.
+    """
+    _scalar_encoders: Dict[type, Callable[[Any], str]]
+
+    def config_dispatcher(self, config: dict):
+        """
+        We pass in the section of the dispatcher from the toml config file.  This is used to configure the logger,
+        and learn more about how to set itself up.  Like target ip addresses, etc.
+        :param config: The configuration that we are using for this logger.
+        """
+        self.output_path = config.get('output_path') or None
+        output_fd = config.get('output_fd')
+        self.output_fd = int(output_fd) if output_fd is not None else None
+        if self.output_path and self.output_fd is not None:
+            raise ValueError("The json lines dispatcher writes to output_path or to output_fd, not both.")
+
+        self.datetime_format = config.get('datetime_format', self.datetime_format)
+        self.log_utc_timezone = bool(config.get('log_utc_timezone', True))
+        self.ensure_ascii = bool(config.get('ensure_ascii', False))
+        self.date_cache = DateFormatCache(datetime_format=self.datetime_format, log_utc=self.log_utc_timezone)
+        self.compact_encoder = self.create_compact_encoder()
+
+        self.encode_string = json.encoder.encode_basestring_ascii if self.ensure_ascii \
+            else json.encoder.encode_basestring
+        self._scalar_encoders = {
+            str: self.encode_string,
+            int: int.__repr__,
+            float: encode_float,
+            bool: lambda value: 'true' if value else 'false',
+            type(None): lambda value: 'null',
+        }
+
+        #
+        # The level names are encoded now.  The machine_name and instance_id belong to the logger, so they are
+        # encoded the first time we see them, joined with the level fields, and reused after that.
+        #
+        self._level_fields = {level.level_id: f',"level":{self.encode_string(level.name)},"date":"'
+                              for level in LogLevels.log_levels_by_name.values()}
+        self._line_prefixes = {}
+        self._prefix_owner = None
+
+        self._lock = threading.Lock()
+        self._file = open(self.output_path, 'ab') if self.output_path else None
+        self._closed = False
+
+    def write_message(self, message_object: Message) -> bool:
+        """
+        Base method that writes a message to whatever resource you are writing messages to.  Like files, whatever.
+        :param message_object: The log message values we need to write.
+        :return: True if the message was written.
+        """
+        return self.write_messages([message_object]) == 1
+
+    def write_messages(self, batch: Sequence[Message]) -> int:
+        """
+        Encodes the batch and writes it with a single write.
+        :param batch: The messages to write.
+        :return: How many messages were written.
+        """
+        if not batch:
+            return 0
+
+        data = ''.join([self.encode_line(message_object) for message_object in batch]).encode()
+        with self._lock:
+            if self._closed:
+                return 0
+            self._write_bytes(data)
+        return len(batch)
+
+    def encode_line(self, message_object: Message) -> str:
+        """
+        Encodes a message as a JSON object, with its line feed.
+        :param message_object: The message.
+        :return: The line.
+        """
+        encode_string = self.encode_string
+        owner = (message_object.machine_name, message_object.instance_id)
+        if owner != self._prefix_owner:
+            self._set_line_prefixes(owner)
+        prefix = self._line_prefixes[message_object.level.level_id]
+
+        parts = [prefix, self.date_cache.format(message_object.timestamp_ns),
+                 '","class_name":', encode_string(get_source_name(message_object.class_name)),
+                 ',"message":', encode_string(message_object.message_static)]
+
+        params = message_object.params
+        if params:
+            scalar_encoders = self._scalar_encoders
+            encoded_params = []
+            for param_key, param_val in params.items():
+                encoder = scalar_encoders.get(param_val.__class__)
+                encoded_val = encoder(param_val) if encoder else self.encode_other(param_val)
+                encoded_params.append(encode_string(str(param_key)) + ':' + encoded_val)
+            parts.append(',"params":{')
+            parts.append(','.join(encoded_params))
+            parts.append('}')
+
+        if message_object.ex:
+            parts.append(',"exception":')
+            parts.append(encode_string(message_object.exception_text))
+
+        parts.append('}\n')
+        return ''.join(parts)
+
+    def encode_other(self, value: Any) -> str:
+        """
+        Encodes a param value that is not one of the common scalars.  Containers become JSON (within the
+        param_max_bytes of the dispatcher, past that, or when they hold themselves, they go as the text of the
+        compact encoder), dates go in ISO format, and anything else as its str().
+        :param value: The param value.
+        :return: The JSON text.
+        """
+        if isinstance(value, (dict, list, tuple, set, frozenset)):
+            try:
+                encoded = json.dumps(list(value) if isinstance(value, (set, frozenset)) else value,
+                                     default=json_default, ensure_ascii=self.ensure_ascii, separators=(',', ':'))
+                if len(encoded) <= self.param_max_bytes:
+                    return encoded
+            except ValueError:
+                pass
+            return self.encode_string(self.compact_encoder.encode(value))
+
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        if isinstance(value, int):
+            return int.__repr__(value)
+        if isinstance(value, float):
+            return encode_float(value)
+        if isinstance(value, (datetime.date, datetime.time)):
+            return self.encode_string(value.isoformat())
+        return self.encode_string(str(value))
+
+    def _set_line_prefixes(self, owner: tuple):
+        """
+        Encodes the start of the lines of every level, up to the opening quote of the date, for a machine_name and
+        instance_id.
+        :param owner: The (machine_name, instance_id) of the messages.
+        """
+        machine_name, instance_id = owner
+        owner_fields = f'{{"machine_name":{self.encode_string(str(machine_name))},' \
+                       f'"instance_id":{self.encode_string(str(instance_id))}'
+        self._line_prefixes = {level_id: owner_fields + level_fields
+                               for level_id, level_fields in self._level_fields.items()}
+        self._prefix_owner = owner
+
+    def _write_bytes(self, data: bytes):
+        """
+        Writes encoded lines to the output.  The caller holds the lock.
+        :param data: The lines.
+        """
+        if self._file is not None:
+            self._file.write(data)
+            self._file.flush()
+        elif self.output_fd is not None:
+            view = memoryview(data)
+            while view:
+                written = os.write(self.output_fd, view)
+                view = view[written:]
+        else:
+            #
+            # Flush the text layer first, so that a print() that happened before our messages comes out before them.
+            #
+            sys.stdout.flush()
+            output = getattr(sys.stdout, 'buffer', None)
+            if output is None:
+                sys.stdout.write(data.decode())
+            else:
+                output.write(data)
+                output.flush()
+
+    def close(self):
+        """
+        Closes the file we append to, if any.  Messages written after this are dropped.
+        """
+        with self._lock:
+            self._closed = True
+            if self._file is not None:
+                self._file.close()
+                self._file = None
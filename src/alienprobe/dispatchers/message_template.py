@@ -0,0 +1,248 @@
+"""
+Compiles the message_format and exception_format of a dispatcher once, into a list of literal segments and token
+getters.  Rendering a message is then a single join, and only the tokens that are actually in the format get
+evaluated.  Before, we ran a str.replace over the whole message for every token, for every message.
+"""
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+from alienprobe.dispatchers.date_cache import DateFormatCache
+from alienprobe.message import Message
+from alienprobe.serializers import SerializerRegistry, create_dispatcher_serializers
+
+
+"""
+Finds the [[TOKEN]] runes in a format.
+"""
+_TOKEN_PATTERN = re.compile(r'\[\[([A-Z_]+)]]')
+
+
+class MessageTemplate:
+    """
+    A single compiled format.  Literal text is kept as is, known tokens are replaced by a getter that takes the
+    message and returns the text for it.  Unknown tokens stay in the output, like they did with the str.replace.
+    """
+
+    """
+    The format we compiled.
+    """
+    template: str
+
+    """
+    The names of the tokens that are evaluated when we render, in order.
+    """
+    token_names: List[str]
+
+    """
+    The literal segments of the format.  The slots of the tokens are filled in when we render.
+    """
+    _parts: List[str]
+
+    """
+    The index in _parts and the getter for every token in the format.
+    """
+    _getters: List[Tuple[int, Callable[[Message], str]]]
+
+    def __init__(self, template: str, getters: Dict[str, Callable[[Message], str]]):
+        """
+        Compiles the format.
+        :param template: The format, like 'date="[[DATE_STRING]]" message="[[LOG_MESSAGE_STATIC]]"'
+        :param getters: The getters of the known tokens, by token name (without the brackets).
+        """
+        self.template = template
+        self.token_names = []
+        self._parts = []
+        self._getters = []
+
+        position = 0
+        for match in _TOKEN_PATTERN.finditer(template):
+            getter = getters.get(match.group(1))
+            if not getter:
+                continue
+
+            if match.start() > position:
+                self._parts.append(template[position:match.start()])
+            self.token_names.append(match.group(1))
+            self._getters.append((len(self._parts), getter))
+            self._parts.append('')
+            position = match.end()
+
+        if position < len(template):
+            self._parts.append(template[position:])
+
+    def render(self, message_object: Message) -> str:
+        """
+        Renders a message with this format.
+        :param message_object: The values for all the fields we want to output.
+        :return: The formatted message.
+        """
+        parts = self._parts.copy()
+        for index, getter in self._getters:
+            parts[index] = getter(message_object)
+
+        return ''.join(parts)
+
+
+class CompiledMessageFormat:
+    """
+    The message_format and exception_format of a dispatcher, compiled once.  We keep one template for messages
+    without an exception, and one with the exception_format appended for messages that carry one.
+    [[INSTANCE_ID]] The unique id of the logger instance.
+    [[MACHINE_NAME]] The host name of the machine.
+    [[DATE_STRING]] The date, formatted with datetime_format.
+    [[CLASS_NAME]] The name of the class (or file) we are logging.
+    [[LOG_LEVEL]] The level name, like 'INFO'.
+    [[LOG_MESSAGE_STATIC]] The static part of the log, like 'Read input file'.
+    [[LOG_PARAMS]] The log parameters, as key="value" pairs.
+    [[EXCEPTION_TEXT]] The stack trace of the exception.
+    """
+
+    """
+    The strftime format of the [[DATE_STRING]] token.
+    """
+    datetime_format: str
+
+    """
+    Do we render the date in UTC, or in the local time zone.
+    """
+    log_utc: bool
+
+    """
+    Formats the [[DATE_STRING]], formatting each second only once.
+    """
+    date_cache: DateFormatCache
+
+    """
+    How we encode the values of the [[LOG_PARAMS]].
+    """
+    serializers: SerializerRegistry
+
+    """
+    The format of messages without an exception.
+    """
+    message_format: str
+
+    """
+    What we append to the message_format for messages with an exception.
+    """
+    exception_format: str
+
+    """
+    The compiled message_format.
+    """
+    message_template: MessageTemplate
+
+    """
+    The compiled message_format + exception_format.
+    """
+    exception_template: MessageTemplate
+
+    def __init__(self, message_format: str, exception_format: str, datetime_format: str, log_utc: bool,
+                 serializers: Optional[SerializerRegistry] = None):
+        """
+        Compiles the formats.
+        :param message_format: The format of how we want the log to output.
+        :param exception_format: What we append to the message_format when there is an exception.
+        :param datetime_format: The strftime format of the [[DATE_STRING]] token (and of the datetime params).
+        :param log_utc: Do we render the date in UTC, or in the local time zone.
+        :param serializers: How we encode the param values.  Default is the built in encoders, with the datetimes
+        formatted with the datetime_format.
+        """
+        if not datetime_format:
+            raise ValueError("No Valid datetime_format configured in the configuration file.  Was None.")
+
+        self.message_format = message_format
+        self.exception_format = exception_format or ''
+        self.datetime_format = datetime_format
+        self.log_utc = log_utc
+        self.date_cache = DateFormatCache(datetime_format=datetime_format, log_utc=log_utc)
+        self.serializers = serializers or create_dispatcher_serializers(datetime_format=datetime_format)
+
+        getters = {
+            'INSTANCE_ID': self.instance_id,
+            'MACHINE_NAME': self.machine_name,
+            'DATE_STRING': self.date_string,
+            'CLASS_NAME': self.class_name,
+            'LOG_LEVEL': self.log_level,
+            'LOG_MESSAGE_STATIC': self.log_message_static,
+            'LOG_PARAMS': self.log_params,
+            'EXCEPTION_TEXT': self.exception_text,
+        }
+        self.message_template = MessageTemplate(message_format, getters)
+        self.exception_template = MessageTemplate(message_format + self.exception_format, getters)
+
+    def render(self, message_object: Message) -> str:
+        """
+        Formats the message according to the compiled formats.
+        :param message_object: The values for all the fields we want to output.
+        :return: The formatted message.
+        """
+        if message_object.ex:
+            return self.exception_template.render(message_object)
+
+        return self.message_template.render(message_object)
+
+    @staticmethod
+    def instance_id(message_object: Message) -> str:
+        """
+        [[INSTANCE_ID]] This is a unique number created once per process (if you use the global logger) or once per
+        logger instance.
+        """
+        return message_object.instance_id
+
+    @staticmethod
+    def machine_name(message_object: Message) -> str:
+        """
+        [[MACHINE_NAME]] The name of the machine that this logger is running on.
+        """
+        return message_object.machine_name
+
+    def date_string(self, message_object: Message) -> str:
+        """
+        [[DATE_STRING]]: The time the message was logged, formatted with the datetime_format.
+        """
+        return self.date_cache.format(message_object.timestamp_ns)
+
+    @staticmethod
+    def class_name(message_object: Message) -> str:
+        """
+        [[CLASS_NAME]]: The name of the class (or file) we are logging.
+        """
+        cls_name = message_object.class_name
+        if not isinstance(cls_name, str):
+            cls_name = str(type(cls_name))
+        return cls_name
+
+    @staticmethod
+    def log_level(message_object: Message) -> str:
+        """
+        [[LOG_LEVEL]]: The name of the level, like 'INFO'.
+        """
+        return message_object.level.name
+
+    @staticmethod
+    def log_message_static(message_object: Message) -> str:
+        """
+        [[LOG_MESSAGE_STATIC]]: The static part of the log, like 'Read input file'.
+        """
+        return message_object.message_static
+
+    def log_params(self, message_object: Message) -> str:
+        """
+        [[LOG_PARAMS]] The log parameters, rendered as key=value pairs, separated by spaces.  Every value goes through
+        the serializers of the dispatcher, that is one dict lookup on its type and the encode.
+        """
+        params = message_object.params
+        if not params:
+            return ''
+
+        encode = self.serializers.encode
+        return ' '.join([f'{param_key}={encode(param_val)}' for param_key, param_val in params.items()])
+
+    @staticmethod
+    def exception_text(message_object: Message) -> str:
+        """
+        [[EXCEPTION_TEXT]] The stack trace of the exception, empty if there is none.  It is rendered once per message,
+        when the logger builds it, and shared by every dispatcher (see alienprobe.exception_text).
+        """
+        return message_object.exception_text or ''
@@ -0,0 +1,255 @@
+"""
+A dispatcher that writes the formatted messages into a fixed size, memory mapped file, used as a circular log.  A
+write is a copy into the mapping, no syscall, and the pages belong to the kernel:  when the process is OOM-killed (or
+dies any other way), the last records are still in the file.  Read them back with:
+
+    alienprobe read-ring /var/log/myapp/myapp.ring
+
+The file is a header, then the records one after the other, wrapping around to the start when the end is reached:
+
+    header   magic, version, header size, data capacity, write offset, next sequence number
+    record   magic, payload length, sequence number, crc32, payload (the formatted line), padded to 8 bytes
+
+A new record can overwrite the start of an old one, and a process can die in the middle of a write, so the reader
+scans the whole data area and keeps only the records whose crc32 matches, sorted by their sequence number.
+"""
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import List, Sequence, Tuple
+
+from alienprobe.dispatchers.base_dispatcher import BaseDispatcher
+from alienprobe.dispatchers.message_template import CompiledMessageFormat
+from alienprobe.message import Message
+
+
+"""
+The file header:  magic, version, header size, data capacity, write offset, next sequence.
+"""
+FILE_HEADER = struct.Struct('<8sIIQQQ')
+FILE_MAGIC = b'APRING\x00\x01'
+FILE_VERSION = 1
+HEADER_SIZE = 64
+
+"""
+The record header:  magic, payload length, sequence, crc32 of the sequence and payload, reserved.
+"""
+RECORD_HEADER = struct.Struct('<IIQII')
+RECORD_MAGIC = 0x31525041
+
+"""
+Records start on 8 byte boundaries, so the reader only has to look for them there.
+"""
+RECORD_ALIGNMENT = 8
+
+
+def record_size(payload_length: int) -> int:
+    """
+    The space a record takes in the file, its header and payload, padded to the alignment.
+    """
+    size = RECORD_HEADER.size + payload_length
+    return (size + RECORD_ALIGNMENT - 1) // RECORD_ALIGNMENT * RECORD_ALIGNMENT
+
+
+def record_crc(sequence: int, payload: bytes) -> int:
+    """
+    The crc32 of a record, over its sequence number and payload.
+    """
+    return zlib.crc32(payload, zlib.crc32(sequence.to_bytes(8, 'little')))
+
+
+def read_ring_file(file_path: str) -> List[Tuple[int, bytes]]:
+    """
+    Reads back the records that survived in a ring file, oldest first.  Records that were partly overwritten, or
+    torn by a crash, are skipped.
+    :param file_path: The ring file.
+    :return: The (sequence number, payload) of every record.
+    """
+    with open(file_path, 'rb') as ring_file:
+        content = ring_file.read()
+
+    if len(content) < HEADER_SIZE:
+        raise ValueError(f"{file_path} is not an alienprobe ring file, it is too small.")
+    magic, version, header_size, capacity, _, _ = FILE_HEADER.unpack_from(content, 0)
+    if magic != FILE_MAGIC or version != FILE_VERSION:
+        raise ValueError(f"{file_path} is not an alienprobe ring file (or not a version we can read).")
+
+    data = memoryview(content)[header_size:header_size + capacity]
+    records = []
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        magic, length, sequence, crc, _ = RECORD_HEADER.unpack_from(data, offset)
+        if magic == RECORD_MAGIC and offset + RECORD_HEADER.size + length <= len(data):
+            payload = bytes(data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length])
+            if record_crc(sequence, payload) == crc:
+                records.append((sequence, payload))
+                offset += record_size(length)
+                continue
+        offset += RECORD_ALIGNMENT
+
+    records.sort(key=lambda record: record[0])
+    return records
+
+
+class MmapRingDispatcher(BaseDispatcher):
+    """
+    Writes the formatted messages into a memory mapped circular file, that survives the process.
+    """
+
+    """
+    The ring file.  Its folder is created if it does not exist.  When it exists with the same size, we carry on
+    where the last process stopped.
+    """
+    file_path: str
+
+    """
+    The size of the data area of the file, the most recent records that fit in it are kept.
+    """
+    size_bytes: int = 4 * 1024 * 1024
+
+    """
+    The strftime format of the [[DATE_STRING]] token.
+    """
+    datetime_format: str = '%Y-%m-%d_%H:%M:%S.%f'
+
+    """
+    Do we write the dates in UTC, or in the local time zone.
+    """
+    log_utc_timezone: bool = True
+
+    """
+    The format of every record, like the one of the console.
+    """
+    message_format: str = 'date="[[DATE_STRING]]" level="[[LOG_LEVEL]]" class="[[CLASS_NAME]]" ' \
+                          'message="[[LOG_MESSAGE_STATIC]]" [[LOG_PARAMS]]'
+
+    """
+    What we append to the message_format for messages with an exception.
+    """
+    exception_format: str = 'exception="\n[[EXCEPTION_TEXT]]"'
+
+    """
+    The message_format and exception_format, compiled once in config_dispatcher.
+    """
+    compiled_format: CompiledMessageFormat
+
+    def config_dispatcher(self, config: dict):
+        """
+        We pass in the section of the dispatcher from the toml config file.  This is used to configure the logger,
+        and learn more about how to set itself up.  Like target ip addresses, etc.
+        :param config: The configuration that we are using for this logger.
+        """
+        self.file_path = config.get('file_path')
+        if not self.file_path:
+            raise ValueError("The mmap ring dispatcher needs a file_path to write to.")
+        self.size_bytes = int(config.get('size_bytes', 4 * 1024 * 1024))
+        if self.size_bytes < 4096 or self.size_bytes % RECORD_ALIGNMENT:
+            raise ValueError(f"The size_bytes of the mmap ring dispatcher must be at least 4096, and a multiple of "
+                             f"{RECORD_ALIGNMENT}, was {self.size_bytes}")
+
+        self.datetime_format = config.get('datetime_format', self.datetime_format)
+        self.log_utc_timezone = bool(config.get('log_utc_timezone', True))
+        self.message_format = config.get('message_format', self.message_format)
+        self.exception_format = config.get('exception_format', self.exception_format)
+        self.compiled_format = self.compile_message_format(message_format=self.message_format,
+                                                           exception_format=self.exception_format,
+                                                           datetime_format=self.datetime_format,
+                                                           log_utc=self.log_utc_timezone)
+
+        #
+        # A single record may take a quarter of the ring at most, longer payloads are cut.
+        #
+        self._max_payload = self.size_bytes // 4 - RECORD_HEADER.size
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.file_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._open_ring()
+
+    def write_message(self, message_object: Message) -> bool:
+        """
+        Base method that writes a message to whatever resource you are writing messages to.  Like files, whatever.
+        :param message_object: The log message values we need to write.
+        :return: True if the message was written.
+        """
+        return self.write_messages([message_object]) == 1
+
+    def write_messages(self, batch: Sequence[Message]) -> int:
+        """
+        Renders the batch outside of the lock, and copies the records into the mapping.
+        :param batch: The messages to write.
+        :return: How many messages were written.
+        """
+        render = self.compiled_format.render
+        max_payload = self._max_payload
+        payloads = []
+        for message_object in batch:
+            payload = render(message_object).encode()
+            payloads.append(payload[:max_payload] if len(payload) > max_payload else payload)
+
+        with self._lock:
+            ring = self._mmap
+            if ring is None:
+                return 0
+
+            capacity = self.size_bytes
+            offset = self._write_offset
+            sequence = self._next_sequence
+            pack_header = RECORD_HEADER.pack_into
+            pack_file_header = FILE_HEADER.pack_into
+            for payload in payloads:
+                size = record_size(len(payload))
+                if offset + size > capacity:
+                    offset = 0
+                start = HEADER_SIZE + offset
+                payload_start = start + RECORD_HEADER.size
+                ring[payload_start:payload_start + len(payload)] = payload
+                pack_header(ring, start, RECORD_MAGIC, len(payload), sequence, record_crc(sequence, payload), 0)
+                offset += size
+                sequence += 1
+
+                #
+                # The header moves on after every record, so a process that dies in the middle of a batch restarts
+                # right after its last complete record.
+                #
+                pack_file_header(ring, 0, FILE_MAGIC, FILE_VERSION, HEADER_SIZE, capacity, offset, sequence)
+
+            self._write_offset = offset
+            self._next_sequence = sequence
+
+        return len(batch)
+
+    def close(self):
+        """
+        Unmaps and closes the file.  The records stay in it.  Messages written after this are dropped.
+        """
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+                os.close(self._fd)
+
+    def _open_ring(self):
+        """
+        Opens and maps the ring file.  If it is a ring file of the same size, we carry on after its last record,
+        otherwise it is started over.
+        """
+        total_size = HEADER_SIZE + self.size_bytes
+        self._fd = os.open(self.file_path, os.O_RDWR | os.O_CREAT, 0o644)
+        existing_size = os.fstat(self._fd).st_size
+        if existing_size != total_size:
+            os.ftruncate(self._fd, 0)
+            os.ftruncate(self._fd, total_size)
+        self._mmap = mmap.mmap(self._fd, total_size)
+
+        magic, version, _, capacity, write_offset, next_sequence = FILE_HEADER.unpack_from(self._mmap, 0)
+        if magic == FILE_MAGIC and version == FILE_VERSION and capacity == self.size_bytes \
+                and write_offset <= capacity:
+            self._write_offset = write_offset
+            self._next_sequence = next_sequence
+        else:
+            self._mmap[:HEADER_SIZE] = bytes(HEADER_SIZE)
+            self._write_offset = 0
+            self._next_sequence = 0
+            FILE_HEADER.pack_into(self._mmap, 0, FILE_MAGIC, FILE_VERSION, HEADER_SIZE, self.size_bytes, 0, 0)
@@ -0,0 +1,333 @@
+"""
+A flight recorder.  It keeps the last messages in memory, as they are (nothing is formatted), and only writes them
+out through a downstream dispatcher when something goes wrong:  when a message at the trigger_level comes in, when
+you call dump(), or when the process gets the dump_signal.  So you get the DEBUG and TRACE detail around an incident,
+without paying to format and write it all the time.
+
+    [common]
+    dispatchers = ['flight_recorder']
+
+    [log_levels]
+    default_log_level = 'debug'         # the recorder only sees what the logger lets through
+
+    [flight_recorder]
+    dispatcher_class_name = 'alienprobe.dispatchers.ring_buffer_dispatcher.RingBufferDispatcher'
+    trigger_level = 'error'
+    passthrough_level = 'info'          # INFO and above are written right away, like a normal dispatcher
+
+    [flight_recorder.downstream]
+    dispatcher_class_name = 'alienprobe.dispatchers.console_dispatcher.ConsoleDispatcher'
+"""
+import signal
+import sys
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+from alienprobe.dispatchers.base_dispatcher import BaseDispatcher, create_dispatcher
+from alienprobe.log_levels import LogLevels, LogLevel
+from alienprobe.message import Message, new_message
+
+
+"""
+What we count for a message on top of its text and params:  the tuple, its fields, the level...
+"""
+MESSAGE_OVERHEAD_BYTES = 256
+
+"""
+What we count for params that are not computed yet (see alienprobe.lazy), we don't compute them to measure them.
+"""
+LAZY_PARAMS_BYTES = 512
+
+"""
+What we count for an exception, it holds its traceback and the frames in it.
+"""
+EXCEPTION_BYTES = 4096
+
+
+"""
+The recorders to dump on each signal.  The handler is installed once per process and signal, and stays with the
+signal while recorders come and go:  a reload builds the new recorder before it closes the old one, so the recorders
+can't hand the handler to each other.
+"""
+_DUMP_TARGETS: Dict[signal.Signals, List['RingBufferDispatcher']] = {}
+
+"""
+The handlers that were installed before ours, by signal, put back when the last recorder of the signal is closed.
+"""
+_PREVIOUS_HANDLERS: Dict[signal.Signals, Any] = {}
+
+_DUMP_SIGNALS_LOCK = threading.Lock()
+
+
+def _on_dump_signal(signal_number, frame):
+    """
+    The signal handler.  It runs on the main thread between two bytecodes, maybe while that thread holds the lock of
+    a recorder, so the dumps themselves run on their own thread.
+    """
+    for recorder in list(_DUMP_TARGETS.get(signal.Signals(signal_number), ())):
+        threading.Thread(target=recorder.dump, name='alienprobe-ring-buffer-dump', daemon=True).start()
+
+
+def add_dump_target(signal_number: signal.Signals, recorder: 'RingBufferDispatcher'):
+    """
+    Dumps the recorder on the signal.  The first recorder of a signal installs the handler, which python only allows
+    on the main thread:  when it is configured on another thread (a config reload, say) the signal is not handled,
+    and we say so on stderr.
+    :param signal_number: The signal.
+    :param recorder: The recorder to dump.
+    """
+    with _DUMP_SIGNALS_LOCK:
+        if signal_number not in _PREVIOUS_HANDLERS:
+            if threading.current_thread() is not threading.main_thread():
+                print(f"alienprobe: the ring buffer dispatcher can only install its {signal_number.name} handler "
+                      f"on the main thread, the signal will not dump it", file=sys.stderr)
+                return
+            _PREVIOUS_HANDLERS[signal_number] = signal.signal(signal_number, _on_dump_signal)
+        _DUMP_TARGETS.setdefault(signal_number, []).append(recorder)
+
+
+def remove_dump_target(signal_number: signal.Signals, recorder: 'RingBufferDispatcher'):
+    """
+    Stops dumping the recorder on the signal.  Once no recorder is left, the previous handler is put back (on the main
+    thread, elsewhere our handler stays, and does nothing).
+    :param signal_number: The signal.
+    :param recorder: The recorder.
+    """
+    with _DUMP_SIGNALS_LOCK:
+        targets = _DUMP_TARGETS.get(signal_number, [])
+        if recorder in targets:
+            targets.remove(recorder)
+        if targets or signal_number not in _PREVIOUS_HANDLERS \
+                or threading.current_thread() is not threading.main_thread():
+            return
+        signal.signal(signal_number, _PREVIOUS_HANDLERS.pop(signal_number))
+        _DUMP_TARGETS.pop(signal_number, None)
+
+
+def estimate_message_bytes(message_object: Message) -> int:
+    """
+    A cheap estimate of the memory a message holds on to, without formatting it.  Strings count their length, other
+    values their (shallow) sys.getsizeof.
+    :param message_object: The message.
+    :return: The estimated bytes.
+    """
+    size = MESSAGE_OVERHEAD_BYTES + len(message_object.message_static)
+    params = message_object.params
+    if isinstance(params, dict):
+        size += sys.getsizeof(params)
+        for param_val in params.values():
+            size += len(param_val) if param_val.__class__ is str else sys.getsizeof(param_val)
+    elif params is not None:
+        size += LAZY_PARAMS_BYTES
+    if message_object.ex is not None:
+        size += EXCEPTION_BYTES
+    return size
+
+
+class RingBufferDispatcher(BaseDispatcher):
+    """
+    Keeps the last messages in a circular buffer, and dumps them through a downstream dispatcher on a trigger.
+    """
+
+    """
+    The most messages we keep.  The slots are allocated once, when we are configured.
+    """
+    capacity: int = 10000
+
+    """
+    The most memory (estimated, see estimate_message_bytes) the kept messages may hold on to.  The oldest messages
+    are dropped first, whichever of capacity or max_bytes is hit.
+    """
+    max_bytes: int = 16 * 1024 * 1024
+
+    """
+    A message at this level or above dumps the buffer, then goes downstream itself.
+    """
+    trigger_level: LogLevel = LogLevels.ERROR
+
+    """
+    Messages at this level or above go downstream right away, and are not kept.  None keeps every message, and only
+    writes on a dump.
+    """
+    passthrough_level: Optional[LogLevel] = None
+
+    """
+    The name of the signal that dumps the buffer, like 'SIGUSR1'.  None to not install a handler.  The handler can
+    only be installed on the main thread:  the signal is handled if the first recorder that uses it is configured
+    there (when the logger starts), not if it first shows up in a config reload.
+    """
+    dump_signal: Optional[str] = None
+
+    """
+    Where the dumped (and passed through) messages go.
+    """
+    downstream: BaseDispatcher
+
+    """
+    How many dumps we did.
+    """
+    dump_count: int = 0
+
+    """
+    How many messages were dropped from the buffer to make room, without being dumped.
+    """
+    dropped_count: int = 0
+
+    def config_dispatcher(self, config: dict):
+        """
+        We pass in the section of the dispatcher from the toml config file.  This is used to configure the logger,
+        and learn more about how to set itself up.  Like target ip addresses, etc.
+        :param config: The configuration that we are using for this logger.  The downstream dispatcher is configured
+        from its 'downstream' table.
+        """
+        self.capacity = int(config.get('capacity', 10000))
+        self.max_bytes = int(config.get('max_bytes', 16 * 1024 * 1024))
+        if self.capacity < 1 or self.max_bytes < 1:
+            raise ValueError(f"The capacity and max_bytes of the ring buffer dispatcher must be at least 1, "
+                             f"were {self.capacity} and {self.max_bytes}")
+
+        levels = LogLevels()
+        trigger_level_name = config.get('trigger_level', 'error')
+        self.trigger_level = levels.get_level_by_name(trigger_level_name)
+        if not self.trigger_level:
+            raise ValueError(f"Unknown trigger_level '{trigger_level_name}' for the ring buffer dispatcher.")
+        passthrough_level_name = config.get('passthrough_level')
+        self.passthrough_level = levels.get_level_by_name(passthrough_level_name) if passthrough_level_name else None
+        if passthrough_level_name and not self.passthrough_level:
+            raise ValueError(f"Unknown passthrough_level '{passthrough_level_name}' for the ring buffer dispatcher.")
+
+        downstream_config = config.get('downstream')
+        if not isinstance(downstream_config, dict):
+            raise ValueError("The ring buffer dispatcher needs a [<name>.downstream] table, with the "
+                             "dispatcher_class_name of the dispatcher it dumps to.")
+        self.downstream = create_dispatcher(dispatcher_name='downstream', dispatcher_config=downstream_config)
+
+        self._lock = threading.Lock()
+        self._slots: List[Optional[Message]] = [None] * self.capacity
+        self._slot_bytes: List[int] = [0] * self.capacity
+        self._start = 0
+        self._count = 0
+        self._total_bytes = 0
+
+        self.dump_signal = config.get('dump_signal') or None
+        if self.dump_signal:
+            signal_number = getattr(signal, self.dump_signal, None)
+            if not isinstance(signal_number, signal.Signals):
+                raise ValueError(f"Unknown dump_signal '{self.dump_signal}' for the ring buffer dispatcher.")
+            add_dump_target(signal_number, self)
+
+    def write_message(self, message_object: Message) -> bool:
+        """
+        Base method that writes a message to whatever resource you are writing messages to.  Like files, whatever.
+        :param message_object: The log message values we need to write.
+        :return: True if the message was written.
+        """
+        return self.write_messages([message_object]) == 1
+
+    def write_messages(self, batch: Sequence[Message]) -> int:
+        """
+        Keeps the messages in the buffer.  A message at the passthrough_level goes downstream instead, and a message
+        at the trigger_level dumps the buffer first.
+        :param batch: The messages to write.
+        :return: How many messages were written.
+        """
+        trigger_id = self.trigger_level.level_id
+        passthrough_id = self.passthrough_level.level_id if self.passthrough_level else None
+        outgoing = []
+        with self._lock:
+            for message_object in batch:
+                level_id = message_object.level.level_id
+                if level_id >= trigger_id:
+                    outgoing.extend(self._take_all())
+                    outgoing.append(message_object)
+                    self.dump_count += 1
+                elif passthrough_id is not None and level_id >= passthrough_id:
+                    outgoing.append(message_object)
+                else:
+                    self._keep(message_object)
+
+        #
+        # We write downstream outside of the lock, formatting a dump can take a while.
+        #
+        if outgoing:
+            self.downstream.submit_messages(outgoing)
+            self.downstream.flush()
+        return len(batch)
+
+    def dump(self) -> int:
+        """
+        Writes the buffered messages downstream, oldest first, and empties the buffer.
+        :return: How many messages were dumped.
+        """
+        with self._lock:
+            messages = self._take_all()
+            self.dump_count += 1
+
+        if messages:
+            self.downstream.submit_messages(messages)
+            self.downstream.flush()
+        return len(messages)
+
+    def buffered_messages(self) -> List[Message]:
+        """
+        The messages in the buffer, oldest first, without taking them out.
+        :return: The messages.
+        """
+        with self._lock:
+            return [self._slots[(self._start + index) % self.capacity] for index in range(self._count)]
+
+    def flush(self):
+        """
+        Flushes the downstream dispatcher.  The buffer is not dumped, use dump() for that.
+        """
+        self.downstream.flush()
+
+    def close(self):
+        """
+        Stops dumping on the signal (the last recorder of the signal puts the previous handler back), and closes the
+        downstream dispatcher.  The buffer is dropped.
+        """
+        if self.dump_signal:
+            remove_dump_target(getattr(signal, self.dump_signal), self)
+        self.downstream.close()
+
+    def _keep(self, message_object: Message):
+        """
+        Puts a message in the buffer, dropping the oldest ones until it fits.  The caller holds the lock.  In the
+        synchronous mode the params are still the dict of the caller, which may change it right after, so we keep a
+        copy:  the dump has to show the values as they were logged.
+        """
+        params = message_object.params
+        if params and params.__class__ is dict:
+            message_object = new_message(Message, (*message_object[:3], dict(params), *message_object[4:]))
+
+        message_bytes = estimate_message_bytes(message_object)
+        capacity = self.capacity
+        while self._count and (self._count == capacity or self._total_bytes + message_bytes > self.max_bytes):
+            self._total_bytes -= self._slot_bytes[self._start]
+            self._slots[self._start] = None
+            self._start = (self._start + 1) % capacity
+            self._count -= 1
+            self.dropped_count += 1
+
+        end = (self._start + self._count) % capacity
+        self._slots[end] = message_object
+        self._slot_bytes[end] = message_bytes
+        self._count += 1
+        self._total_bytes += message_bytes
+
+    def _take_all(self) -> List[Message]:
+        """
+        Takes every message out of the buffer, oldest first.  The caller holds the lock.
+        """
+        slots = self._slots
+        capacity = self.capacity
+        messages = []
+        for index in range(self._count):
+            slot = (self._start + index) % capacity
+            messages.append(slots[slot])
+            slots[slot] = None
+        self._start = 0
+        self._count = 0
+        self._total_bytes = 0
+        return messages
@@ -0,0 +1,333 @@
+"""
+A dispatcher that stores the messages in a SQLite table, one row per message, so the logs can be queried locally
+with SQL, without any service to run:
+
+    SELECT datetime(timestamp_ns / 1e9, 'unixepoch'), message_static, json_extract(params, '$.path')
+      FROM log_messages WHERE level_id >= 5 ORDER BY timestamp_ns DESC LIMIT 20;
+
+The rows are built on the calling thread, and handed to a writer thread with its own connection, which inserts them
+with executemany and commits every commit_max_rows rows or commit_interval_ms, whichever comes first.  The database
+is in WAL mode, so you can read it while the application writes.
+"""
+import atexit
+import json
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from alienprobe.dispatchers.base_dispatcher import BaseDispatcher
+from alienprobe.dispatchers.json_lines_dispatcher import json_default
+from alienprobe.level_trie import get_source_name
+from alienprobe.message import Message
+
+
+"""
+The indexes you can ask for in the config, and their columns.
+"""
+INDEXES: Dict[str, Tuple[str, ...]] = {
+    'timestamp': ('timestamp_ns',),
+    'level_timestamp': ('level_id', 'timestamp_ns'),
+    'message_static': ('message_static',),
+}
+
+SYNCHRONOUS_MODES = ('off', 'normal', 'full', 'extra')
+
+_TABLE_NAME = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+"""
+The param types that always go into the JSON as they are (floats don't, NaN is not JSON).
+"""
+_JSON_SCALARS = (str, int, bool, type(None))
+
+
+class SqliteDispatcher(BaseDispatcher):
+    """
+    Inserts the messages into a SQLite table, on a writer thread.
+    """
+
+    """
+    The database file.  It is created, with its table and indexes, if it does not exist.
+    """
+    database_path: str
+
+    """
+    The table we insert into.
+    """
+    table_name: str = 'log_messages'
+
+    """
+    The indexes of the table, from INDEXES.  Default is all of them.  Indexes are only ever added, an index that
+    is not in the config anymore stays until you drop it.
+    """
+    indexes: List[str]
+
+    """
+    We commit once this many rows were inserted since the last commit...
+    """
+    commit_max_rows: int = 1000
+
+    """
+    ...or once the oldest uncommitted row is this old.
+    """
+    commit_interval_ms: float = 1000
+
+    """
+    The PRAGMA synchronous of the writer connection.  'normal' is safe in WAL mode, a power loss may only lose the
+    last transactions.
+    """
+    synchronous: str = 'normal'
+
+    """
+    The most rows waiting for the writer thread.  Past that, new messages are dropped (and counted), we never make
+    the application wait for the disk.
+    """
+    max_pending_rows: int = 100000
+
+    """
+    How many rows were committed, dropped because too many were waiting, or lost to a database error.
+    """
+    written_count: int = 0
+    dropped_count: int = 0
+    error_count: int = 0
+
+    def config_dispatcher(self, config: dict):
+        """
+        We pass in the section of the dispatcher from the toml config file.  This is used to configure the logger,
+        and learn more about how to set itself up.  Like target ip addresses, etc.
+        :param config: The configuration that we are using for this logger.
+        """
+        self.database_path = config.get('database_path')
+        if not self.database_path:
+            raise ValueError("The sqlite dispatcher needs a database_path to write to.")
+        self.table_name = config.get('table_name', 'log_messages')
+        if not _TABLE_NAME.fullmatch(self.table_name):
+            raise ValueError(f"The table_name of the sqlite dispatcher must be a plain identifier, "
+                             f"was '{self.table_name}'")
+        self.indexes = list(config.get('indexes', list(INDEXES)))
+        unknown_indexes = [index_name for index_name in self.indexes if index_name not in INDEXES]
+        if unknown_indexes:
+            raise ValueError(f"Unknown indexes {unknown_indexes} for the sqlite dispatcher, use some of "
+                             f"{list(INDEXES)}")
+
+        self.commit_max_rows = int(config.get('commit_max_rows', 1000))
+        self.commit_interval_ms = float(config.get('commit_interval_ms', 1000))
+        self.max_pending_rows = int(config.get('max_pending_rows', 100000))
+        if self.commit_max_rows < 1 or self.max_pending_rows < 1:
+            raise ValueError(f"The commit_max_rows and max_pending_rows of the sqlite dispatcher must be at least 1, "
+                             f"were {self.commit_max_rows} and {self.max_pending_rows}")
+        self.synchronous = str(config.get('synchronous', 'normal')).strip().lower()
+        if self.synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Unknown synchronous '{self.synchronous}' for the sqlite dispatcher, "
+                             f"use one of {SYNCHRONOUS_MODES}")
+        self.compact_encoder = self.create_compact_encoder()
+
+        #
+        # The schema is set up here, so that a bad path or a locked database fails the configuration.
+        #
+        connection = self._connect()
+        try:
+            self._create_schema(connection)
+        finally:
+            connection.close()
+
+        self._insert_sql = f"INSERT INTO {self.table_name} (timestamp_ns, level_id, class_name, message_static, " \
+                           f"instance_id, machine_name, params, exception_text) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+        self._cond = threading.Condition()
+        self._pending: List[tuple] = []
+        self._uncommitted = 0
+        self._flush_requests = 0
+        self._stopping = False
+        self._writer = threading.Thread(target=self._run_writer, name='alienprobe-sqlite-writer', daemon=True)
+        self._writer.start()
+        atexit.register(self.flush)
+
+    def write_message(self, message_object: Message) -> bool:
+        """
+        Base method that writes a message to whatever resource you are writing messages to.  Like files, whatever.
+        :param message_object: The log message values we need to write.
+        :return: True if the message was written.
+        """
+        return self.write_messages([message_object]) == 1
+
+    def write_messages(self, batch: Sequence[Message]) -> int:
+        """
+        Builds the rows, and hands them to the writer thread.
+        :param batch: The messages to write.
+        :return: How many messages were queued for the writer.
+        """
+        rows = [self.build_row(message_object) for message_object in batch]
+
+        with self._cond:
+            if self._stopping:
+                return 0
+            room = self.max_pending_rows - len(self._pending)
+            if len(rows) > room:
+                self.dropped_count += len(rows) - max(room, 0)
+                rows = rows[:max(room, 0)]
+            self._pending.extend(rows)
+            self._cond.notify()
+        return len(rows)
+
+    def build_row(self, message_object: Message) -> tuple:
+        """
+        The row of a message:  timestamp_ns, level_id, class_name, message_static, instance_id, machine_name, the
+        params as a JSON object, and the exception text.
+        :param message_object: The message.
+        :return: The row.
+        """
+        params_json = None
+        params = message_object.params
+        if params:
+            params = dict(params.items())
+            try:
+                params_json = json.dumps(params, default=json_default, ensure_ascii=False, allow_nan=False)
+            except (TypeError, ValueError, RecursionError):
+                params_json = json.dumps({str(param_key): self._json_param(param_val)
+                                          for param_key, param_val in params.items()},
+                                         default=json_default, ensure_ascii=False)
+
+        return (message_object.timestamp_ns, message_object.level.level_id,
+                get_source_name(message_object.class_name), message_object.message_static,
+                message_object.instance_id, message_object.machine_name, params_json, message_object.exception_text)
+
+    def _json_param(self, value):
+        """
+        A param value as it goes into the JSON, when the params as a whole could not be encoded:  NaN, a container
+        that holds itself...  Those values go as the text of the compact encoder, the others as they are.
+        """
+        if value.__class__ in _JSON_SCALARS:
+            return value
+        try:
+            json.dumps(value, default=json_default, allow_nan=False)
+            return value
+        except (TypeError, ValueError, RecursionError):
+            return self.compact_encoder.encode(value)
+
+    def flush(self, timeout: float = 10):
+        """
+        Waits until the writer thread has inserted and committed everything that was written before.
+        :param timeout: The most seconds we wait.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._flush_requests += 1
+            self._cond.notify_all()
+            try:
+                while (self._pending or self._uncommitted) and self._writer.is_alive():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return
+                    self._cond.wait(remaining)
+            finally:
+                self._flush_requests -= 1
+
+    def close(self):
+        """
+        Commits what is waiting, stops the writer thread and closes its connection.  Messages written after this are
+        dropped.
+        """
+        with self._cond:
+            if self._stopping:
+                return
+            self._stopping = True
+            self._cond.notify_all()
+        atexit.unregister(self.flush)
+        self._writer.join()
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Opens a connection in WAL mode, with our synchronous mode.
+        """
+        connection = sqlite3.connect(self.database_path, timeout=30, isolation_level='DEFERRED')
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(f'PRAGMA synchronous={self.synchronous}')
+        return connection
+
+    def _create_schema(self, connection: sqlite3.Connection):
+        """
+        Creates the table and the configured indexes, if they do not exist.
+        """
+        table = self.table_name
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, timestamp_ns INTEGER "
+                           f"NOT NULL, level_id INTEGER NOT NULL, class_name TEXT, message_static TEXT, "
+                           f"instance_id TEXT, machine_name TEXT, params TEXT, exception_text TEXT)")
+        for index_name in self.indexes:
+            connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_{index_name}_idx ON {table} "
+                               f"({', '.join(INDEXES[index_name])})")
+        connection.commit()
+
+    def _run_writer(self):
+        """
+        The writer thread:  inserts the pending rows with executemany, and commits on the row count or the
+        interval, or when flush() or close() asks for it.
+        """
+        connection = self._connect()
+        interval = self.commit_interval_ms / 1000
+        oldest_uncommitted: Optional[float] = None
+        try:
+            while True:
+                with self._cond:
+                    while not self._pending and not self._stopping and not (self._flush_requests and self._uncommitted):
+                        if oldest_uncommitted is None:
+                            self._cond.wait()
+                            continue
+                        remaining = oldest_uncommitted + interval - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    rows = self._pending[:self.commit_max_rows]
+                    del self._pending[:len(rows)]
+                    more_pending = bool(self._pending)
+                    stopping = self._stopping
+                    flush_requested = bool(self._flush_requests)
+
+                if rows:
+                    try:
+                        connection.executemany(self._insert_sql, rows)
+                    except sqlite3.Error:
+                        self._rollback(connection)
+                        oldest_uncommitted = None
+                        with self._cond:
+                            self.error_count += self._uncommitted + len(rows)
+                            self._uncommitted = 0
+                            self._cond.notify_all()
+                        continue
+                    if oldest_uncommitted is None:
+                        oldest_uncommitted = time.monotonic()
+                    with self._cond:
+                        self._uncommitted += len(rows)
+
+                if self._uncommitted and (self._uncommitted >= self.commit_max_rows
+                                          or time.monotonic() - oldest_uncommitted >= interval
+                                          or ((stopping or flush_requested) and not more_pending)):
+                    committed = self._uncommitted
+                    try:
+                        connection.commit()
+                    except sqlite3.Error:
+                        self._rollback(connection)
+                        committed = 0
+                    oldest_uncommitted = None
+                    with self._cond:
+                        if committed:
+                            self.written_count += committed
+                        else:
+                            self.error_count += self._uncommitted
+                        self._uncommitted = 0
+                        self._cond.notify_all()
+
+                if stopping and not more_pending and not self._uncommitted:
+                    return
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _rollback(connection: sqlite3.Connection):
+        """
+        Rolls back the open transaction after an error, ignoring what else can go wrong.
+        """
+        try:
+            connection.rollback()
+        except sqlite3.Error:
+            pass
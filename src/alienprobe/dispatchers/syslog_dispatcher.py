@@ -0,0 +1,290 @@
+"""
+A dispatcher that sends every message to syslog, one datagram per message, over the local Unix datagram socket
+(/dev/log) or UDP.  The frames are RFC 5424 by default:
+
+    <134>1 2024-01-02T03:04:05.123456Z worker-01 myapp 4242 - - class="myapp.mymodule" message="Read input file" ...
+
+or the older BSD format of RFC 3164, which some daemons still expect:
+
+    <134>Jan  2 03:04:05 worker-01 myapp[4242]: class="myapp.mymodule" message="Read input file" ...
+
+The sends never block:  when the socket buffer is full (the daemon is behind, or gone), the message is dropped and
+counted in dropped_count, the application does not wait for syslog.
+"""
+import os
+import re
+import socket
+import sys
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+from alienprobe.dispatchers.base_dispatcher import BaseDispatcher
+from alienprobe.dispatchers.date_cache import DateFormatCache
+from alienprobe.dispatchers.message_template import CompiledMessageFormat
+from alienprobe.log_levels import LogLevels
+from alienprobe.message import Message
+
+
+"""
+The syslog facility codes, by name.
+"""
+FACILITIES: Dict[str, int] = {
+    'kern': 0, 'user': 1, 'mail': 2, 'daemon': 3, 'auth': 4, 'syslog': 5, 'lpr': 6, 'news': 7, 'uucp': 8,
+    'cron': 9, 'authpriv': 10, 'ftp': 11, 'local0': 16, 'local1': 17, 'local2': 18, 'local3': 19, 'local4': 20,
+    'local5': 21, 'local6': 22, 'local7': 23,
+}
+
+"""
+The syslog severity of every level id.  Syslog has nothing below debug, so TRACE is debug as well.
+"""
+SEVERITIES: Dict[int, int] = {
+    LogLevels.TRACE.level_id: 7,
+    LogLevels.DEBUG.level_id: 7,
+    LogLevels.INFO.level_id: 6,
+    LogLevels.NOTICE.level_id: 5,
+    LogLevels.WARNING.level_id: 4,
+    LogLevels.ERROR.level_id: 3,
+    LogLevels.CRITICAL.level_id: 2,
+    LogLevels.FATAL.level_id: 1,
+}
+
+PROTOCOLS = ('rfc5424', 'rfc3164')
+
+"""
+What is not allowed in the header fields of RFC 5424 (printable US-ASCII, no spaces).
+"""
+_NOT_PRINTABLE = re.compile(r'[^\x21-\x7e]')
+
+
+def header_field(value: str, max_length: int) -> str:
+    """
+    Cleans up a header field (host name, app name...):  no spaces or non ASCII characters, and not too long.
+    :param value: The field.
+    :param max_length: The most characters the RFC allows for it.
+    :return: The field, or '-' (the nil value) when it is empty.
+    """
+    return _NOT_PRINTABLE.sub('_', value)[:max_length] or '-'
+
+
+class SyslogDispatcher(BaseDispatcher):
+    """
+    Sends the messages to syslog, without ever blocking.
+    """
+
+    """
+    The Unix datagram socket of the syslog daemon.  Default is /dev/log, when no host is set.
+    """
+    socket_path: Optional[str] = None
+
+    """
+    The host of a syslog server we send to over UDP, instead of the local socket.
+    """
+    host: Optional[str] = None
+
+    """
+    The UDP port of the syslog server.
+    """
+    port: int = 514
+
+    """
+    'rfc5424' (the default) or 'rfc3164', the older BSD format.
+    """
+    protocol: str = 'rfc5424'
+
+    """
+    The syslog facility, like 'user' or 'local0'.
+    """
+    facility: str = 'user'
+
+    """
+    The APP-NAME (the tag in RFC 3164).  Default is the name of the program.
+    """
+    app_name: str
+
+    """
+    The longest datagram we send, longer messages are cut.  Default is 2048 over UDP (what RFC 5424 says every
+    receiver should take), and 8192 on the local socket.
+    """
+    max_message_bytes: int
+
+    """
+    The format of the MSG part of the frame.  The date, level, host name and pid are in the syslog header already.
+    """
+    message_format: str = 'class="[[CLASS_NAME]]" message="[[LOG_MESSAGE_STATIC]]" [[LOG_PARAMS]]'
+
+    """
+    What we append to the message_format for messages with an exception.
+    """
+    exception_format: str = ' exception="[[EXCEPTION_TEXT]]"'
+
+    """
+    The message_format and exception_format, compiled once in config_dispatcher.
+    """
+    compiled_format: CompiledMessageFormat
+
+    """
+    How many messages we sent.
+    """
+    sent_count: int = 0
+
+    """
+    How many messages we dropped, because the socket buffer was full or the daemon could not be reached.
+    """
+    dropped_count: int = 0
+
+    def config_dispatcher(self, config: dict):
+        """
+        We pass in the section of the dispatcher from the toml config file.  This is used to configure the logger,
+        and learn more about how to set itself up.  Like target ip addresses, etc.
+        :param config: The configuration that we are using for this logger.
+        """
+        self.host = config.get('host') or None
+        self.port = int(config.get('port', 514))
+        self.socket_path = config.get('socket_path') or None
+        if self.host and self.socket_path:
+            raise ValueError("The syslog dispatcher sends to a socket_path or to a host, not both.")
+        if not self.host and not self.socket_path:
+            self.socket_path = '/dev/log'
+
+        self.protocol = str(config.get('protocol', 'rfc5424')).strip().lower()
+        if self.protocol not in PROTOCOLS:
+            raise ValueError(f"Unknown protocol '{self.protocol}' for the syslog dispatcher, use one of {PROTOCOLS}")
+        self.facility = str(config.get('facility', 'user')).strip().lower()
+        if self.facility not in FACILITIES:
+            raise ValueError(f"Unknown syslog facility '{self.facility}', use one of {list(FACILITIES)}")
+        self.app_name = config.get('app_name') or os.path.basename(sys.argv[0] if sys.argv and sys.argv[0]
+                                                                   else '') or 'python'
+        self.max_message_bytes = int(config.get('max_message_bytes', 2048 if self.host else 8192))
+        if self.max_message_bytes < 480:
+            raise ValueError(f"The max_message_bytes of the syslog dispatcher must be at least 480, "
+                             f"was {self.max_message_bytes}")
+
+        self.message_format = config.get('message_format', self.message_format)
+        self.exception_format = config.get('exception_format', self.exception_format)
+        self.compiled_format = self.compile_message_format(message_format=self.message_format,
+                                                           exception_format=self.exception_format,
+                                                           datetime_format='%Y-%m-%dT%H:%M:%S.%fZ', log_utc=True)
+        if self.protocol == 'rfc5424':
+            self.date_cache = DateFormatCache(datetime_format='%Y-%m-%dT%H:%M:%S.%fZ', log_utc=True)
+        else:
+            self.date_cache = DateFormatCache(datetime_format='%b %d %H:%M:%S', log_utc=False)
+
+        #
+        # The PRI (and version) of every level, and the rest of the header around the date, which only changes with
+        # the host name and the pid, are built once.
+        #
+        facility_code = FACILITIES[self.facility]
+        version = '1 ' if self.protocol == 'rfc5424' else ''
+        self._priorities = {level_id: f"<{facility_code * 8 + severity}>{version}"
+                            for level_id, severity in SEVERITIES.items()}
+        self._header: Tuple[Optional[Tuple[str, int]], str] = (None, '')
+
+        self._lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self._connect()
+
+    def write_message(self, message_object: Message) -> bool:
+        """
+        Base method that writes a message to whatever resource you are writing messages to.  Like files, whatever.
+        :param message_object: The log message values we need to write.
+        :return: True if the message was written.
+        """
+        return self.write_messages([message_object]) == 1
+
+    def write_messages(self, batch: Sequence[Message]) -> int:
+        """
+        Sends one datagram per message.  A message that does not fit in the socket buffer right now is dropped.
+        :param batch: The messages to write.
+        :return: How many messages were sent.
+        """
+        frames = [self.encode_frame(message_object) for message_object in batch]
+
+        sent = 0
+        with self._lock:
+            sock = self._sock or self._connect()
+            for frame in frames:
+                if sock is None:
+                    break
+                try:
+                    sock.send(frame)
+                    sent += 1
+                except (BlockingIOError, InterruptedError):
+                    pass
+                except OSError:
+                    #
+                    # The daemon went away (or was restarted), we connect again for the next batch.
+                    #
+                    sock.close()
+                    self._sock = sock = None
+
+            self.sent_count += sent
+            self.dropped_count += len(frames) - sent
+        return sent
+
+    def encode_frame(self, message_object: Message) -> bytes:
+        """
+        Builds the syslog frame of a message, cut to max_message_bytes.
+        :param message_object: The message.
+        :return: The datagram.
+        """
+        #
+        # The owner and its header are one tuple, swapped in one assignment, so a thread never pairs the header of
+        # one host name (or pid) with another.
+        #
+        owner = (message_object.machine_name, os.getpid())
+        header_owner, header_middle = self._header
+        if owner != header_owner:
+            header_middle = self._build_header(owner)
+            self._header = (owner, header_middle)
+
+        date_string = self.date_cache.format(message_object.timestamp_ns)
+        if self.protocol == 'rfc3164' and date_string[4] == '0':
+            date_string = date_string[:4] + ' ' + date_string[5:]
+
+        frame = (self._priorities[message_object.level.level_id] + date_string + header_middle +
+                 self.compiled_format.render(message_object)).encode('utf-8', 'replace')
+        if len(frame) > self.max_message_bytes:
+            #
+            # Cut on a character boundary, half a UTF-8 character would make the receiver reject the whole frame.
+            #
+            frame = frame[:self.max_message_bytes].decode('utf-8', 'ignore').encode('utf-8')
+        return frame
+
+    def close(self):
+        """
+        Closes the socket.  Messages written after this open it again.
+        """
+        with self._lock:
+            if self._sock is not None:
+                self._sock.close()
+                self._sock = None
+
+    def _build_header(self, owner: Tuple[str, int]) -> str:
+        """
+        Builds the header that goes between the date and the MSG, for a host name and a pid.
+        """
+        machine_name, pid = owner
+        if self.protocol == 'rfc5424':
+            return f" {header_field(machine_name, 255)} {header_field(self.app_name, 48)} {pid} - - "
+        return f" {header_field(machine_name, 255)} {header_field(self.app_name, 32)}[{pid}]: "
+
+    def _connect(self) -> Optional[socket.socket]:
+        """
+        Opens the non blocking socket.  A datagram socket is connected, so every send goes to the same place without
+        resolving the address again.  The caller holds the lock (or we are configuring).
+        :return: The socket, or None if the daemon can't be reached right now.
+        """
+        if self.host:
+            sock = socket.socket(socket.AF_INET6 if ':' in self.host else socket.AF_INET, socket.SOCK_DGRAM)
+            address = (self.host, self.port)
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            address = self.socket_path
+        try:
+            sock.connect(address)
+        except OSError:
+            sock.close()
+            return None
+        sock.setblocking(False)
+        self._sock = sock
+        return sock
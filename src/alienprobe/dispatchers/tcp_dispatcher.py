@@ -0,0 +1,401 @@
+"""
+A dispatcher that streams the messages to a log collector over TCP (Logstash, Fluent Bit, Vector...), as JSON lines
+or as text, one record per line or length prefixed.
+
+Logging never waits for the network:  the records go into a bounded in memory spool, and sender threads (one per
+connection of the pool) send them in batches.  When the collector goes away (or restarts), the senders reconnect with
+a jittered exponential backoff, and the spool holds the records in the meantime.  When the spool is full, the oldest
+records are dropped and counted in dropped_count.
+
+The delivery is at least once:  a batch that failed is sent again after the reconnect, so the collector may see
+records twice, or the start of a record cut short by the failed connection.  With more than one connection, the
+records of different batches can arrive out of order.
+"""
+import atexit
+import collections
+import random
+import select
+import socket
+import struct
+import threading
+import time
+from typing import Deque, List, Optional, Sequence
+
+from alienprobe.dispatchers.base_dispatcher import BaseDispatcher
+from alienprobe.dispatchers.json_lines_dispatcher import JsonLinesDispatcher
+from alienprobe.dispatchers.message_template import CompiledMessageFormat
+from alienprobe.message import Message
+
+
+FRAMINGS = ('newline', 'length_prefixed')
+RECORD_FORMATS = ('json', 'text')
+
+"""
+The length prefix of a record, in the length_prefixed framing:  4 bytes, big endian.
+"""
+LENGTH_PREFIX = struct.Struct('>I')
+
+
+def _readable(sock: socket.socket) -> bool:
+    """
+    Is there something to read on the socket right now (data, the end of the stream or an error)?  We poll, select()
+    can't watch a file descriptor past 1023, which a busy process easily has.
+    :param sock: The connected socket.
+    :return: True if a recv would not block.
+    """
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        poller.register(sock, select.POLLIN)
+        return bool(poller.poll(0))
+    return bool(select.select([sock], [], [], 0)[0])
+
+
+class TcpDispatcher(BaseDispatcher):
+    """
+    Streams the messages to a collector over TCP, from a bounded spool, without ever blocking the logging threads.
+    """
+
+    """
+    The host and port of the collector.
+    """
+    host: str
+    port: int
+
+    """
+    How the records are delimited:  'newline' (every record ends with a line feed, the line feeds inside a text
+    record are escaped as \\n) or 'length_prefixed' (every record starts with its length, on 4 bytes big endian).
+    """
+    framing: str = 'newline'
+
+    """
+    What a record is:  'json', a JSON object like the ones of the json lines dispatcher, or 'text', the
+    message_format like the console.
+    """
+    record_format: str = 'json'
+
+    """
+    How many connections (and sender threads) we keep to the collector.
+    """
+    pool_size: int = 1
+
+    """
+    The most bytes of records we hold while the collector can't keep up, or can't be reached.  Past that, the oldest
+    records are dropped.
+    """
+    spool_max_bytes: int = 8 * 1024 * 1024
+
+    """
+    The most bytes a sender sends at once.
+    """
+    batch_max_bytes: int = 64 * 1024
+
+    """
+    The backoff between two connection attempts:  the first retry waits up to reconnect_min_ms, then the wait
+    doubles at every failure, up to reconnect_max_ms.  The actual wait is random, between 0 and that, so that many
+    processes don't all reconnect at once after a collector restart.
+    """
+    reconnect_min_ms: float = 100
+    reconnect_max_ms: float = 30000
+
+    """
+    How long connecting, and sending a batch, may take before we give up on the connection.
+    """
+    socket_timeout_seconds: float = 10
+
+    """
+    How long flush() (and close()) waits for the spool to be sent, while we are connected.
+    """
+    flush_timeout_seconds: float = 5
+
+    """
+    The message_format and exception_format of the 'text' records.
+    """
+    message_format: str = 'machine_name="[[MACHINE_NAME]]" instance="[[INSTANCE_ID]]" date="[[DATE_STRING]]" ' \
+                          'level="[[LOG_LEVEL]]" class="[[CLASS_NAME]]" message="[[LOG_MESSAGE_STATIC]]" ' \
+                          '[[LOG_PARAMS]]'
+    exception_format: str = ' exception="[[EXCEPTION_TEXT]]"'
+
+    """
+    The message_format and exception_format, compiled once in config_dispatcher, for the 'text' records.
+    """
+    compiled_format: CompiledMessageFormat
+
+    """
+    The strftime format of the dates, and do we write them in UTC.
+    """
+    datetime_format: str = '%Y-%m-%dT%H:%M:%S.%fZ'
+    log_utc_timezone: bool = True
+
+    """
+    How many records were sent, dropped from a full spool, and how many connections we opened.
+    """
+    sent_count: int = 0
+    dropped_count: int = 0
+    connect_count: int = 0
+
+    def config_dispatcher(self, config: dict):
+        """
+        We pass in the section of the dispatcher from the toml config file.  This is used to configure the logger,
+        and learn more about how to set itself up.  Like target ip addresses, etc.
+        :param config: The configuration that we are using for this logger.
+        """
+        self.host = config.get('host')
+        if not self.host or not config.get('port'):
+            raise ValueError("The tcp dispatcher needs the host and port of the collector.")
+        self.port = int(config['port'])
+
+        self.framing = str(config.get('framing', 'newline')).strip().lower()
+        if self.framing not in FRAMINGS:
+            raise ValueError(f"Unknown framing '{self.framing}' for the tcp dispatcher, use one of {FRAMINGS}")
+        self.record_format = str(config.get('record_format', 'json')).strip().lower()
+        if self.record_format not in RECORD_FORMATS:
+            raise ValueError(f"Unknown record_format '{self.record_format}' for the tcp dispatcher, "
+                             f"use one of {RECORD_FORMATS}")
+
+        self.pool_size = int(config.get('pool_size', 1))
+        self.spool_max_bytes = int(config.get('spool_max_bytes', 8 * 1024 * 1024))
+        self.batch_max_bytes = int(config.get('batch_max_bytes', 64 * 1024))
+        if self.pool_size < 1 or self.spool_max_bytes < 1 or self.batch_max_bytes < 1:
+            raise ValueError(f"The pool_size, spool_max_bytes and batch_max_bytes of the tcp dispatcher must be at "
+                             f"least 1, were {self.pool_size}, {self.spool_max_bytes} and {self.batch_max_bytes}")
+        self.reconnect_min_ms = float(config.get('reconnect_min_ms', 100))
+        self.reconnect_max_ms = float(config.get('reconnect_max_ms', 30000))
+        self.socket_timeout_seconds = float(config.get('socket_timeout_seconds', 10))
+        self.flush_timeout_seconds = float(config.get('flush_timeout_seconds', 5))
+
+        self.datetime_format = config.get('datetime_format', self.datetime_format)
+        self.log_utc_timezone = bool(config.get('log_utc_timezone', True))
+        if self.record_format == 'json':
+            self._json_encoder = JsonLinesDispatcher()
+            self._json_encoder.config_param_limits(config)
+            self._json_encoder.config_dispatcher({'datetime_format': self.datetime_format,
+                                                  'log_utc_timezone': self.log_utc_timezone,
+                                                  'ensure_ascii': config.get('ensure_ascii', False)})
+        else:
+            self.message_format = config.get('message_format', self.message_format)
+            self.exception_format = config.get('exception_format', self.exception_format)
+            self.compiled_format = self.compile_message_format(message_format=self.message_format,
+                                                               exception_format=self.exception_format,
+                                                               datetime_format=self.datetime_format,
+                                                               log_utc=self.log_utc_timezone)
+
+        self._cond = threading.Condition()
+        self._spool: Deque[bytes] = collections.deque()
+        self._spool_bytes = 0
+        self._in_flight = 0
+        self._connected = 0
+        self._stop = threading.Event()
+        self._senders = [threading.Thread(target=self._run_sender, name=f'alienprobe-tcp-sender-{index}',
+                                          daemon=True)
+                         for index in range(self.pool_size)]
+        for sender in self._senders:
+            sender.start()
+        atexit.register(self.flush)
+
+    def write_message(self, message_object: Message) -> bool:
+        """
+        Base method that writes a message to whatever resource you are writing messages to.  Like files, whatever.
+        :param message_object: The log message values we need to write.
+        :return: True if the message was written.
+        """
+        return self.write_messages([message_object]) == 1
+
+    def write_messages(self, batch: Sequence[Message]) -> int:
+        """
+        Encodes the records, and puts them in the spool for the senders.  Never waits for the network.
+        :param batch: The messages to write.
+        :return: How many messages were spooled.
+        """
+        records = [self.encode_record(message_object) for message_object in batch]
+
+        with self._cond:
+            if self._stop.is_set():
+                return 0
+            spool = self._spool
+            spool.extend(records)
+            self._spool_bytes += sum(len(record) for record in records)
+            while self._spool_bytes > self.spool_max_bytes and spool:
+                self._spool_bytes -= len(spool.popleft())
+                self.dropped_count += 1
+            self._cond.notify()
+        return len(records)
+
+    def encode_record(self, message_object: Message) -> bytes:
+        """
+        Encodes a message as a record, with its framing.
+        :param message_object: The message.
+        :return: The record.
+        """
+        if self.record_format == 'json':
+            text = self._json_encoder.encode_line(message_object)
+            if self.framing == 'newline':
+                return text.encode()
+            record = text[:-1].encode()
+        else:
+            text = self.compiled_format.render(message_object)
+            if self.framing == 'newline':
+                return (text.replace('\n', '\\n') + '\n').encode()
+            record = text.encode()
+        return LENGTH_PREFIX.pack(len(record)) + record
+
+    def flush(self):
+        """
+        Waits (up to flush_timeout_seconds) for the spool to be sent.  Does not wait when we are not connected.
+        """
+        deadline = time.monotonic() + self.flush_timeout_seconds
+        with self._cond:
+            while (self._spool or self._in_flight) and self._connected:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                self._cond.wait(remaining)
+
+    def close(self):
+        """
+        Sends what is left in the spool (like flush), then stops the senders and closes the connections.  Messages
+        written after this are dropped.
+        """
+        if self._stop.is_set():
+            return
+        atexit.unregister(self.flush)
+        self.flush()
+        with self._cond:
+            self._stop.set()
+            self._cond.notify_all()
+        for sender in self._senders:
+            sender.join(self.socket_timeout_seconds)
+
+    @property
+    def spooled_bytes(self) -> int:
+        """
+        How many bytes of records are waiting to be sent.
+        """
+        return self._spool_bytes
+
+    def backoff_seconds(self, failures: int) -> float:
+        """
+        How long we wait before the next connection attempt, with full jitter.
+        :param failures: How many attempts failed in a row.
+        :return: The wait, in seconds.
+        """
+        ceiling = min(self.reconnect_max_ms, self.reconnect_min_ms * 2 ** min(failures - 1, 32))
+        return random.uniform(0, ceiling) / 1000
+
+    def _run_sender(self):
+        """
+        A sender thread:  keeps its connection to the collector, and sends batches from the spool until we are
+        closed.
+        """
+        sock: Optional[socket.socket] = None
+        failures = 0
+        while True:
+            with self._cond:
+                while not self._spool and not self._stop.is_set():
+                    self._cond.wait()
+                if not self._spool:
+                    break
+
+            if sock is not None and self._peer_closed(sock):
+                sock = self._disconnect(sock)
+            if sock is None:
+                sock = self._connect()
+                if sock is None:
+                    failures += 1
+                    if self._stop.wait(self.backoff_seconds(failures)):
+                        break
+                    continue
+                failures = 0
+
+            batch = self._take_batch()
+            if not batch:
+                continue
+            try:
+                sock.sendall(b''.join(batch))
+            except OSError:
+                sock = self._disconnect(sock)
+                self._put_back(batch)
+                failures += 1
+                if self._stop.wait(self.backoff_seconds(failures)):
+                    break
+                continue
+
+            with self._cond:
+                self._in_flight -= len(batch)
+                self.sent_count += len(batch)
+                self._cond.notify_all()
+
+        if sock is not None:
+            self._disconnect(sock)
+
+    def _take_batch(self) -> List[bytes]:
+        """
+        Takes records from the spool, up to batch_max_bytes (but at least one).
+        """
+        batch = []
+        with self._cond:
+            spool = self._spool
+            size = 0
+            while spool and (not batch or size + len(spool[0]) <= self.batch_max_bytes):
+                record = spool.popleft()
+                size += len(record)
+                batch.append(record)
+            self._spool_bytes -= size
+            self._in_flight += len(batch)
+        return batch
+
+    def _put_back(self, batch: List[bytes]):
+        """
+        Puts a batch that could not be sent back at the head of the spool, unless newer records filled it up.
+        """
+        with self._cond:
+            self._in_flight -= len(batch)
+            room = self.spool_max_bytes - self._spool_bytes
+            for record in reversed(batch):
+                if len(record) > room:
+                    self.dropped_count += 1
+                    continue
+                self._spool.appendleft(record)
+                self._spool_bytes += len(record)
+                room -= len(record)
+            self._cond.notify_all()
+
+    def _connect(self) -> Optional[socket.socket]:
+        """
+        Opens a connection to the collector.
+        :return: The socket, or None if the collector can't be reached right now.
+        """
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.socket_timeout_seconds)
+        except OSError:
+            return None
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self._cond:
+            self._connected += 1
+            self.connect_count += 1
+        return sock
+
+    def _disconnect(self, sock: socket.socket) -> None:
+        """
+        Closes a connection.
+        :return: None, for the caller to forget the socket.
+        """
+        sock.close()
+        with self._cond:
+            self._connected -= 1
+            self._cond.notify_all()
+        return None
+
+    @staticmethod
+    def _peer_closed(sock: socket.socket) -> bool:
+        """
+        Did the collector close the connection?  A send on a connection the peer closed still succeeds once, and
+        the batch would be lost, so we look before every batch.  Whatever the collector sends us (acks, echoes) is
+        read and thrown away.  Only an end of stream or a connection error counts as closed.
+        """
+        try:
+            while _readable(sock):
+                if not sock.recv(65536):
+                    return True
+            return False
+        except OSError:
+            return True
@@ -0,0 +1,146 @@
+"""
+Renders the stack traces of the logged exceptions.  A stack trace is rendered once per message, when the logger
+builds it (see Message.exception_text), and every dispatcher that writes the message shares the text.  On top of
+that, in a retry storm the same stack trace comes in thousands of times a second, so we can dedup them:  within
+exception_dedup_seconds (in [common]), only the first occurrence of a stack trace is written in full, the next ones
+are a one line reference to it.
+
+    [fingerprint 3f2a9c1d07be]
+    Traceback (most recent call last):
+      ...
+    ConnectionError: Connection refused
+
+    ConnectionError: Connection refused [same stack trace as fingerprint 3f2a9c1d07be, repeat 42 within 60s]
+
+The fingerprint is the exception type and the code locations (file, function, line) of the frames, of the exception
+and of its cause or context.  The message of the exception is not part of it, so 'id 1 failed' and 'id 2 failed' from
+the same place share their stack trace.
+"""
+import hashlib
+import threading
+import time
+import traceback
+from typing import Dict, List
+
+
+def format_exception_text(ex: BaseException) -> str:
+    """
+    Renders the full stack trace of an exception, every line followed by an empty one, like we always did.
+    :param ex: The exception.
+    :return: The text.
+    """
+    return ''.join([ex_str + '\n' for ex_str in traceback.format_exception(type(ex), ex, ex.__traceback__)])
+
+
+def exception_fingerprint(ex: BaseException) -> str:
+    """
+    The fingerprint of the stack trace of an exception:  its type, and the code locations of its frames, for the
+    exception and its chain of causes.  Much cheaper than rendering it.
+    :param ex: The exception.
+    :return: 12 hex characters.
+    """
+    parts: List[str] = []
+    seen = set()
+    while ex is not None and id(ex) not in seen and len(seen) < 16:
+        seen.add(id(ex))
+        ex_type = type(ex)
+        parts.append(f"{ex_type.__module__}.{ex_type.__qualname__}")
+        tb = ex.__traceback__
+        while tb is not None:
+            code = tb.tb_frame.f_code
+            parts.append(f"{code.co_filename}:{code.co_name}:{tb.tb_lineno}")
+            tb = tb.tb_next
+        ex = ex.__cause__ if ex.__cause__ is not None else (None if ex.__suppress_context__ else ex.__context__)
+
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()[:12]
+
+
+class ExceptionTextCache:
+    """
+    Renders the stack traces, and dedups the repeated ones within a time window.
+    """
+
+    """
+    How long (in seconds) a stack trace is only referenced, after it was written in full.  0 writes every stack
+    trace in full, and does not compute fingerprints.
+    """
+    dedup_seconds: float
+
+    """
+    The most fingerprints we remember, the oldest ones are forgotten first.
+    """
+    max_entries: int
+
+    """
+    For every fingerprint in its window:  when it was written in full (time.monotonic()), and how many times it was
+    referenced since.
+    """
+    _entries: Dict[str, List]
+
+    def __init__(self, dedup_seconds: float = 0, max_entries: int = 1024):
+        """
+        Constructor.
+        :param dedup_seconds: How long a stack trace is only referenced, after it was written in full.  0 is off.
+        :param max_entries: The most fingerprints we remember.
+        """
+        self.dedup_seconds = dedup_seconds
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def configure(self, dedup_seconds: float):
+        """
+        Changes the dedup window, and forgets the fingerprints we have seen.
+        :param dedup_seconds: How long a stack trace is only referenced, after it was written in full.  0 is off.
+        """
+        with self._lock:
+            self.dedup_seconds = dedup_seconds
+            self._entries = {}
+
+    def render(self, ex: BaseException) -> str:
+        """
+        Renders an exception in full, or as a reference to the same stack trace written in full within the window.
+        :param ex: The exception.
+        :return: The text.
+        """
+        dedup_seconds = self.dedup_seconds
+        if dedup_seconds <= 0:
+            return format_exception_text(ex)
+
+        fingerprint = exception_fingerprint(ex)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is not None and now - entry[0] < dedup_seconds:
+                entry[1] += 1
+                repeat_count = entry[1]
+            else:
+                self._entries.pop(fingerprint, None)
+                if len(self._entries) >= self.max_entries:
+                    del self._entries[next(iter(self._entries))]
+                self._entries[fingerprint] = [now, 0]
+                repeat_count = 0
+
+        if repeat_count:
+            summary = traceback.format_exception_only(type(ex), ex)[-1].rstrip('\n')
+            return f"{summary} [same stack trace as fingerprint {fingerprint}, repeat {repeat_count} within " \
+                   f"{dedup_seconds:g}s]"
+
+        return f"[fingerprint {fingerprint}]\n" + format_exception_text(ex)
+
+
+"""
+The cache every dispatcher renders with.  The logger sets its window from exception_dedup_seconds in [common].
+"""
+EXCEPTION_TEXT_CACHE = ExceptionTextCache()
+
+
+def exception_text(ex: BaseException) -> str:
+    """
+    Renders the text of an exception that is being logged.  The logger calls it once per message, the dispatchers
+    read Message.exception_text.  An exception that is logged again (say re-raised and logged higher up) is rendered
+    again, with its traceback as it is now, and the dedup window as it is now.
+    :param ex: The exception.
+    :return: The full stack trace, or a reference to it.
+    """
+    return EXCEPTION_TEXT_CACHE.render(ex)
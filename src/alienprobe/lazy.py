@@ -0,0 +1,187 @@
+"""
+Lazy log parameters.  Some parameters are expensive to compute (sizes, the repr of a big object, a dump of a nested
+dict...), and they are wasted when the message is filtered out by its level.  Pass a function or a lambda (or
+lazy(...)) instead of the value, or instead of the whole params dict, and it is only computed when a dispatcher
+renders the message (or when the rate limits key on its params, see alienprobe.rate_limiter).
+Other callables (bound methods, partials, objects with a __call__) are plain values, rendered as they are, so wrap
+them in lazy(...) to have them called.
+
+    logger.debug(self, 'Loaded cache', {'entries': lazy(lambda: len(cache)), 'dump': lambda: repr(cache)})
+    logger.trace(self, 'State', lambda: {'state': self.dump_state()})
+
+A lazy value is computed at most once per message, and shared by all the dispatchers that render it.  Note that it is
+computed when the message is rendered, which is on the writer thread in the async mode, so don't make it depend on
+state that changes right after you log.
+"""
+import threading
+from collections.abc import Mapping
+from types import FunctionType
+from typing import Any, Callable, Iterator, Optional, Union
+
+
+class Lazy:
+    """
+    Wraps a callable that computes a log parameter.  Functions and lambdas are lazy as they are, any other callable
+    (a bound method, a partial...) has to be wrapped.
+    """
+    __slots__ = ('func',)
+
+    def __init__(self, func: Callable[[], Any]):
+        """
+        Constructor.
+        :param func: Computes the value, takes no arguments.
+        """
+        self.func = func
+
+    def __call__(self):
+        """
+        Computes the value.
+        :return: The value of the parameter.
+        """
+        return self.func()
+
+
+def lazy(func: Callable[[], Any]) -> Lazy:
+    """
+    Marks a log parameter as lazy, like {'size': lazy(lambda: len(big_list))}
+    :param func: Computes the value, takes no arguments.
+    :return: The lazy parameter.
+    """
+    return Lazy(func)
+
+
+def is_lazy(value: Any) -> bool:
+    """
+    Is this parameter value computed on demand?  Only a lazy(...) wrapper, a function or a lambda is.  A bound
+    method, a partial or an object with a __call__ may well be the value itself, so we don't call those.
+    :param value: The parameter value.
+    :return: True if we call it to get the value.
+    """
+    return isinstance(value, (Lazy, FunctionType))
+
+
+def wrap_params(log_params: Union[dict, Callable[[], dict], None]) -> Union[dict, 'LazyParams', None]:
+    """
+    Wraps the params in a LazyParams if the dict is a callable, or holds a lazy value.  Otherwise it is returned as is.
+    :param log_params: The params, as passed to the logger.
+    :return: The params to put on the message.
+    """
+    if not log_params or isinstance(log_params, LazyParams):
+        return log_params
+
+    if isinstance(log_params, dict):
+        for value in log_params.values():
+            if is_lazy(value):
+                return LazyParams(log_params)
+        return log_params
+
+    if is_lazy(log_params):
+        return LazyParams(log_params)
+
+    raise ValueError(f"The log params must be a dictionary, a callable returning one, or None.  "
+                     f"Got a {type(log_params).__name__}")
+
+
+class LazyParams(Mapping):
+    """
+    The params of a message, computed the first time something reads them.  It is a read only mapping, so the
+    dispatchers can use it like the params dict.
+    """
+
+    """
+    The params as passed, a dict holding lazy values, or a callable that returns the dict.
+    """
+    _source: Union[dict, Callable[[], dict]]
+
+    """
+    The computed params, None until they are read.
+    """
+    _resolved: Optional[dict]
+
+    def __init__(self, source: Union[dict, Callable[[], dict]]):
+        """
+        Constructor.  Nothing is computed yet.
+        :param source: A dict holding lazy values, or a callable that returns the dict.
+        """
+        self._source = source
+        self._resolved = None
+        self._lock = threading.Lock()
+
+    def resolve(self) -> dict:
+        """
+        Computes the params, once.  If two dispatchers (or threads) render at the same time, the second one waits
+        for the first.  A lazy value that fails renders its error, instead of breaking the dispatcher.
+        :return: The computed params.
+        """
+        resolved = self._resolved
+        if resolved is not None:
+            return resolved
+
+        with self._lock:
+            if self._resolved is None:
+                self._resolved = self._compute()
+            return self._resolved
+
+    def _compute(self) -> dict:
+        """
+        Calls the lazy values.
+        :return: The computed params.
+        """
+        source = self._source
+        if not isinstance(source, dict):
+            try:
+                source = source()
+            except Exception as ex:
+                return {'lazy_params_error': repr(ex)}
+            if not source:
+                return {}
+            if not isinstance(source, dict):
+                return {'lazy_params_error': f"The params callable returned a {type(source).__name__}, not a dict"}
+
+        resolved = {}
+        for key, value in source.items():
+            if is_lazy(value):
+                try:
+                    value = value()
+                except Exception as ex:
+                    value = f"<lazy param failed: {ex!r}>"
+            resolved[key] = value
+        return resolved
+
+    @property
+    def is_resolved(self) -> bool:
+        """
+        Were the params computed yet?
+        :return: True once something read them.
+        """
+        return self._resolved is not None
+
+    def __getitem__(self, key):
+        """
+        Gets a computed param.
+        """
+        return self.resolve()[key]
+
+    def __iter__(self) -> Iterator:
+        """
+        Iterates over the param names.
+        """
+        return iter(self.resolve())
+
+    def __len__(self) -> int:
+        """
+        How many params there are.
+        """
+        return len(self.resolve())
+
+    def items(self):
+        """
+        The computed (name, value) pairs, straight from the computed dict.
+        """
+        return self.resolve().items()
+
+    def __repr__(self):
+        """
+        String representation for debugging.  Does not compute anything.
+        """
+        return f"LazyParams({self._resolved!r})" if self._resolved is not None else "LazyParams(<not computed>)"
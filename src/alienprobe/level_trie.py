@@ -0,0 +1,157 @@
+"""
+A trie of dotted module and package names to log levels.  This is what lets you set 'myapp.mymodule = debug' in the
+[log_levels] section of the config file, and have every module and class under myapp.mymodule log at debug, while
+the rest of the application stays at the default level.
+"""
+from typing import Optional, Dict, Union
+
+from alienprobe.log_levels import LogLevel, LogLevels
+
+
+class LevelTrieNode:
+    """
+    A single part of a dotted name (like 'mymodule' in 'myapp.mymodule') in the level trie.
+    """
+
+    """
+    The child nodes, by the next part of the dotted name.
+    """
+    children: Dict[str, 'LevelTrieNode']
+
+    """
+    The level that was configured for this exact prefix, or None if it was not configured and we inherit the level
+    of the parent.
+    """
+    level: Optional[LogLevel]
+
+    def __init__(self):
+        """
+        Constructor, a node starts with no children and no level of its own.
+        """
+        self.children = {}
+        self.level = None
+
+
+class LevelTrie:
+    """
+    Finds the log level of a log source by the longest matching dotted prefix.  For example, with 'myapp = info' and
+    'myapp.db = trace', the source 'myapp.db.pool' logs at TRACE, 'myapp.web' at INFO and 'otherapp' at the default
+    level.  A lookup only walks the parts of the name, it never scans the configured prefixes.
+    """
+
+    """
+    The root of the trie, which holds the default level.
+    """
+    _root: LevelTrieNode
+
+    def __init__(self, default_level: LogLevel = LogLevels.DEBUG):
+        """
+        Constructor for the trie.
+        :param default_level: The level of every source that does not match any configured prefix.
+        """
+        self._root = LevelTrieNode()
+        self._root.level = default_level
+
+    @property
+    def default_level(self) -> LogLevel:
+        """
+        The level of every source that does not match any configured prefix.
+        :return: The default level.
+        """
+        return self._root.level
+
+    @default_level.setter
+    def default_level(self, level: LogLevel):
+        """
+        Sets the level of every source that does not match any configured prefix.
+        :param level: The new default level.
+        """
+        self._root.level = level
+
+    def set_level(self, prefix: str, level: LogLevel):
+        """
+        Sets the log level for a dotted prefix, like 'myapp.mymodule'.
+        :param prefix: The dotted module, package or class name.
+        :param level: The level for the prefix and everything below it.
+        """
+        if not prefix:
+            raise ValueError("Cannot set the log level of an empty prefix, set the default level instead.")
+
+        node = self._root
+        for part in prefix.split('.'):
+            child = node.children.get(part)
+            if child is None:
+                child = LevelTrieNode()
+                node.children[part] = child
+            node = child
+
+        node.level = level
+
+    def load_levels(self, levels: dict, prefix: str = ''):
+        """
+        Loads the levels from the [log_levels] section of the config file.  TOML turns an unquoted dotted key such
+        as myapp.mymodule = 'debug' into nested tables, so we walk them and join the keys back together.  A quoted
+        key such as "myapp.mymodule" = 'debug' works as well.
+        :param levels: The (possibly nested) dict of names to level names.
+        :param prefix: The dotted prefix of the table we are in, empty at the top.
+        """
+        for key, value in levels.items():
+            if not prefix and key == 'default_log_level':
+                continue
+
+            name = f"{prefix}.{key}" if prefix else key
+            if isinstance(value, dict):
+                self.load_levels(value, prefix=name)
+                continue
+
+            level = LogLevels().get_level_by_name(str(value))
+            if not level:
+                raise ValueError(f"Unknown log level '{value}' for '{name}' in the [log_levels] section.")
+            self.set_level(name, level)
+
+    def resolve(self, source_name: str) -> LogLevel:
+        """
+        Finds the level of the longest configured prefix of the given dotted name.
+        :param source_name: The dotted name, like 'myapp.mymodule.MyClass'
+        :return: The level of the source.
+        """
+        node = self._root
+        level = node.level
+        for part in source_name.split('.'):
+            node = node.children.get(part)
+            if node is None:
+                break
+            if node.level is not None:
+                level = node.level
+
+        return level
+
+    def min_level_id(self) -> int:
+        """
+        The lowest level id anywhere in the trie.  Nothing below this level can ever be dispatched, so the logger
+        uses it as a global threshold before it even looks at the source.
+        :return: The lowest configured level id.
+        """
+        lowest = self._root.level.level_id
+        pending = [self._root]
+        while pending:
+            node = pending.pop()
+            if node.level is not None and node.level.level_id < lowest:
+                lowest = node.level.level_id
+            pending.extend(node.children.values())
+
+        return lowest
+
+
+def get_source_name(log_source: Union[str, type, object]) -> str:
+    """
+    Gets the dotted name we match against the trie for a log source.  A string (usually __name__) is used as is,
+    a class or an object gives 'module.ClassName'.
+    :param log_source: The log source, as passed to the logger.
+    :return: The dotted name of the source.
+    """
+    if isinstance(log_source, str):
+        return log_source
+
+    cls = log_source if isinstance(log_source, type) else type(log_source)
+    return f"{cls.__module__}.{cls.__qualname__}"
@@ -0,0 +1,219 @@
+"""
+The asyncio mode.  The logger methods, called on the event loop, only append the message to a queue owned by the
+loop, and a writer task drains it into the dispatchers:  the coroutines of the AsyncBaseDispatchers are awaited on
+the loop, and the plain dispatchers (console, files...) write on a thread of their own, so that their blocking I/O
+never stalls the loop.  Turned on with AlienLogger.start_loop_writer(), from a coroutine.
+"""
+import asyncio
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, List
+
+from alienprobe.dispatchers.async_base_dispatcher import AsyncBaseDispatcher
+from alienprobe.dispatchers.base_dispatcher import BaseDispatcher
+from alienprobe.message import Message
+
+
+class LoopWriter:
+    """
+    A bounded queue of messages owned by an event loop, and the writer task that drains it into the dispatchers.
+    """
+
+    """
+    The event loop that owns the queue.
+    """
+    loop: asyncio.AbstractEventLoop
+
+    """
+    The most messages we hold in the queue.  When it is full, the synchronous logger methods drop the message (they
+    can't wait on the loop they are running on), and the awaitable ones (logger.ainfo()...) wait for some room.
+    """
+    queue_size: int
+
+    """
+    How many messages were put on the queue.
+    """
+    enqueued_count: int = 0
+
+    """
+    How many messages were dropped because the queue was full.
+    """
+    dropped_count: int = 0
+
+    """
+    How many times a dispatcher raised an exception in the writer task.
+    """
+    error_count: int = 0
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, get_dispatchers: Callable[[], Dict[str, BaseDispatcher]],
+                 queue_size: int = 10000):
+        """
+        Constructor for the writer.  Call start() from the loop to start the writer task.
+        :param loop: The event loop that owns the queue and runs the writer task.
+        :param get_dispatchers: Returns the current dispatchers.  We call it for every batch, so that a hot reload of
+        the config is picked up as well.
+        :param queue_size: The most messages we hold in the queue.
+        """
+        if queue_size < 1:
+            raise ValueError(f"The queue_size of the loop writer must be at least 1, was {queue_size}")
+
+        self.loop = loop
+        self.get_dispatchers = get_dispatchers
+        self.queue_size = queue_size
+
+        self._queue: Deque[Message] = deque()
+        self._loop_thread_id = 0
+        self._wakeup = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._progress = asyncio.Event()
+        self._processed_count = 0
+        self._closed = False
+        self._task = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='alienprobe-loop-dispatch')
+
+    def start(self):
+        """
+        Starts the writer task.  Call it on the loop.
+        """
+        self._loop_thread_id = threading.get_ident()
+        self._task = self.loop.create_task(self._run(), name='alienprobe-loop-writer')
+
+    def put(self, message_object: Message) -> bool:
+        """
+        Puts a message on the queue, from the loop or from any other thread, without ever waiting.  A message that
+        does not fit is dropped, and counted.
+        :param message_object: The message to dispatch.
+        :return: False if the writer is stopped, and the caller has to dispatch the message itself.  True if the
+        message was queued, or dropped.
+        """
+        if self._closed:
+            return False
+        on_loop = threading.get_ident() == self._loop_thread_id
+        if not on_loop and self.loop.is_closed():
+            return False
+
+        queue = self._queue
+        if len(queue) >= self.queue_size:
+            self.dropped_count += 1
+            return True
+
+        queue.append(message_object)
+        self.enqueued_count += 1
+
+        #
+        # An asyncio event may only be set on its loop, another thread asks the loop to do it.
+        #
+        if not on_loop:
+            self.loop.call_soon_threadsafe(self._wakeup.set)
+        elif not self._wakeup.is_set():
+            self._wakeup.set()
+        return True
+
+    async def wait_for_room(self):
+        """
+        Waits, on the loop, until the queue has room for another message (or the writer is stopped).
+        """
+        queue = self._queue
+        while len(queue) >= self.queue_size and not self._closed:
+            self._not_full.clear()
+            await self._not_full.wait()
+
+    async def flush(self):
+        """
+        Waits, on the loop, until everything that was queued so far has been written by the dispatchers.
+        """
+        target = self.enqueued_count
+        while self._processed_count < target and not self._task.done():
+            self._progress.clear()
+            await self._progress.wait()
+
+    async def shutdown(self):
+        """
+        Writes what is left on the queue, and stops the writer task.  After this, put() returns False and the logger
+        dispatches on the calling thread again.
+        """
+        if self._closed:
+            return
+
+        self._closed = True
+        self._wakeup.set()
+        self._not_full.set()
+        await self._task
+        self._executor.shutdown(wait=False)
+
+    async def _run(self):
+        """
+        The writer task.  Takes everything that is queued in one go, and hands it to every dispatcher in batches of
+        its batch_size:  the async dispatchers on the loop, the others on the dispatch thread, all of them at the
+        same time.  The next batch is only taken once they all wrote, so every dispatcher gets the messages in order.
+        """
+        queue = self._queue
+        while True:
+            if not queue:
+                if self._closed:
+                    return
+                #
+                # Clear before we look at the queue again, so that a put() from another thread in between is not lost.
+                #
+                self._wakeup.clear()
+                if not queue:
+                    await self._wakeup.wait()
+                continue
+
+            batch = [queue.popleft() for _ in range(len(queue))]
+            self._not_full.set()
+            await self._dispatch(batch)
+            self._processed_count += len(batch)
+            self._progress.set()
+
+    async def _dispatch(self, batch: List[Message]):
+        """
+        Hands a batch to every dispatcher.
+        :param batch: The messages to write, in order.
+        """
+        sync_dispatchers = []
+        writes = []
+        for disp in self.get_dispatchers().values():
+            if isinstance(disp, AsyncBaseDispatcher):
+                if disp.loop is not self.loop:
+                    disp.bind_loop(self.loop)
+                writes.append(self._write_async(disp, batch))
+            else:
+                sync_dispatchers.append(disp)
+
+        if sync_dispatchers:
+            writes.append(self.loop.run_in_executor(self._executor, self._write_sync, sync_dispatchers, batch))
+        await asyncio.gather(*writes)
+
+    async def _write_async(self, disp: AsyncBaseDispatcher, batch: List[Message]):
+        """
+        Awaits the writes of an async dispatcher, in batches of its batch_size.
+        """
+        batch_size = disp.batch_size
+        for start in range(0, len(batch), batch_size):
+            try:
+                await disp.write_messages(batch[start:start + batch_size])
+            except Exception as ex:
+                self._report(disp, ex)
+
+    def _write_sync(self, dispatchers: List[BaseDispatcher], batch: List[Message]):
+        """
+        The dispatch thread:  writes to the plain dispatchers, in batches of their batch_size.
+        """
+        for disp in dispatchers:
+            batch_size = disp.batch_size
+            for start in range(0, len(batch), batch_size):
+                try:
+                    disp.write_messages(batch[start:start + batch_size])
+                except Exception as ex:
+                    self._report(disp, ex)
+
+    def _report(self, disp: BaseDispatcher, ex: Exception):
+        """
+        An exception in a dispatcher must not kill the writer task, and we cannot log it through the logger (it would
+        land on this very queue), so it goes to stderr.
+        """
+        self.error_count += 1
+        print(f"alienprobe: dispatcher {type(disp).__name__} failed in the loop writer: {ex!r}", file=sys.stderr)
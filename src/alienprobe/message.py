@@ -2,26 +2,137 @@
 Just an object that wraps a message being printed.  We do this so its easier for the dispatchers
 to process the messages.
 """
-from typing import Union
+import time
+from operator import itemgetter
+from typing import Mapping, Optional, Union
 
+from alienprobe.exception_text import exception_text as render_exception_text
 from alienprobe.log_levels import LogLevel
 
 
-class Message:
+class Message(tuple):
     """
-    A class which contains an essential message to log.
+    A class which contains an essential message to log.  It is a tuple underneath, so it is compact, it is built in
+    a single call, and it cannot be changed once it is built.  The same message can safely go to many dispatchers,
+    and across threads.  Dispatchers must never change it (or its params), they render from it.
     """
-    level: LogLevel
-    class_name: Union[str, object]
-    message_static: str = None
-    params: dict = {}
-    ex: BaseException = None
-    instance_id: str
-    machine_name: str
+    __slots__ = ()
+
+    """
+    The level we are logging at.
+    """
+    level: LogLevel = property(itemgetter(0))
+
+    """
+    The source that logged, the __name__ string or the object that passed 'self'.
+    """
+    class_name: Union[str, object] = property(itemgetter(1))
+
+    """
+    The static part of the log, like 'Read input file'.
+    """
+    message_static: str = property(itemgetter(2))
+
+    """
+    The log parameters, None if there are none.  A read only LazyParams mapping when some of them are computed on
+    demand (see alienprobe.lazy), so only read them with .items(), [] and the like.
+    """
+    params: Optional[Mapping] = property(itemgetter(3))
+
+    """
+    The exception that was logged, if any.
+    """
+    ex: Optional[BaseException] = property(itemgetter(4))
+
+    """
+    The unique id of the logger instance that logged this.
+    """
+    instance_id: str = property(itemgetter(5))
+
+    """
+    The host name of the machine that logged this.
+    """
+    machine_name: str = property(itemgetter(6))
+
+    """
+    When the message was logged, in nanoseconds since the epoch.  Captured once by the logger, so that every
+    dispatcher shows the same time for the same event.
+    """
+    timestamp_ns: int = property(itemgetter(7))
+
+    """
+    The time.monotonic_ns() of when the message was logged, captured together with timestamp_ns.  The wall clock can
+    jump (NTP, daylight savings...), this one can't, so use it to order messages or to measure how long they waited.
+    """
+    monotonic_ns: int = property(itemgetter(8))
+
+    """
+    The stack trace of the exception (or a reference to it, see alienprobe.exception_text), rendered once when the
+    message is built, so it shows the traceback as it was when we logged, and every dispatcher writes the same text.
+    None if there is no exception.
+    """
+    exception_text: Optional[str] = property(itemgetter(9))
+
+    def __new__(cls, level: LogLevel, class_name: Union[str, object], message_static: str,
+                params: Optional[dict] = None, ex: Optional[BaseException] = None, instance_id: str = 'UNKNOWN',
+                machine_name: str = 'Unknown', timestamp_ns: Optional[int] = None,
+                monotonic_ns: Optional[int] = None, exception_text: Optional[str] = None):
+        """
+        Builds a message.  The logger uses new_message(), which skips the defaults.
+        :param level: The level we are logging at.
+        :param class_name: The source that logged.
+        :param message_static: The static part of the log, like 'Read input file'.
+        :param params: The log parameters.
+        :param ex: The exception that was logged, if any.
+        :param instance_id: The unique id of the logger instance.
+        :param machine_name: The host name of the machine.
+        :param timestamp_ns: When the message was logged, in nanoseconds since the epoch.  Default is now.
+        :param monotonic_ns: The time.monotonic_ns() of when the message was logged.  Default is now.
+        :param exception_text: The rendered stack trace.  Default is to render the exception now.
+        """
+        if timestamp_ns is None:
+            timestamp_ns = time.time_ns()
+        if monotonic_ns is None:
+            monotonic_ns = time.monotonic_ns()
+        if exception_text is None and ex is not None:
+            exception_text = render_exception_text(ex)
+
+        return tuple.__new__(cls, (level, class_name, message_static, params, ex, instance_id, machine_name,
+                                   timestamp_ns, monotonic_ns, exception_text))
+
+    """
+    Messages are events, two messages are only the same message if they are the same object.  This also means we
+    never try to hash the params dict.
+    """
+    __eq__ = object.__eq__
+    __ne__ = object.__ne__
+    __hash__ = object.__hash__
+
+    def __getnewargs__(self):
+        """
+        So that a message can be pickled.
+        :return: The fields, in order.
+        """
+        return tuple(self)
 
     def __str__(self):
         """
         String representation for debugging.
         :return: Whats going on here.
         """
-        return f"{self.level} - {self.class_name} - {self.message_static}"
\ No newline at end of file
+        return f"{self.level} - {self.class_name} - {self.message_static}"
+
+    def __repr__(self):
+        """
+        String representation for debugging.
+        :return: Whats going on here.
+        """
+        return f"Message({self.level}, {self.class_name!r}, {self.message_static!r}, params={self.params!r})"
+
+
+"""
+Builds a message straight from the tuple of all its fields, in order:  new_message(Message, (level, class_name,
+message_static, params, ex, instance_id, machine_name, timestamp_ns, monotonic_ns, exception_text)).  This is what
+the logger uses on the hot path, it skips the argument handling of Message(), which is about twice as slow.
+"""
+new_message = tuple.__new__
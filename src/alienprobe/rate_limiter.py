@@ -0,0 +1,301 @@
+"""
+Per message rate limiting, so that a loop gone wrong (logger.warn(self, 'Cannot connect to URL! Retrying...') ten
+thousand times a second) can't flood the dispatchers.  Every message key, the log source and the static message (and
+the values of the key_params you pick), gets a token bucket:  rate_per_second tokens come in every second, up to
+burst, and a message takes one.  A message that finds the bucket empty is suppressed and counted, and the logger
+writes a summary per key every summary_interval_seconds ('Suppressed repeated messages', suppressed_count=48211).
+There is no timer thread:  the summaries are written by the first message logged after the interval, or by flush()
+and shutdown().  Lazy params are computed for the key when there are key_params, even if the message is then
+suppressed, and the dispatchers render those same values.
+
+The budgets are set in the [rate_limits] section of the config, with overrides per level and per module (the longest
+dotted prefix wins, and a module budget wins over a level budget):
+
+    [rate_limits]
+    rate_per_second = 20
+    burst = 100
+
+    [rate_limits.levels]
+    error = {rate_per_second = 0}
+
+    [rate_limits.modules]
+    "myapp.poller" = {rate_per_second = 1, burst = 5}
+
+A rate_per_second of 0 turns the limit off.  The check takes no lock:  two threads taking the last token of the same
+bucket at the same time may both get through, which is fine for a flood guard.
+"""
+import time
+from collections.abc import Mapping
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from alienprobe.level_trie import get_source_name
+from alienprobe.log_levels import LogLevels
+
+
+"""
+A budget:  (rate_per_second, burst).  None means unlimited.
+"""
+RateBudget = Optional[Tuple[float, float]]
+
+"""
+The static message of the summaries.
+"""
+SUMMARY_MESSAGE = 'Suppressed repeated messages'
+
+
+class TokenBucket:
+    """
+    The tokens of one message key.
+    """
+    __slots__ = ('rate_per_second', 'burst', 'tokens', 'last_refill', 'suppressed_count', 'reported_count',
+                 'log_source', 'log_level', 'message_static', 'key_values')
+
+    def __init__(self, budget: Tuple[float, float], now: float, log_source, log_level, message_static: str,
+                 key_values: tuple):
+        """
+        Constructor, a bucket starts full.
+        :param budget: The rate_per_second and burst of the key.
+        :param now: The monotonic time, in seconds.
+        :param log_source: The log source of the key, the summaries are logged from it.
+        :param log_level: The level of the key, the summaries are logged at it.
+        :param message_static: The static message of the key.
+        :param key_values: The values of the key_params, in order.
+        """
+        self.rate_per_second, self.burst = budget
+        self.tokens = self.burst
+        self.last_refill = now
+        self.suppressed_count = 0
+        self.reported_count = 0
+        self.log_source = log_source
+        self.log_level = log_level
+        self.message_static = message_static
+        self.key_values = key_values
+
+
+class RateLimiter:
+    """
+    The token buckets of every message key, and the budgets they get per level and module.
+    """
+
+    """
+    The budget of the messages with no level or module override.
+    """
+    default_budget: RateBudget
+
+    """
+    The budget overrides per level id.
+    """
+    level_budgets: Dict[int, RateBudget]
+
+    """
+    The budget overrides per dotted module prefix.
+    """
+    module_budgets: Dict[str, RateBudget]
+
+    """
+    The names of the params whose values are part of the message key, so that 'Cannot connect' to two urls is
+    limited per url.
+    """
+    key_params: Tuple[str, ...]
+
+    """
+    How often (in seconds) we summarize the suppressed messages.
+    """
+    summary_interval_seconds: float = 60
+
+    """
+    The most message keys we keep buckets for.  Past that, we start over with full buckets, so a key param with
+    endless values can't eat the memory.
+    """
+    max_keys: int = 10000
+
+    """
+    Set once summary_interval_seconds went by and something was suppressed.  The logger then calls take_summaries().
+    """
+    summary_due: bool = False
+
+    """
+    How many messages were suppressed, over all the keys.
+    """
+    suppressed_count: int = 0
+
+    def __init__(self, default_budget: RateBudget, level_budgets: Optional[Dict[int, RateBudget]] = None,
+                 module_budgets: Optional[Dict[str, RateBudget]] = None, key_params: Sequence[str] = (),
+                 summary_interval_seconds: float = 60, max_keys: int = 10000):
+        """
+        Constructor for the limiter.
+        :param default_budget: The budget of the messages with no level or module override.
+        :param level_budgets: The budget overrides per level id.
+        :param module_budgets: The budget overrides per dotted module prefix.
+        :param key_params: The names of the params whose values are part of the message key.
+        :param summary_interval_seconds: How often we summarize the suppressed messages.
+        :param max_keys: The most message keys we keep buckets for.
+        """
+        self.default_budget = default_budget
+        self.level_budgets = level_budgets or {}
+        self.module_budgets = module_budgets or {}
+        self.key_params = tuple(key_params)
+        self.summary_interval_seconds = summary_interval_seconds
+        self.max_keys = max_keys
+
+        self._budget_cache: Dict[tuple, RateBudget] = {}
+        self._buckets: Dict[tuple, TokenBucket] = {}
+        self._suppressed: Dict[tuple, TokenBucket] = {}
+        self._next_summary = time.monotonic() + summary_interval_seconds
+
+    def allow(self, log_source, log_level, message_static: str, log_params) -> bool:
+        """
+        Takes a token from the bucket of the message key.  The budget of a source and level is resolved once, and
+        the bucket is a dict hit, so this is O(1).
+        :param log_source: The log source, as passed to the logger.
+        :param log_level: The level of the message.
+        :param message_static: The static message.
+        :param log_params: The params of the message, for the key_params, as the logger wrapped them.  Lazy params
+        (a LazyParams) are computed here, once:  the message carries the same instance, and the dispatchers render
+        the values we keyed on.  Keying on the lambdas would make every message a key of its own.
+        :return: True if the message can go, False if it is suppressed.
+        """
+        cache_key = log_source if isinstance(log_source, (str, type)) else type(log_source)
+        level_id = log_level.level_id
+        budget_key = (cache_key, level_id)
+        budget = self._budget_cache.get(budget_key, ())
+        if budget == ():
+            budget = self._budget_cache[budget_key] = self.resolve_budget(get_source_name(cache_key), level_id)
+        if budget is None:
+            return True
+
+        key_values = ()
+        if self.key_params and isinstance(log_params, Mapping):
+            key_values = tuple(log_params.get(param_name) for param_name in self.key_params)
+        key = (cache_key, level_id, message_static, key_values)
+        try:
+            bucket = self._buckets.get(key)
+        except TypeError:
+            key_values = tuple(repr(value) for value in key_values)
+            key = (cache_key, level_id, message_static, key_values)
+            bucket = self._buckets.get(key)
+
+        now = time.monotonic()
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._buckets = {}
+            bucket = self._buckets[key] = TokenBucket(budget=budget, now=now, log_source=cache_key,
+                                                      log_level=log_level, message_static=message_static,
+                                                      key_values=key_values)
+
+        tokens = bucket.tokens + (now - bucket.last_refill) * bucket.rate_per_second
+        if tokens > bucket.burst:
+            tokens = bucket.burst
+        bucket.last_refill = now
+        if tokens >= 1:
+            bucket.tokens = tokens - 1
+            allowed = True
+        else:
+            bucket.tokens = tokens
+            bucket.suppressed_count += 1
+            self.suppressed_count += 1
+            if key not in self._suppressed:
+                self._suppressed[key] = bucket
+            allowed = False
+
+        if now >= self._next_summary and self._suppressed:
+            self.summary_due = True
+        return allowed
+
+    def resolve_budget(self, source_name: str, level_id: int) -> RateBudget:
+        """
+        The budget of a source at a level:  the longest module prefix that has one, else the level, else the default.
+        :param source_name: The dotted name of the source.
+        :param level_id: The level id.
+        :return: The budget, None if unlimited.
+        """
+        if self.module_budgets:
+            parts = source_name.split('.')
+            for length in range(len(parts), 0, -1):
+                prefix = '.'.join(parts[:length])
+                if prefix in self.module_budgets:
+                    return self.module_budgets[prefix]
+
+        return self.level_budgets.get(level_id, self.default_budget)
+
+    def take_summaries(self) -> List[TokenBucket]:
+        """
+        The buckets that suppressed messages since their last summary, with the new count in suppressed_count minus
+        reported_count.  Marks them reported, and starts a new summary interval.
+        :return: The buckets to summarize.
+        """
+        self.summary_due = False
+        self._next_summary = time.monotonic() + self.summary_interval_seconds
+        suppressed, self._suppressed = self._suppressed, {}
+        return list(suppressed.values())
+
+
+def parse_budget(config: dict, name: str, default: Optional[Tuple[float, float]] = None) -> RateBudget:
+    """
+    Reads a budget from a table with rate_per_second and burst.
+    :param config: The table.
+    :param name: Where the table is, for the errors.
+    :param default: The budget whose values we use when the table does not set them.
+    :return: The budget, None if the rate is 0.
+    """
+    default_rate, default_burst = default or (0, 1)
+    rate_per_second = float(config.get('rate_per_second', default_rate))
+    burst = float(config.get('burst', max(default_burst, rate_per_second)))
+    if rate_per_second < 0 or burst < 1:
+        raise ValueError(f"The rate_per_second of {name} must be 0 or more and its burst at least 1, were "
+                         f"{rate_per_second} and {burst}")
+    return (rate_per_second, burst) if rate_per_second else None
+
+
+def create_rate_limiter(config: dict) -> Optional[RateLimiter]:
+    """
+    Builds the rate limiter from the [rate_limits] section of the config.
+    :param config: The [rate_limits] section.
+    :return: The limiter, or None if nothing is limited.
+    """
+    if not config:
+        return None
+
+    default_budget = parse_budget(config, name='[rate_limits]')
+    default_values = default_budget or (0, float(config.get('burst', 1)))
+
+    level_budgets = {}
+    for level_name, level_config in config.get('levels', {}).items():
+        level = LogLevels().get_level_by_name(level_name)
+        if not level or not isinstance(level_config, dict):
+            raise ValueError(f"Unknown level '{level_name}' (or not a table) in the [rate_limits.levels] section.")
+        level_budgets[level.level_id] = parse_budget(level_config, name=f"rate_limits.levels.{level_name}",
+                                                     default=default_values)
+
+    module_budgets = {}
+    _load_module_budgets(config.get('modules', {}), prefix='', module_budgets=module_budgets,
+                         default=default_values)
+
+    if default_budget is None and not any(level_budgets.values()) and not any(module_budgets.values()):
+        return None
+
+    summary_interval_seconds = float(config.get('summary_interval_seconds', 60))
+    max_keys = int(config.get('max_keys', 10000))
+    if summary_interval_seconds <= 0 or max_keys < 1:
+        raise ValueError(f"The summary_interval_seconds and max_keys of [rate_limits] must be positive, were "
+                         f"{summary_interval_seconds} and {max_keys}")
+    return RateLimiter(default_budget=default_budget, level_budgets=level_budgets, module_budgets=module_budgets,
+                       key_params=config.get('key_params', ()), summary_interval_seconds=summary_interval_seconds,
+                       max_keys=max_keys)
+
+
+def _load_module_budgets(modules: dict, prefix: str, module_budgets: Dict[str, RateBudget],
+                         default: Tuple[float, float]):
+    """
+    Loads the [rate_limits.modules] section.  TOML turns an unquoted dotted key into nested tables, so a table
+    without rate_per_second or burst is walked, and its keys joined back together.
+    """
+    for key, value in modules.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if not isinstance(value, dict):
+            raise ValueError(f"The budget of '{name}' in [rate_limits.modules] must be a table, like "
+                             f"{{rate_per_second = 1, burst = 5}}")
+        if 'rate_per_second' in value or 'burst' in value:
+            module_budgets[name] = parse_budget(value, name=f"rate_limits.modules.{name}", default=default)
+        else:
+            _load_module_budgets(value, prefix=name, module_budgets=module_budgets, default=default)
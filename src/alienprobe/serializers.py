@@ -0,0 +1,267 @@
+"""
+Turns the values of the log parameters into text.  A registry maps a type to its encoder, so rendering a parameter is
+a dict lookup on the exact type of the value, plus the encode.  Types that are not registered are matched on their
+MRO once, and the result is cached for that type.
+
+You can register your own types in code:
+
+    register_serializer(Money, lambda money: f'"{money.amount} {money.currency}"')
+
+or in the [serializers] section of the config file, with the dotted path of the type and of the encoder:
+
+    [serializers]
+    "myapp.money.Money" = "myapp.logging_helpers.encode_money"
+
+An encoder takes the value and returns the text that goes after 'name=', quotes included if it needs them.  The
+encoders of the config are replaced as a whole when the config is reloaded, so a type taken out of the section goes
+back to the encoder it had before.
+"""
+import datetime
+import decimal
+import importlib
+import uuid
+import weakref
+from pathlib import PurePath
+from typing import Any, Callable, Dict, Optional
+
+from alienprobe.compact_encoder import CompactEncoder
+
+
+"""
+An encoder takes the parameter value, and returns the text that goes after 'name='.
+"""
+Encoder = Callable[[Any], str]
+
+
+def encode_quoted(value: Any) -> str:
+    """
+    The default encoder, the str() of the value in double quotes.
+    """
+    return f'"{value}"'
+
+
+def encode_string(value: str) -> str:
+    """
+    Strings go in double quotes.
+    """
+    return '"' + value + '"'
+
+
+def encode_date(value: datetime.date) -> str:
+    """
+    Dates in ISO format, in double quotes.
+    """
+    return '"' + value.isoformat() + '"'
+
+
+def container_encoder(compact_encoder: CompactEncoder) -> Encoder:
+    """
+    Makes the encoder of the containers (dicts, lists, tuples, sets), on a single line within the limits of the
+    compact encoder, in double quotes.
+    :param compact_encoder: The encoder, with its limits.
+    :return: The encoder.
+    """
+    encode = compact_encoder.encode
+    return lambda value: '"' + encode(value) + '"'
+
+
+"""
+The containers, they go through the compact encoder.
+"""
+CONTAINER_TYPES = (dict, list, tuple, set, frozenset)
+
+
+class SerializerRegistry:
+    """
+    Maps the types of parameter values to their encoders.  A dispatcher registry can have a parent (the global
+    registry), whose encoders it falls back to.  When an encoder is registered in the parent, the caches of its
+    children are cleared, so the lookups stay a single dict hit.
+    """
+
+    """
+    The encoders registered in this registry, by type.
+    """
+    _encoders: Dict[type, Encoder]
+
+    """
+    The encoders of the [serializers] section of the config, by type.  They win over the ones registered in code, and
+    are swapped as a whole on a reload (see replace_config_encoders).
+    """
+    _config_encoders: Dict[type, Encoder]
+
+    """
+    The encoder we resolved for every type we saw, including through the MRO and the parent.
+    """
+    _cache: Dict[type, Encoder]
+
+    def __init__(self, parent: Optional['SerializerRegistry'] = None):
+        """
+        Constructor.
+        :param parent: The registry we fall back to, usually the global one.
+        """
+        self.parent = parent
+        self._encoders = {}
+        self._config_encoders = {}
+        self._cache = {}
+        self._children = weakref.WeakSet()
+        if parent is not None:
+            parent._children.add(self)
+
+    def register(self, value_type: type, encoder: Encoder):
+        """
+        Registers the encoder of a type (and of its subclasses, unless they have their own).
+        :param value_type: The type of the values.
+        :param encoder: Takes a value, returns the text that goes after 'name='.
+        """
+        self._encoders[value_type] = encoder
+        self.clear_cache()
+
+    def replace_config_encoders(self, encoders: Dict[type, Encoder]):
+        """
+        Swaps in the encoders of a newly loaded config, in one reference assignment, so a dispatcher rendering on
+        another thread sees either the old set or the new one.  Encoders of the previous config that are not in the
+        new one are gone.
+        :param encoders: The encoders of the config, by type (see load_serializers).
+        """
+        self._config_encoders = dict(encoders)
+        self.clear_cache()
+
+    def clear_cache(self):
+        """
+        Forgets the resolved encoders, here and in the children.
+        """
+        self._cache = {}
+        for child in list(self._children):
+            child.clear_cache()
+
+    def encode(self, value: Any) -> str:
+        """
+        Encodes a parameter value.
+        :param value: The value.
+        :return: The text that goes after 'name='.
+        """
+        encoder = self._cache.get(value.__class__)
+        if encoder is None:
+            encoder = self.resolve(value.__class__)
+        return encoder(value)
+
+    def resolve(self, value_type: type) -> Encoder:
+        """
+        Finds the encoder of a type, the closest class in its MRO with an encoder, here or in the parent.  For each
+        class, the encoders of the config (here, then in the parent) come before the ones registered in code (here,
+        then in the parent), so a [serializers] entry also wins over the datetime and container encoders of a
+        dispatcher.  The result is cached for the type.
+        :param value_type: The type of the value.
+        :return: The encoder.
+        """
+        #
+        # Take the cache first:  if the encoders change while we resolve, the cache is replaced, and what we resolved
+        # from the old encoders lands in the old cache.
+        #
+        cache = self._cache
+        if self.parent is not None:
+            layers = [self._config_encoders, self.parent._config_encoders, self._encoders, self.parent._encoders]
+        else:
+            layers = [self._config_encoders, self._encoders]
+
+        encoder = None
+        for cls in value_type.__mro__:
+            for encoders in layers:
+                encoder = encoders.get(cls)
+                if encoder is not None:
+                    break
+            if encoder is not None:
+                break
+
+        if encoder is None:
+            encoder = encode_quoted
+        cache[value_type] = encoder
+        return encoder
+
+
+"""
+The global registry, with the built in encoders.  The dispatchers fall back to it.
+"""
+DEFAULT_SERIALIZERS = SerializerRegistry()
+for _value_type, _encoder in {
+    str: encode_string,
+    int: int.__repr__,
+    float: float.__repr__,
+    bool: bool.__repr__,
+    type(None): encode_quoted,
+    datetime.datetime: encode_date,
+    datetime.date: encode_date,
+    datetime.time: encode_date,
+    decimal.Decimal: decimal.Decimal.__str__,
+    uuid.UUID: encode_quoted,
+    PurePath: encode_quoted,
+    bytes: encode_quoted,
+    object: encode_quoted,
+}.items():
+    DEFAULT_SERIALIZERS.register(_value_type, _encoder)
+for _value_type in CONTAINER_TYPES:
+    DEFAULT_SERIALIZERS.register(_value_type, container_encoder(CompactEncoder()))
+
+
+def register_serializer(value_type: type, encoder: Encoder):
+    """
+    Registers the encoder of one of your types, for every dispatcher.
+    :param value_type: The type of the values.
+    :param encoder: Takes a value, returns the text that goes after 'name=' (quotes included if needed).
+    """
+    DEFAULT_SERIALIZERS.register(value_type, encoder)
+
+
+def create_dispatcher_serializers(datetime_format: str,
+                                  compact_encoder: Optional[CompactEncoder] = None) -> SerializerRegistry:
+    """
+    Creates the registry of a dispatcher, on top of the global one.  Datetimes are formatted with the datetime_format
+    of the dispatcher, and containers with its compact encoder.
+    :param datetime_format: The strftime format of the dispatcher.
+    :param compact_encoder: The compact encoder with the param limits of the dispatcher.  Default is the global one.
+    :return: The registry.
+    """
+    registry = SerializerRegistry(parent=DEFAULT_SERIALIZERS)
+    registry.register(datetime.datetime, lambda value: '"' + value.strftime(datetime_format) + '"')
+    if compact_encoder is not None:
+        encoder = container_encoder(compact_encoder)
+        for value_type in CONTAINER_TYPES:
+            registry.register(value_type, encoder)
+    return registry
+
+
+def import_dotted(dotted_path: str) -> Any:
+    """
+    Imports a class or a function from its dotted path, like 'myapp.money.Money'
+    :param dotted_path: The module path, a dot, and the name in the module.
+    :return: The class or function.
+    """
+    module_name, _, attr_name = dotted_path.rpartition('.')
+    if not module_name:
+        raise ValueError(f"'{dotted_path}' is not a dotted path like 'mymodule.MyClass'")
+    return getattr(importlib.import_module(module_name), attr_name)
+
+
+def load_serializers(section: dict, prefix: str = '',
+                     encoders: Optional[Dict[type, Encoder]] = None) -> Dict[type, Encoder]:
+    """
+    Imports the encoders of the [serializers] section of the config.  Nothing is registered yet, the logger publishes
+    them with the rest of the config (see SerializerRegistry.replace_config_encoders).  Like in [log_levels], TOML
+    turns unquoted dotted keys into nested tables, so we join them back together.
+    :param section: The (possibly nested) dict of type paths to encoder paths.
+    :param prefix: The dotted prefix of the table we are in, empty at the top.
+    :param encoders: The encoders loaded so far, for the nested tables.
+    :return: The encoders, by type.
+    """
+    if encoders is None:
+        encoders = {}
+
+    for key, value in section.items():
+        type_path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            load_serializers(value, prefix=type_path, encoders=encoders)
+            continue
+
+        encoders[import_dotted(type_path)] = import_dotted(str(value))
+
+    return encoders
@@ -0,0 +1,80 @@
+"""
+Micro benchmark of the message formatting of the default ConsoleDispatcher template.  Compares the old str.replace
+formatting (kept below, as it was) against the compiled template.
+Run it with:  PYTHONPATH=src python testing/benchmarks/bench_format_message.py
+"""
+import datetime
+import timeit
+
+from alienprobe.dispatchers.console_dispatcher import ConsoleDispatcher
+from alienprobe.log_levels import LogLevels
+from alienprobe.message import Message
+
+
+def legacy_format_message(message_object: Message, datetime_format: str, log_utc: bool,
+                          message_format: str, exception_format: str) -> str:
+    """
+    The formatting as it was before the templates were compiled, a str.replace per token.
+    """
+    msg = message_format
+
+    cls_name = message_object.class_name
+    if not isinstance(cls_name, str):
+        cls_name = str(type(cls_name))
+
+    msg = msg.replace('[[CLASS_NAME]]', cls_name)
+
+    log_date = datetime.datetime.now()
+    if log_utc:
+        log_date = datetime.datetime.utcnow()
+
+    curtime_str = log_date.strftime(datetime_format)
+    msg = msg.replace('[[DATE_STRING]]', curtime_str)
+    msg = msg.replace('[[LOG_LEVEL]]', message_object.level.name)
+    msg = msg.replace('[[LOG_MESSAGE_STATIC]]', message_object.message_static)
+    msg = msg.replace('[[INSTANCE_ID]]', message_object.instance_id)
+    msg = msg.replace('[[MACHINE_NAME]]', message_object.machine_name)
+
+    params_msg = ''
+    for param_key, param_val in message_object.params.items():
+        params_msg += str(param_key) + '='
+        if isinstance(param_val, int) or isinstance(param_val, float):
+            param_val_str = str(param_val)
+        else:
+            param_val_str = f'"{str(param_val)}"'
+        params_msg += param_val_str + ' '
+
+    return msg.replace('[[LOG_PARAMS]]', params_msg.strip())
+
+
+def main(count: int = 200_000):
+    """
+    Formats the same message count times with both implementations, and prints the ns per message.
+    :param count: How many messages to format.
+    """
+    dispatcher = ConsoleDispatcher()
+    dispatcher.config_dispatcher(config={})
+
+    msg_obj = Message(level=LogLevels.INFO, class_name='myapp.mymodule', message_static='Read input file',
+                      params={'path': '/tmp/input.csv', 'client': 'acme', 'file_size': 1024},
+                      instance_id='20240101_000000Z_ABCDE', machine_name='worker-01')
+
+    #
+    # Both should give the same output, apart from the date.
+    #
+    legacy_message = legacy_format_message(msg_obj, dispatcher.datetime_format, True, dispatcher.message_format,
+                                           dispatcher.exception_format)
+    compiled_message = dispatcher.compiled_format.render(msg_obj)
+    assert legacy_message.split(' level=')[1] == compiled_message.split(' level=')[1]
+
+    legacy_seconds = min(timeit.repeat(
+        lambda: legacy_format_message(msg_obj, dispatcher.datetime_format, True, dispatcher.message_format,
+                                      dispatcher.exception_format), number=count, repeat=3))
+    compiled_seconds = min(timeit.repeat(lambda: dispatcher.compiled_format.render(msg_obj), number=count, repeat=3))
+
+    print(f"str.replace formatting: {legacy_seconds / count * 1e9:8.0f} ns/message")
+    print(f"compiled template:      {compiled_seconds / count * 1e9:8.0f} ns/message")
+
+
+if __name__ == '__main__':
+    main()
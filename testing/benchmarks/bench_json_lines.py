@@ -0,0 +1,68 @@
+"""
+Throughput benchmark of the JsonLinesDispatcher against the text path of the ConsoleDispatcher.  Both write batches of
+100 messages to /dev/null, like the writer thread of the async mode does, and we check that they keep up with
+100k messages a second.
+Run it with:  PYTHONPATH=src python testing/benchmarks/bench_json_lines.py
+"""
+import os
+import sys
+import time
+
+from alienprobe.dispatchers.console_dispatcher import ConsoleDispatcher
+from alienprobe.dispatchers.json_lines_dispatcher import JsonLinesDispatcher
+from alienprobe.log_levels import LogLevels
+from alienprobe.message import Message
+
+
+"""
+The rate we want to sustain.
+"""
+TARGET_MESSAGES_PER_SECOND = 100_000
+
+
+def run(dispatcher, batches: list) -> float:
+    """
+    Writes every batch, and returns how many messages a second that was.
+    """
+    started = time.perf_counter()
+    for batch in batches:
+        dispatcher.write_messages(batch)
+    elapsed = time.perf_counter() - started
+    return sum(len(batch) for batch in batches) / elapsed
+
+
+def main(count: int = 100_000, batch_size: int = 100):
+    """
+    Writes count messages with both dispatchers, and prints the messages per second.
+    :param count: How many messages to write.
+    :param batch_size: How many messages per write_messages.
+    """
+    messages = [Message(level=LogLevels.INFO, class_name='myapp.mymodule', message_static='Read input file',
+                        params={'path': '/tmp/input.csv', 'client': 'acme', 'file_size': 1024 + index,
+                                'ratio': 0.25, 'cached': True},
+                        instance_id='20240101_000000Z_ABCDE', machine_name='worker-01')
+                for index in range(count)]
+    batches = [messages[index:index + batch_size] for index in range(0, count, batch_size)]
+
+    console = ConsoleDispatcher()
+    console.config_dispatcher(config={'colorize_messages': False})
+    json_lines = JsonLinesDispatcher()
+    json_lines.config_dispatcher(config={'output_path': os.devnull})
+
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            console_rate = max(run(console, batches) for _ in range(3))
+        finally:
+            sys.stdout = stdout
+    json_rate = max(run(json_lines, batches) for _ in range(3))
+    json_lines.close()
+
+    for name, rate in (('console text', console_rate), ('json lines', json_rate)):
+        verdict = 'ok' if rate >= TARGET_MESSAGES_PER_SECOND else 'below target'
+        print(f"{name:12}: {rate:10,.0f} messages/second ({verdict}, {1e9 / rate:6.0f} ns/message)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Event loop lag benchmark of the asyncio mode.  A coroutine logs 50k messages a second, in a burst every millisecond,
+while a probe task asks to be woken up every millisecond and records how late it was.  We run it with the synchronous
+path (the console dispatcher formats and writes on the loop) and with the loop writer (the loop only queues, the
+console writes on its own thread), and print how long the loop spent in the logger calls, and the lag percentiles.
+The console writes to /dev/null, a slower sink only makes the synchronous path worse.
+Run it with:  PYTHONPATH=src python testing/benchmarks/bench_loop_lag.py
+"""
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+from alienprobe.alien_logger import AlienLogger
+from alienprobe.dispatchers.console_dispatcher import ConsoleDispatcher
+
+
+"""
+The rate the coroutine logs at.
+"""
+TARGET_CALLS_PER_SECOND = 50_000
+
+"""
+How often the probe asks to be woken up, in seconds.
+"""
+PROBE_INTERVAL = 0.001
+
+
+async def probe(lags: list, stop: asyncio.Event):
+    """
+    Sleeps PROBE_INTERVAL over and over, and records how much later than asked it woke up, in milliseconds.
+    """
+    while not stop.is_set():
+        asked = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append((time.perf_counter() - asked - PROBE_INTERVAL) * 1000)
+
+
+async def produce(logger: AlienLogger, seconds: float) -> tuple:
+    """
+    Logs at TARGET_CALLS_PER_SECOND for a while, in a burst every millisecond, like handlers serving requests.
+    :return: How many messages were logged, and how many seconds the loop spent in the logger calls.
+    """
+    started = time.perf_counter()
+    logged = 0
+    busy = 0.0
+    while True:
+        burst_started = time.perf_counter()
+        elapsed = burst_started - started
+        if elapsed >= seconds:
+            return logged, busy
+        for _ in range(int(elapsed * TARGET_CALLS_PER_SECOND) - logged):
+            logger.info('myapp.handlers', 'Handled request', {'path': '/api/items', 'status': 200,
+                                                              'elapsed_ms': 1.25, 'request': logged})
+            logged += 1
+        busy += time.perf_counter() - burst_started
+        await asyncio.sleep(PROBE_INTERVAL)
+
+
+async def run(logger: AlienLogger, loop_writer: bool, seconds: float) -> tuple:
+    """
+    Runs the producer and the probe together.
+    :return: The lags of the probe, the rate the producer achieved, and the milliseconds per second the loop spent
+    in the logger calls.
+    """
+    if loop_writer:
+        logger.start_loop_writer(queue_size=100_000)
+
+    lags = []
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(lags, stop))
+    started = time.perf_counter()
+    logged, busy = await produce(logger, seconds)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe_task
+
+    if loop_writer:
+        await logger.stop_loop_writer()
+    return lags, logged / elapsed, busy * 1000 / elapsed
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    The value below which this fraction of the values lie.
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main(seconds: float = 3.0):
+    """
+    Runs both paths, and prints the lag of the loop.
+    :param seconds: How long each path logs.
+    """
+    config_file = Path(__file__).resolve().parents[1].joinpath('collateral/testing/test_alienlogger_config.toml')
+    os.environ.setdefault('ALIENLOGGER__CONFIG_FILE_PATH', str(config_file))
+
+    stdout = sys.stdout
+    results = []
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            for name, loop_writer in (('synchronous', False), ('loop writer', True)):
+                logger = AlienLogger()
+                logger.stop_config_watcher()
+                console = ConsoleDispatcher()
+                console.config_dispatcher(config={'colorize_messages': False})
+                logger.dispatchers = {'console': console}
+                results.append((name, *asyncio.run(run(logger, loop_writer=loop_writer, seconds=seconds))))
+        finally:
+            sys.stdout = stdout
+
+    for name, lags, rate, busy in results:
+        print(f"{name:12}: {rate:8,.0f} calls/second, {busy:6.1f} ms/second in the logger, loop lag p50 "
+              f"{percentile(lags, 0.5):5.2f} ms, p99 {percentile(lags, 0.99):5.2f} ms, max {max(lags):6.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Allocation and memory benchmark of the Message record, for 1M messages.  Compares the old plain class message (kept
+below, as it was built by the logger: one attribute assignment per field) against the tuple backed Message.
+Run it with:  PYTHONPATH=src python testing/benchmarks/bench_message.py
+"""
+import time
+import tracemalloc
+
+from alienprobe.log_levels import LogLevels
+from alienprobe.message import Message, new_message
+
+
+class LegacyMessage:
+    """
+    The message as it was, a plain class with class level defaults.
+    """
+    level = None
+    class_name = None
+    message_static: str = None
+    params: dict = {}
+    ex: BaseException = None
+    instance_id: str
+    machine_name: str
+    timestamp_ns: int
+    monotonic_ns: int
+
+
+def build_legacy(count: int, params: dict) -> list:
+    """
+    Builds count messages the way the logger used to, plus the timestamp, so that both hold the same fields.
+    """
+    messages = []
+    for _ in range(count):
+        msg_obj = LegacyMessage()
+        msg_obj.level = LogLevels.INFO
+        msg_obj.class_name = 'myapp.mymodule'
+        msg_obj.message_static = 'Read input file'
+        msg_obj.params = params
+        msg_obj.ex = None
+        msg_obj.instance_id = '20240101_000000Z_ABCDE'
+        msg_obj.machine_name = 'worker-01'
+        msg_obj.timestamp_ns = time.time_ns()
+        msg_obj.monotonic_ns = time.monotonic_ns()
+        messages.append(msg_obj)
+    return messages
+
+
+def build_messages(count: int, params: dict) -> list:
+    """
+    Builds count messages the way the logger does now, in one call with the pre captured timestamps.
+    """
+    messages = []
+    for _ in range(count):
+        messages.append(new_message(Message, (LogLevels.INFO, 'myapp.mymodule', 'Read input file', params, None,
+                                              '20240101_000000Z_ABCDE', 'worker-01', time.time_ns(),
+                                              time.monotonic_ns(), None)))
+    return messages
+
+
+def measure(name: str, build, count: int):
+    """
+    Times the building of count messages, then measures the memory they hold.
+    """
+    params = {'path': '/tmp/input.csv'}
+
+    start_time = time.perf_counter()
+    build(count, params)
+    elapsed = time.perf_counter() - start_time
+
+    tracemalloc.start()
+    messages = build(count, params)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del messages
+
+    print(f"{name:14} {elapsed / count * 1e9:6.0f} ns/message  {current / count:6.1f} bytes/message "
+          f"({current / 1024 / 1024:6.1f} MiB for {count} messages)")
+
+
+def main(count: int = 1_000_000):
+    """
+    Runs both measurements.
+    """
+    measure('plain class', build_legacy, count)
+    measure('Message tuple', build_messages, count)
+
+
+if __name__ == '__main__':
+    main()
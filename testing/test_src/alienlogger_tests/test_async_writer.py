@@ -0,0 +1,305 @@
+"""
+Tests for the asynchronous dispatch mode.
+"""
+import os
+import threading
+
+from alienprobe.alien_logger import AlienLogger
+from alienprobe.async_writer import AsyncWriter, OverflowPolicies
+from alienprobe.log_levels import LogLevels
+from alienprobe.message import Message
+from test_fixtures import test_context, TestContext, RecordingDispatcher
+
+
+class BlockedDispatcher(RecordingDispatcher):
+    """
+    A recording dispatcher that holds the writer thread until we release it, so that the queue fills up.
+    """
+
+    def __init__(self):
+        """
+        Constructor, starts blocked.
+        """
+        super().__init__()
+        self.release = threading.Event()
+        self.entered = threading.Event()
+
+    def write_message(self, message_object: Message) -> bool:
+        """
+        Waits for the release, then records.
+        """
+        self.entered.set()
+        self.release.wait()
+        return super().write_message(message_object)
+
+
+def make_message(message_static: str) -> Message:
+    """
+    A message with only the static part set, which is all we need to check the order.
+    """
+    return Message(level=LogLevels.INFO, class_name=__name__, message_static=message_static)
+
+
+def fill_blocked_writer(policy: str, count: int, sample_every: int = 10):
+    """
+    Starts a writer with a queue of 2, blocks it on the first message, and puts count more messages.
+    :return: The writer and the dispatcher.
+    """
+    dispatcher = BlockedDispatcher()
+    writer = AsyncWriter(get_dispatchers=lambda: {'blocked': dispatcher}, queue_size=2, overflow_policy=policy,
+                         sample_every=sample_every)
+    writer.start()
+    writer.put(make_message('first'))
+    assert dispatcher.entered.wait(5), "The writer thread should pick up the first message."
+    for index in range(count):
+        writer.put(make_message(str(index)))
+    return writer, dispatcher
+
+
+def test_drop_newest():
+    """
+    When the queue is full, drop_newest keeps what is queued.
+    """
+    writer, dispatcher = fill_blocked_writer(OverflowPolicies.DROP_NEWEST, count=5)
+    dispatcher.release.set()
+    writer.shutdown()
+    assert [m.message_static for m in dispatcher.messages] == ['first', '0', '1']
+    assert writer.dropped_count == 3
+
+
+def test_drop_oldest():
+    """
+    When the queue is full, drop_oldest keeps the most recent messages.
+    """
+    writer, dispatcher = fill_blocked_writer(OverflowPolicies.DROP_OLDEST, count=5)
+    dispatcher.release.set()
+    writer.shutdown()
+    assert [m.message_static for m in dispatcher.messages] == ['first', '3', '4']
+    assert writer.dropped_count == 3
+
+
+def test_sample():
+    """
+    When the queue is full, sample keeps one in every sample_every overflowing messages.
+    """
+    writer, dispatcher = fill_blocked_writer(OverflowPolicies.SAMPLE, count=8, sample_every=3)
+    dispatcher.release.set()
+    writer.shutdown()
+    assert [m.message_static for m in dispatcher.messages] == ['first', '4', '7']
+
+
+def test_block_and_flush():
+    """
+    The block policy loses nothing, and flush waits until everything is written.
+    """
+    dispatcher = RecordingDispatcher()
+    writer = AsyncWriter(get_dispatchers=lambda: {'recorder': dispatcher}, queue_size=4)
+    writer.start()
+    for index in range(500):
+        writer.put(make_message(str(index)))
+    assert writer.flush(timeout=5)
+    assert [m.message_static for m in dispatcher.messages] == [str(index) for index in range(500)]
+
+    writer.shutdown()
+    assert not writer.put(make_message('late')), "After shutdown, the caller has to dispatch itself."
+
+
+def test_logger_async_mode(test_context: TestContext):
+    """
+    In async mode, the logger snapshots the params and the messages reach the dispatchers on the writer thread.
+    """
+    config_file = test_context.project_path.joinpath('testing/collateral/testing/test_alienlogger_async_config.toml')
+    os.environ['ALIENLOGGER__CONFIG_FILE_PATH'] = str(config_file)
+    logger = AlienLogger()
+    recorder = RecordingDispatcher()
+    logger.dispatchers = {'recorder': recorder}
+
+    params = {'count': 1}
+    logger.info(__name__, 'Queued message', params)
+    params['count'] = 2
+    logger.flush()
+    assert recorder.messages[-1].params == {'count': 1}, "The queued message keeps the params as they were logged."
+
+    logger.shutdown()
+    logger.info(__name__, 'After shutdown')
+    assert recorder.messages[-1].message_static == 'After shutdown', "After shutdown we dispatch synchronously."
+
+
+def test_bad_async_settings_keep_the_previous_config(test_context: TestContext, tmp_path):
+    """
+    A reload with a bad async setting is not applied at all:  the levels, the dispatchers and the writer stay.
+    """
+    config_text = test_context.project_path.joinpath(
+        'testing/collateral/testing/test_alienlogger_async_config.toml').read_text().replace(
+        'config_reload_seconds = 0', 'config_reload_seconds = 60')
+    config_file = tmp_path.joinpath('async_config.toml')
+    config_file.write_text(config_text)
+    os.environ['ALIENLOGGER__CONFIG_FILE_PATH'] = str(config_file)
+    logger = AlienLogger()
+    try:
+        async_writer = logger._async_writer
+        dispatchers = logger.dispatchers
+        config_file.write_text(config_text.replace("'block'", "'blok'").replace("'trace'", "'error'")
+                               .replace("[null]\n", "[null]\nsome_setting = true\n"))
+        assert not logger.check_config_changes() and logger.reload_metrics.failed_reload_count == 1
+        assert logger.default_log_level.level_id == LogLevels.TRACE.level_id
+        assert logger.dispatchers is dispatchers and logger._async_writer is async_writer
+    finally:
+        logger.shutdown()
+
+
+class BatchRecordingDispatcher(RecordingDispatcher):
+    """
+    A recording dispatcher that also keeps the size of every batch it was given.
+    """
+
+    def __init__(self, batch_size: int, max_batch_latency_ms: float = 0):
+        """
+        Constructor, with the batching settings.
+        """
+        super().__init__()
+        self.batch_sizes = []
+        self.config_batching({'batch_size': batch_size, 'max_batch_latency_ms': max_batch_latency_ms})
+
+    def write_messages(self, batch) -> int:
+        """
+        Records the batch size, then the messages.
+        """
+        self.batch_sizes.append(len(batch))
+        return super().write_messages(batch)
+
+
+def test_batches_per_dispatcher():
+    """
+    The writer thread groups the messages per dispatcher, in batches of the batch_size of each dispatcher.  A partial
+    batch waits for max_batch_latency_ms, or for a flush.
+    """
+    small = BatchRecordingDispatcher(batch_size=3)
+    slow = BatchRecordingDispatcher(batch_size=1000, max_batch_latency_ms=60000)
+    blocked = BlockedDispatcher()
+    dispatchers = {'blocked': blocked}
+    writer = AsyncWriter(get_dispatchers=lambda: dispatchers, queue_size=100)
+    writer.start()
+
+    #
+    # Hold the writer on a first message, so that the next ones pile up and get drained in one go.
+    #
+    writer.put(make_message('first'))
+    assert blocked.entered.wait(5)
+    dispatchers.update({'small': small, 'slow': slow})
+    for index in range(7):
+        writer.put(make_message(str(index)))
+    blocked.release.set()
+
+    writer.put(make_message('wake up'))
+    for _ in range(100):
+        if len(small.messages) == 8:
+            break
+        threading.Event().wait(0.01)
+    assert small.batch_sizes[:2] == [3, 3], "Full batches of 3 first, then what is left."
+    assert not slow.messages, "A partial batch waits for its max_batch_latency_ms."
+
+    assert writer.flush(timeout=5)
+    assert slow.batch_sizes == [8], "A flush writes the partial batches."
+    writer.shutdown()
+
+
+def test_console_single_write_per_batch(capsys):
+    """
+    The console dispatcher writes a whole batch with one write.
+    """
+    from alienprobe.dispatchers.console_dispatcher import ConsoleDispatcher
+    from test_dispatchers import make_message as make_full_message
+
+    dispatcher = ConsoleDispatcher()
+    dispatcher.config_dispatcher(config={'message_format': '[[LOG_MESSAGE_STATIC]]'})
+    assert dispatcher.write_messages([make_full_message(message_static=str(i)) for i in range(3)]) == 3
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 3 and lines[2].endswith('2' + ConsoleDispatcher.ascii_colour_codes['reset'])
+
+
+def test_loop_writer(test_context: TestContext):
+    """
+    In the asyncio mode, the logger methods only queue the message on the loop, the async dispatchers are awaited
+    on the loop and the plain ones write on the dispatch thread.  Both get every message, in order.
+    """
+    import asyncio
+    from test_fixtures import RecordingAsyncDispatcher
+
+    class ThreadRecordingDispatcher(RecordingDispatcher):
+        def write_message(self, message_object: Message) -> bool:
+            self.thread_names.add(threading.current_thread().name)
+            return super().write_message(message_object)
+
+    logger = AlienLogger()
+    plain = ThreadRecordingDispatcher()
+    plain.thread_names = set()
+    async_recorder = RecordingAsyncDispatcher()
+    logger.dispatchers = {'plain': plain, 'async': async_recorder}
+
+    async def main():
+        writer = logger.start_loop_writer(queue_size=100)
+        assert logger.start_loop_writer() is writer, "The mode is started once per loop."
+        for index in range(50):
+            logger.info(__name__, str(index))
+        assert not plain.messages and not async_recorder.messages, "The sync methods only queue on the loop."
+
+        await logger.ainfo(__name__, '50', {'index': 50})
+        await asyncio.get_running_loop().run_in_executor(None, logger.warning, __name__, '51')
+        await logger.aflush()
+        expected = [str(index) for index in range(52)]
+        assert [m.message_static for m in plain.messages] == expected
+        assert [m.message_static for m in async_recorder.messages] == expected
+        assert plain.thread_names == {'alienprobe-loop-dispatch_0'}, "Blocking dispatchers never run on the loop."
+
+        await logger.stop_loop_writer()
+        await logger.adebug(__name__, 'after stop')
+        assert async_recorder.messages[-1].message_static == '51', "The async dispatcher write is only scheduled."
+        await asyncio.sleep(0.01)
+        assert async_recorder.messages[-1].message_static == 'after stop'
+        assert plain.messages[-1].message_static == 'after stop', "Sync dispatch again after the stop."
+
+    asyncio.run(main())
+
+
+def test_loop_writer_backpressure(test_context: TestContext):
+    """
+    When the queue of the loop is full, the sync methods drop the message, and the awaitable ones wait for room.
+    """
+    import asyncio
+    from test_fixtures import RecordingAsyncDispatcher
+
+    logger = AlienLogger()
+    recorder = RecordingAsyncDispatcher()
+    logger.dispatchers = {'async': recorder}
+
+    async def main():
+        writer = logger.start_loop_writer(queue_size=10)
+        for index in range(15):
+            logger.info(__name__, f"sync {index}")
+        assert writer.dropped_count == 5
+
+        for index in range(30):
+            await logger.ainfo(__name__, f"awaited {index}")
+        await logger.aflush()
+        assert writer.dropped_count == 5, "The awaitable methods never drop."
+        assert [m.message_static for m in recorder.messages] == \
+            [f"sync {index}" for index in range(10)] + [f"awaited {index}" for index in range(30)]
+        await logger.stop_loop_writer()
+
+    asyncio.run(main())
+
+
+def test_async_dispatcher_requires_write_messages(test_context: TestContext):
+    """
+    An AsyncBaseDispatcher without its write_messages coroutine can't be instantiated.
+    """
+    import pytest
+    from alienprobe.dispatchers.async_base_dispatcher import AsyncBaseDispatcher
+
+    class IncompleteDispatcher(AsyncBaseDispatcher):
+        def config_dispatcher(self, config: dict):
+            pass
+
+    with pytest.raises(TypeError):
+        IncompleteDispatcher()
@@ -0,0 +1,852 @@
+"""
+Tests for the dispatchers, and the formatting they share.
+"""
+import os
+
+from alienprobe.dispatchers.console_dispatcher import ConsoleDispatcher
+from alienprobe.dispatchers.message_template import CompiledMessageFormat
+from alienprobe.log_levels import LogLevels
+from alienprobe.message import Message
+
+
+def make_message(**kwargs) -> Message:
+    """
+    Builds a message with some defaults, for the formatting tests.
+    :param kwargs: The fields to override.
+    :return: The message.
+    """
+    return Message(level=kwargs.get('level', LogLevels.INFO),
+                   class_name=kwargs.get('class_name', 'myapp.mymodule'),
+                   message_static=kwargs.get('message_static', 'Read input file'),
+                   params=kwargs.get('params', {'path': '/tmp/in.csv', 'file_size': 42}),
+                   ex=kwargs.get('ex', None), instance_id='INSTANCE', machine_name='MACHINE')
+
+
+def test_compiled_format():
+    """
+    The compiled format renders every known token, and leaves unknown tokens alone.
+    """
+    compiled = CompiledMessageFormat(
+        message_format='machine_name="[[MACHINE_NAME]]" instance="[[INSTANCE_ID]]" level="[[LOG_LEVEL]]" '
+                       'class="[[CLASS_NAME]]" message="[[LOG_MESSAGE_STATIC]]" [[LOG_PARAMS]] [[UNKNOWN]]',
+        exception_format=' exception="[[EXCEPTION_TEXT]]"', datetime_format='%Y', log_utc=True)
+
+    assert compiled.message_template.token_names == ['MACHINE_NAME', 'INSTANCE_ID', 'LOG_LEVEL', 'CLASS_NAME',
+                                                     'LOG_MESSAGE_STATIC', 'LOG_PARAMS']
+    assert compiled.render(make_message()) == \
+           'machine_name="MACHINE" instance="INSTANCE" level="INFO" class="myapp.mymodule" ' \
+           'message="Read input file" path="/tmp/in.csv" file_size=42 [[UNKNOWN]]'
+
+    try:
+        raise RuntimeError('Boom')
+    except RuntimeError as ex:
+        rendered = compiled.render(make_message(ex=ex, params=None))
+    assert rendered.startswith('machine_name="MACHINE"'), "The message part comes first."
+    assert 'exception="Traceback' in rendered and 'RuntimeError: Boom' in rendered
+
+
+def test_format_message_compiles_once():
+    """
+    format_message compiles a format the first time it sees it, and reuses it after that.
+    """
+    dispatcher = ConsoleDispatcher()
+    dispatcher.config_dispatcher(config={'message_format': '[[LOG_LEVEL]] [[LOG_MESSAGE_STATIC]]'})
+    assert dispatcher.compiled_format.render(make_message()) == 'INFO Read input file'
+
+    rendered = dispatcher.format_message(make_message(level=LogLevels.ERROR), datetime_format='%Y', log_utc=True,
+                                         message_format='[[LOG_LEVEL]]!', exception_format='')
+    assert rendered == 'ERROR!'
+    assert len(dispatcher._compiled_formats) == 2
+    assert not ConsoleDispatcher._compiled_formats, "The compiled formats are per dispatcher."
+
+
+def test_buffered_console(capsys):
+    """
+    The buffered console holds the lines until a flush, or a message at the flush level.
+    """
+    dispatcher = ConsoleDispatcher()
+    dispatcher.config_dispatcher(config={'message_format': '[[LOG_MESSAGE_STATIC]]', 'buffered': True,
+                                         'colorize_messages': False, 'buffer_size_bytes': 1024 * 1024,
+                                         'buffer_flush_interval_ms': 60000, 'buffer_flush_level': 'error'})
+    try:
+        dispatcher.write_message(make_message(message_static='Buffered info'))
+        assert capsys.readouterr().out == '', "An INFO message stays in the buffer."
+
+        dispatcher.write_message(make_message(message_static='Urgent error', level=LogLevels.ERROR))
+        assert capsys.readouterr().out == 'Buffered info\nUrgent error\n', "An ERROR flushes the buffer."
+
+        dispatcher.write_message(make_message(message_static='Flushed info'))
+        dispatcher.flush()
+        assert capsys.readouterr().out == 'Flushed info\n'
+    finally:
+        dispatcher.close()
+
+    dispatcher.write_message(make_message(message_static='After close'))
+    assert capsys.readouterr().out == 'After close\n', "After close, we write straight to stdout."
+
+
+def test_message_is_immutable():
+    """
+    A message cannot be changed once it is built, so it can be shared by every dispatcher and thread.  It can still
+    be pickled.
+    """
+    import pickle
+    import pytest
+
+    msg_obj = make_message()
+    with pytest.raises(AttributeError):
+        msg_obj.params = {}
+    assert msg_obj.timestamp_ns > 0, "The timestamp is captured when the message is built."
+
+    copy = pickle.loads(pickle.dumps(make_message(class_name='pickled', params={'a': 1})))
+    assert (copy.class_name, copy.params, copy.level) == ('pickled', {'a': 1}, LogLevels.INFO)
+
+
+def test_date_format_cache():
+    """
+    The cached date formatting gives the same result as a full strftime, for every kind of format.
+    """
+    import datetime
+    from alienprobe.dispatchers.date_cache import DateFormatCache
+
+    timestamps_ns = [1_700_000_000_123_456_789, 1_700_000_000_987_654_321, 1_700_000_001_000_001_000]
+    for datetime_format in ['%Y-%m-%d_%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%f|%f', '%H:%M %%f %f']:
+        for log_utc in [True, False]:
+            cache = DateFormatCache(datetime_format=datetime_format, log_utc=log_utc)
+            for timestamp_ns in timestamps_ns:
+                seconds = timestamp_ns // 1000 / 1e6
+                if log_utc:
+                    expected_date = datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc)
+                    expected_date = expected_date.replace(tzinfo=None)
+                else:
+                    expected_date = datetime.datetime.fromtimestamp(seconds)
+                assert cache.format(timestamp_ns) == expected_date.strftime(datetime_format), datetime_format
+
+
+def test_same_timestamp_for_every_dispatcher():
+    """
+    The time is captured once per message, so every dispatcher shows the same time for the same message.
+    """
+    first = CompiledMessageFormat(message_format='[[DATE_STRING]]', exception_format='',
+                                  datetime_format='%H:%M:%S.%f', log_utc=True)
+    second = CompiledMessageFormat(message_format='[[DATE_STRING]]', exception_format='',
+                                   datetime_format='%H:%M:%S.%f', log_utc=True)
+    msg_obj = make_message()
+    assert first.render(msg_obj) == second.render(msg_obj)
+    assert first.render(Message(LogLevels.INFO, 'x', 'y', timestamp_ns=0)) == '00:00:00.000000'
+
+
+class Money:
+    """
+    One of "our" types, with its own encoder registered from the config.
+    """
+
+    def __init__(self, amount: str, currency: str):
+        self.amount = amount
+        self.currency = currency
+
+
+def encode_money(value: Money) -> str:
+    """
+    The encoder of Money, referenced by its dotted path in the config.
+    """
+    return f'"{value.amount} {value.currency}"'
+
+
+def encode_year(value) -> str:
+    """
+    A datetime encoder, referenced by its dotted path in the config.
+    """
+    return str(value.year)
+
+
+def test_serializers():
+    """
+    Every param type goes through the registry, datetimes use the datetime_format of the dispatcher, and your own
+    types can be registered from the config.
+    """
+    import datetime
+    import decimal
+    import uuid
+    from pathlib import Path
+    from alienprobe.serializers import DEFAULT_SERIALIZERS, load_serializers
+
+    compiled = CompiledMessageFormat(message_format='[[LOG_PARAMS]]', exception_format='',
+                                     datetime_format='%Y/%m/%d', log_utc=True)
+    params = {'text': 'abc', 'count': 3, 'ratio': 0.5, 'flag': True, 'nothing': None,
+              'when': datetime.datetime(2024, 1, 2, 3, 4, 5), 'day': datetime.date(2024, 1, 2),
+              'price': decimal.Decimal('1.50'), 'id': uuid.UUID(int=1), 'path': Path('/tmp/x')}
+    assert compiled.render(make_message(params=params)) == \
+           'text="abc" count=3 ratio=0.5 flag=True nothing="None" when="2024/01/02" day="2024-01-02" ' \
+           'price=1.50 id="00000000-0000-0000-0000-000000000001" path="/tmp/x"'
+
+    class Celsius(float):
+        pass
+    assert compiled.serializers.encode(Celsius(21.5)) == '21.5', "Subclasses use the encoder of their base class."
+
+    assert compiled.serializers.encode(Money('10', 'EUR')).startswith('"<')
+    try:
+        DEFAULT_SERIALIZERS.replace_config_encoders(load_serializers({f'{__name__}.Money': f'{__name__}.encode_money'}))
+        assert compiled.serializers.encode(Money('10', 'EUR')) == '"10 EUR"', \
+            "Registering a type clears the caches of the dispatchers."
+    finally:
+        DEFAULT_SERIALIZERS.replace_config_encoders({})
+    assert compiled.serializers.encode(Money('10', 'EUR')).startswith('"<'), "The config encoders are replaced whole."
+
+    try:
+        DEFAULT_SERIALIZERS.replace_config_encoders(load_serializers({'datetime.datetime': f'{__name__}.encode_year'}))
+        assert compiled.render(make_message(params={'when': datetime.datetime(2024, 1, 2)})) == 'when=2024', \
+            "A config encoder wins over the datetime encoder of the dispatcher."
+    finally:
+        DEFAULT_SERIALIZERS.replace_config_encoders({})
+
+
+def test_compact_encoder():
+    """
+    Containers are rendered on a single line, and cut explicitly at the depth, item and size limits.
+    """
+    from alienprobe.compact_encoder import CompactEncoder
+
+    encoder = CompactEncoder(max_depth=2, max_items=3, max_bytes=60)
+    assert encoder.encode({'name': 'Andre', 'tags': ('a',), 'empty': set()}) == \
+           "{'name': 'Andre', 'tags': ('a',), 'empty': set()}"
+    assert encoder.encode(list(range(10))) == '[0, 1, 2, ...(+7 items)]'
+    assert encoder.encode({'a': {'b': {'c': 1}}}) == "{'a': {'b': {...}}}"
+
+    cycle = [1]
+    cycle.append(cycle)
+    assert encoder.encode(cycle) == '[1, <cycle>]'
+
+    encoded = encoder.encode(['x' * 100])
+    assert encoded == "['" + 'x' * 58 + '...(truncated)'
+
+    dispatcher = ConsoleDispatcher()
+    dispatcher.config_param_limits({'param_max_items': 2})
+    dispatcher.config_dispatcher({'colorize_messages': False, 'message_format': '[[LOG_PARAMS]]'})
+    assert dispatcher.render_line(make_message(params={'ids': [1, 2, 3], 'when': [0.5]})) == \
+           'ids="[1, 2, ...(+1 items)]" when="[0.5]"'
+
+
+def test_json_lines(tmp_path, capsys):
+    """
+    Every message is one JSON object per line, to a file or to stdout, with the params as JSON values.
+    """
+    import datetime
+    import json
+    from alienprobe.dispatchers.json_lines_dispatcher import JsonLinesDispatcher
+
+    output_path = tmp_path / 'log.jsonl'
+    dispatcher = JsonLinesDispatcher()
+    dispatcher.config_dispatcher({'output_path': str(output_path), 'datetime_format': '%Y'})
+    try:
+        raise RuntimeError('Boom')
+    except RuntimeError as ex:
+        error = ex
+    cycle = [1]
+    cycle.append(cycle)
+    params = {'text': 'café "quoted"', 'count': 3, 'ratio': 0.5, 'flag': False, 'nothing': None,
+              'nan': float('nan'), 'day': datetime.date(2024, 1, 2), 'tags': {'a': [1, 2]}, 'cycle': cycle}
+    assert dispatcher.write_messages([make_message(params=params), make_message(level=LogLevels.ERROR, ex=error,
+                                                                                params=None)]) == 2
+    dispatcher.close()
+
+    lines = output_path.read_text(encoding='utf-8').splitlines()
+    first, second = [json.loads(line) for line in lines]
+    assert first['machine_name'] == 'MACHINE' and first['instance_id'] == 'INSTANCE' and first['level'] == 'INFO'
+    assert first['message'] == 'Read input file' and first['class_name'] == 'myapp.mymodule'
+    assert first['params'] == {'text': 'café "quoted"', 'count': 3, 'ratio': 0.5, 'flag': False,
+                               'nothing': None, 'nan': 'nan', 'day': '2024-01-02', 'tags': {'a': [1, 2]},
+                               'cycle': '[1, <cycle>]'}
+    assert second['level'] == 'ERROR' and 'params' not in second
+    assert 'RuntimeError: Boom' in second['exception']
+    assert dispatcher.write_message(make_message()) is False, "Messages after close are dropped."
+
+    dispatcher = JsonLinesDispatcher()
+    dispatcher.config_dispatcher({})
+    dispatcher.write_message(make_message(params={'n': 1}))
+    assert json.loads(capsys.readouterr().out)['params'] == {'n': 1}
+
+    read_fd, write_fd = os.pipe()
+    try:
+        dispatcher = JsonLinesDispatcher()
+        dispatcher.config_dispatcher({'output_fd': write_fd})
+        dispatcher.write_message(make_message(message_static='To the pipe'))
+        assert json.loads(os.read(read_fd, 65536))['message'] == 'To the pipe'
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+def test_file_dispatcher(tmp_path):
+    """
+    The file dispatcher buffers, rotates on size and on time, compresses the rotated files in the background, and
+    keeps retention_count of them.
+    """
+    import gzip
+    import time
+    from alienprobe.dispatchers.file_dispatcher import FileDispatcher
+
+    file_path = tmp_path / 'logs' / 'app.log'
+    dispatcher = FileDispatcher()
+    dispatcher.config_dispatcher({'file_path': str(file_path), 'message_format': '[[LOG_MESSAGE_STATIC]]',
+                                  'flush_interval_ms': 60000, 'rotate_max_bytes': 100, 'retention_count': 2,
+                                  'compression': 'gzip'})
+    try:
+        dispatcher.write_message(make_message(message_static='Buffered'))
+        assert file_path.read_bytes() == b'', "An INFO message stays in the buffer."
+        dispatcher.write_message(make_message(message_static='Urgent', level=LogLevels.ERROR))
+        assert file_path.read_bytes() == b'Buffered\nUrgent\n', "An ERROR flushes the buffer."
+
+        for index in range(4):
+            dispatcher.write_messages([make_message(message_static=f'{index:02d}' + 'x' * 60)])
+
+        dispatcher._next_rotation_time = time.time() - 1
+        dispatcher.write_message(make_message(message_static='After the time rotation'))
+    finally:
+        dispatcher.close()
+
+    assert file_path.read_bytes() == b'After the time rotation\n'
+    rotated = dispatcher.rotated_files()
+    assert len(rotated) == 2, "Only retention_count rotated files are kept."
+    assert all(path.endswith('.gz') for path in rotated)
+    assert [gzip.decompress(open(path, 'rb').read()) for path in rotated] == \
+           [b'02' + b'x' * 60 + b'\n', b'03' + b'x' * 60 + b'\n']
+    assert dispatcher.write_message(make_message()) is False, "Messages after close are dropped."
+
+
+def write_file_records(file_path: str, worker: int, count: int, start):
+    """
+    A worker process of test_file_dispatcher_multi_process, writes count records of many sizes to the shared file,
+    once all the workers are started.
+    """
+    from alienprobe.dispatchers.file_dispatcher import FileDispatcher
+
+    dispatcher = FileDispatcher()
+    dispatcher.config_dispatcher({'file_path': file_path, 'message_format': '[[LOG_MESSAGE_STATIC]]',
+                                  'multi_process': True, 'buffer_size_bytes': 16 * 1024, 'rotate_max_bytes': 256 * 1024,
+                                  'retention_count': 0, 'compression': 'gzip'})
+    start.wait()
+    batch = []
+    for seq in range(count):
+        batch.append(make_message(message_static=f'{worker}:{seq}:' + 'x' * (seq * 37 % 6000) + ':end', params=None))
+        if len(batch) == seq % 7 + 1:
+            dispatcher.write_messages(batch)
+            batch = []
+    dispatcher.write_messages(batch)
+    dispatcher.close()
+
+
+def test_file_dispatcher_multi_process(tmp_path):
+    """
+    Several processes append to the same file and rotate (and compress) it together, no record is torn or lost.
+    """
+    import gzip
+    import multiprocessing
+
+    file_path = tmp_path / 'shared.log'
+    workers, count = 4, 2000
+    context = multiprocessing.get_context('spawn')
+    start = context.Barrier(workers)
+    processes = [context.Process(target=write_file_records, args=(str(file_path), worker, count, start))
+                 for worker in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=120)
+        assert process.exitcode == 0
+
+    log_paths = [path for path in tmp_path.iterdir() if not path.name.endswith('.lock')]
+    assert len(log_paths) > 1, "The file was rotated."
+    seen = []
+    for path in log_paths:
+        content = gzip.decompress(path.read_bytes()) if path.name.endswith('.gz') else path.read_bytes()
+        for line in content.decode().splitlines():
+            worker, seq, padding, end = line.split(':')
+            assert end == 'end' and padding == 'x' * (int(seq) * 37 % 6000), f"Torn record in {path.name}"
+            seen.append((int(worker), int(seq)))
+    assert len(seen) == workers * count, "Records were lost or written twice."
+    assert set(seen) == {(worker, seq) for worker in range(workers) for seq in range(count)}, "Records were lost."
+
+
+def test_ring_buffer_dispatcher():
+    """
+    The ring buffer keeps the last messages within its count and byte limits, and dumps them downstream on a
+    trigger, on demand, or on its signal.
+    """
+    import signal
+    import threading
+    import time
+    from alienprobe.dispatchers.ring_buffer_dispatcher import RingBufferDispatcher, estimate_message_bytes
+
+    dispatcher = RingBufferDispatcher()
+    dispatcher.config_dispatcher({'capacity': 3, 'trigger_level': 'error', 'passthrough_level': 'warning',
+                                  'dump_signal': 'SIGUSR1',
+                                  'downstream': {'dispatcher_class_name': 'test_fixtures.RecordingDispatcher'}})
+    recorded = dispatcher.downstream.messages
+    try:
+        debug_messages = [make_message(level=LogLevels.DEBUG, message_static=f'Step {index}') for index in range(5)]
+        dispatcher.write_messages(debug_messages)
+        assert recorded == [], "Nothing is written until a trigger."
+        assert dispatcher.dropped_count == 2
+
+        warning = make_message(level=LogLevels.WARNING, message_static='Passed through')
+        dispatcher.write_message(warning)
+        assert recorded == [warning]
+
+        error = make_message(level=LogLevels.ERROR, message_static='Boom')
+        dispatcher.write_message(error)
+        assert [m.message_static for m in recorded] == ['Passed through', 'Step 2', 'Step 3', 'Step 4', 'Boom'], \
+            "The context is dumped before the trigger."
+        assert recorded[0] is warning and recorded[-1] is error, "Only the kept messages are copies."
+        assert dispatcher.buffered_messages() == []
+
+        dispatcher.write_message(debug_messages[0])
+        assert dispatcher.dump() == 1 and recorded[-1].message_static == 'Step 0'
+
+        params = {'step': 1}
+        dispatcher.write_message(make_message(level=LogLevels.DEBUG, message_static='Mutated', params=params))
+        params['step'] = 2
+        assert dispatcher.buffered_messages()[0].params == {'step': 1}, "The kept params are a snapshot."
+        dispatcher.dump()
+
+        #
+        # A reload builds the new recorder before it closes the old one, the signal must stay with the new one.
+        #
+        reloaded = RingBufferDispatcher()
+        reloaded.config_dispatcher({'dump_signal': 'SIGUSR1',
+                                    'downstream': {'dispatcher_class_name': 'test_fixtures.RecordingDispatcher'}})
+        dispatcher.close()
+        dispatcher = reloaded
+        recorded = reloaded.downstream.messages
+
+        reloaded.write_message(debug_messages[1])
+        signal.raise_signal(signal.SIGUSR1)
+        for _ in range(100):
+            if recorded and recorded[-1].message_static == 'Step 1':
+                break
+            time.sleep(0.01)
+        assert recorded and recorded[-1].message_static == 'Step 1', "The signal dumps the buffer of the new recorder."
+    finally:
+        dispatcher.close()
+    assert signal.getsignal(signal.SIGUSR1) == signal.SIG_DFL, "Closing the last recorder puts the handler back."
+
+    errors = []
+
+    def configure_off_main_thread():
+        try:
+            RingBufferDispatcher().config_dispatcher({
+                'dump_signal': 'SIGUSR2', 'downstream': {'dispatcher_class_name': 'test_fixtures.RecordingDispatcher'}})
+        except Exception as ex:
+            errors.append(ex)
+
+    thread = threading.Thread(target=configure_off_main_thread)
+    thread.start()
+    thread.join()
+    assert not errors, "A recorder configured off the main thread (a config reload) works, without its signal."
+    assert signal.getsignal(signal.SIGUSR2) == signal.SIG_DFL
+
+    message_bytes = estimate_message_bytes(make_message(level=LogLevels.DEBUG))
+    dispatcher = RingBufferDispatcher()
+    dispatcher.config_dispatcher({'capacity': 100, 'max_bytes': message_bytes * 2,
+                                  'downstream': {'dispatcher_class_name': 'test_fixtures.RecordingDispatcher'}})
+    dispatcher.write_messages([make_message(level=LogLevels.DEBUG, message_static='Step') for _ in range(5)])
+    assert len(dispatcher.buffered_messages()) == 2, "The buffer is also bounded by its estimated bytes."
+
+
+def test_mmap_ring_survives_a_crash(tmp_path, capsys):
+    """
+    The records written to the mmap ring are still there after the process is killed, and the CLI reads back the
+    most recent ones in order.
+    """
+    import subprocess
+    import sys
+    from alienprobe.cli import main
+    from alienprobe.dispatchers.mmap_ring_dispatcher import read_ring_file
+
+    ring_path = tmp_path / 'app.ring'
+    crashing_code = f'''
+import os, signal
+from alienprobe.dispatchers.mmap_ring_dispatcher import MmapRingDispatcher
+from alienprobe.log_levels import LogLevels
+from alienprobe.message import Message
+dispatcher = MmapRingDispatcher()
+dispatcher.config_dispatcher({{'file_path': {str(ring_path)!r}, 'size_bytes': 8192,
+                               'message_format': '[[LOG_MESSAGE_STATIC]]'}})
+for index in range(1000):
+    dispatcher.write_message(Message(LogLevels.INFO, 'crash', f'Record {{index}}'))
+os.kill(os.getpid(), signal.SIGKILL)
+'''
+    process = subprocess.run([sys.executable, '-c', crashing_code],
+                             env={**os.environ, 'PYTHONPATH': os.pathsep.join(sys.path)})
+    assert process.returncode == -9
+
+    records = read_ring_file(str(ring_path))
+    assert 100 < len(records) < 1000, "The ring only keeps the most recent records."
+    assert records == [(sequence, f'Record {sequence}'.encode()) for sequence in range(1000 - len(records), 1000)]
+
+    assert main(['read-ring', str(ring_path), '--last', '2', '--sequence']) == 0
+    assert capsys.readouterr().out == '998 Record 998\n999 Record 999\n'
+
+    from alienprobe.dispatchers.mmap_ring_dispatcher import MmapRingDispatcher
+    dispatcher = MmapRingDispatcher()
+    dispatcher.config_dispatcher({'file_path': str(ring_path), 'size_bytes': 8192,
+                                  'message_format': '[[LOG_MESSAGE_STATIC]]'})
+    dispatcher.write_message(make_message(message_static='After the restart'))
+    dispatcher.close()
+    assert read_ring_file(str(ring_path))[-1] == (1000, b'After the restart'), "A restart carries on after the crash."
+
+
+def fail_with(item_id: int):
+    """
+    Raises the same stack trace for every item, with a different message.
+    """
+    raise ConnectionError(f'Item {item_id} refused')
+
+
+def test_exception_text_is_shared_and_deduped(monkeypatch):
+    """
+    A stack trace is rendered once per message for every dispatcher, and repeated stack traces are only referenced
+    within the dedup window.
+    """
+    import traceback
+    from alienprobe.exception_text import ExceptionTextCache, EXCEPTION_TEXT_CACHE, exception_fingerprint
+
+    calls = []
+    format_exception = traceback.format_exception
+    monkeypatch.setattr(traceback, 'format_exception', lambda *args: calls.append(args) or format_exception(*args))
+
+    errors = []
+    for item_id in range(3):
+        try:
+            fail_with(item_id)
+        except ConnectionError as ex:
+            errors.append(ex)
+
+    first = ConsoleDispatcher()
+    first.config_dispatcher({'message_format': '[[LOG_MESSAGE_STATIC]]', 'exception_format': ' [[EXCEPTION_TEXT]]'})
+    second = CompiledMessageFormat(message_format='', exception_format='[[EXCEPTION_TEXT]]', datetime_format='%Y',
+                                   log_utc=True)
+    message_object = make_message(ex=errors[0])
+    assert first.compiled_format.render(message_object).endswith(second.render(message_object))
+    assert len(calls) == 1, "The stack trace is rendered once, for both dispatchers."
+
+    assert len({exception_fingerprint(ex) for ex in errors}) == 1, "The message is not part of the fingerprint."
+    cache = ExceptionTextCache(dedup_seconds=60)
+    full_text, second_text, third_text = [cache.render(ex) for ex in errors]
+    fingerprint = exception_fingerprint(errors[0])
+    assert full_text.startswith(f'[fingerprint {fingerprint}]\nTraceback') and 'Item 0 refused' in full_text
+    assert second_text == f'ConnectionError: Item 1 refused [same stack trace as fingerprint {fingerprint}, ' \
+                          f'repeat 1 within 60s]'
+    assert third_text.endswith('repeat 2 within 60s]')
+    assert EXCEPTION_TEXT_CACHE.dedup_seconds == 0, "The dedup is off unless it is configured."
+
+
+def test_syslog_dispatcher(tmp_path):
+    """
+    The syslog dispatcher sends RFC 5424 (or RFC 3164) frames over a Unix datagram socket or UDP, and drops the
+    messages instead of blocking when the socket buffer is full.
+    """
+    import re
+    import socket
+    from alienprobe.dispatchers.syslog_dispatcher import SyslogDispatcher
+
+    socket_path = str(tmp_path / 'log.sock')
+    receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    receiver.bind(socket_path)
+    receiver.settimeout(5)
+    dispatcher = SyslogDispatcher()
+    dispatcher.config_dispatcher({'socket_path': socket_path, 'facility': 'local0', 'app_name': 'my app'})
+    try:
+        assert dispatcher.write_message(make_message(level=LogLevels.WARNING))
+        frame = receiver.recv(65536).decode()
+        assert re.fullmatch(rf'<132>1 \d{{4}}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{{6}}Z MACHINE my_app {os.getpid()} - - '
+                            r'class="myapp.mymodule" message="Read input file" path="/tmp/in.csv" file_size=42', frame)
+
+        dispatcher.write_message(make_message(level=LogLevels.DEBUG, params={'blob': 'x' * 20000}))
+        assert len(receiver.recv(65536)) == 8192, "Long messages are cut to max_message_bytes."
+
+        dispatcher.write_message(make_message(level=LogLevels.DEBUG, params={'blob': '\u00e9' * 20000}))
+        frame = receiver.recv(65536)
+        assert 8190 <= len(frame) <= 8192 and frame.decode().endswith('\u00e9'), "We cut on a character boundary."
+
+        #
+        # Nobody reads, so the socket buffer fills up:  the sends don't block, the overflow is counted.
+        #
+        sent = dispatcher.write_messages([make_message() for _ in range(5000)])
+        assert sent < 5000 and dispatcher.dropped_count == 5000 - sent
+        assert dispatcher.sent_count == sent + 3
+    finally:
+        dispatcher.close()
+        receiver.close()
+
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.settimeout(5)
+    dispatcher = SyslogDispatcher()
+    dispatcher.config_dispatcher({'host': '127.0.0.1', 'port': receiver.getsockname()[1], 'protocol': 'rfc3164',
+                                  'app_name': 'myapp'})
+    try:
+        assert dispatcher.write_message(make_message(level=LogLevels.FATAL, params={}))
+        frame = receiver.recv(65536).decode()
+        assert re.fullmatch(rf'<9>[A-Z][a-z]{{2}} [ 1-3]\d \d\d:\d\d:\d\d MACHINE myapp\[{os.getpid()}\]: '
+                            r'class="myapp.mymodule" message="Read input file" ', frame)
+    finally:
+        dispatcher.close()
+        receiver.close()
+
+
+def start_tcp_collector(port: int = 0):
+    """
+    A local TCP collector for the tests, that keeps everything it receives.
+    :param port: The port to listen on, 0 for any free one.
+    :return: The port, the received bytes (one bytearray per connection), and a function that stops the collector
+    and drops its connections, like a restart.
+    """
+    import socket
+    import threading
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', port))
+    listener.listen(8)
+    received = []
+    connections = []
+
+    def read_connection(conn, data):
+        with conn:
+            try:
+                while chunk := conn.recv(65536):
+                    data += chunk
+            except OSError:
+                pass
+
+    def accept_connections():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            connections.append(conn)
+            received.append(bytearray())
+            threading.Thread(target=read_connection, args=(conn, received[-1]), daemon=True).start()
+
+    def stop():
+        for sock in [listener] + connections:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    threading.Thread(target=accept_connections, daemon=True).start()
+    return listener.getsockname()[1], received, stop
+
+
+def test_tcp_dispatcher():
+    """
+    The tcp dispatcher streams JSON lines (or length prefixed text records) to a collector, spools while the
+    collector is down without blocking, and reconnects when it is back.
+    """
+    import json
+    import struct
+    import time
+    from alienprobe.dispatchers.tcp_dispatcher import TcpDispatcher
+
+    def wait_for(condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    port, received, stop_collector = start_tcp_collector()
+    dispatcher = TcpDispatcher()
+    dispatcher.config_dispatcher({'host': '127.0.0.1', 'port': port, 'reconnect_min_ms': 10,
+                                  'reconnect_max_ms': 50, 'spool_max_bytes': 20000})
+    try:
+        assert dispatcher.write_messages([make_message(params={'index': index}) for index in range(100)]) == 100
+        dispatcher.flush()
+        assert wait_for(lambda: sum(data.count(b'\n') for data in received) == 100)
+        records = [json.loads(line) for line in b''.join(received).splitlines()]
+        assert [record['params']['index'] for record in records] == list(range(100))
+        assert records[0]['message'] == 'Read input file' and records[0]['machine_name'] == 'MACHINE'
+
+        #
+        # The collector goes away:  logging does not block, the spool keeps the newest records within its bound.
+        #
+        stop_collector()
+        started = time.monotonic()
+        for index in range(1000):
+            dispatcher.write_message(make_message(params={'index': index}))
+        assert time.monotonic() - started < 1, "Logging never waits for the collector."
+        assert wait_for(lambda: dispatcher.dropped_count > 0) and dispatcher.spooled_bytes <= 20000
+
+        #
+        # It is back on the same port:  the spool is sent after the reconnect, oldest first.
+        #
+        port, received, stop_collector = start_tcp_collector(port)
+        dispatcher.write_message(make_message(params={'index': 'last'}))
+        assert wait_for(lambda: b'"last"' in b''.join(received))
+        indexes = [json.loads(line)['params']['index'] for line in b''.join(received).splitlines()]
+        kept = [index for index in indexes if index != 'last']
+        assert indexes[-1] == 'last' and kept == sorted(kept) and kept[-1] == 999
+        assert len(set(kept)) + dispatcher.dropped_count >= 1000
+        assert dispatcher.connect_count >= 2
+    finally:
+        dispatcher.close()
+        stop_collector()
+
+    port, received, stop_collector = start_tcp_collector()
+    dispatcher = TcpDispatcher()
+    dispatcher.config_dispatcher({'host': '127.0.0.1', 'port': port, 'framing': 'length_prefixed',
+                                  'record_format': 'text', 'message_format': '[[LOG_MESSAGE_STATIC]]'})
+    try:
+        dispatcher.write_messages([make_message(message_static='two\nlines'), make_message()])
+        dispatcher.close()
+        assert wait_for(lambda: len(b''.join(received)) == 8 + len('two\nlines') + len('Read input file'))
+        data = b''.join(received)
+        (length,) = struct.unpack_from('>I', data)
+        assert data[4:4 + length] == b'two\nlines'
+        assert data[4 + length + 4:] == b'Read input file'
+    finally:
+        stop_collector()
+
+
+
+def test_tcp_peer_closed_with_high_fd():
+    """
+    A connection on a file descriptor past 1023 (out of reach of select()) is still seen as open, until the peer
+    really closes it.
+    """
+    import resource
+    import socket
+    import pytest
+    from alienprobe.dispatchers.tcp_dispatcher import TcpDispatcher
+
+    high_fd = 1500
+    if resource.getrlimit(resource.RLIMIT_NOFILE)[0] <= high_fd:
+        pytest.skip("The file descriptor limit is too low to open a descriptor past 1023.")
+
+    ours, peer = socket.socketpair()
+    os.dup2(ours.fileno(), high_fd)
+    ours.close()
+    sock = socket.socket(fileno=high_fd)
+    try:
+        assert not TcpDispatcher._peer_closed(sock), "An idle open connection is not closed."
+        peer.sendall(b'ack\n')
+        assert not TcpDispatcher._peer_closed(sock), "What the peer sends is read and thrown away."
+        peer.close()
+        assert TcpDispatcher._peer_closed(sock), "The end of the stream is a closed connection."
+    finally:
+        sock.close()
+
+def test_sqlite_dispatcher(tmp_path):
+    """
+    The sqlite dispatcher inserts a row per message on its writer thread, commits on the row count (or on flush),
+    and sets up WAL mode and the configured indexes.
+    """
+    import sqlite3
+    import time
+    from alienprobe.dispatchers.sqlite_dispatcher import SqliteDispatcher
+
+    database_path = str(tmp_path / 'logs.db')
+    dispatcher = SqliteDispatcher()
+    dispatcher.config_dispatcher({'database_path': database_path, 'commit_max_rows': 10,
+                                  'commit_interval_ms': 60000, 'indexes': ['level_timestamp', 'message_static']})
+    reader = sqlite3.connect(database_path)
+    try:
+        assert reader.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        index_names = {row[1] for row in reader.execute('PRAGMA index_list(log_messages)')}
+        assert index_names == {'log_messages_level_timestamp_idx', 'log_messages_message_static_idx'}
+
+        assert dispatcher.write_messages([make_message(params={'index': index}) for index in range(25)]) == 25
+        deadline = time.monotonic() + 5
+        while dispatcher.written_count < 20 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert reader.execute('SELECT count(*) FROM log_messages').fetchone()[0] == 20, \
+            "Only full batches of commit_max_rows are committed before the interval."
+
+        try:
+            raise ValueError('bad row')
+        except ValueError as ex:
+            dispatcher.write_message(make_message(level=LogLevels.ERROR, ex=ex,
+                                                  params={'ratio': float('nan'), 'tags': ['a', 'b']}))
+        dispatcher.flush()
+        assert dispatcher.written_count == 26
+        assert [row[0] for row in reader.execute("SELECT json_extract(params, '$.index') FROM log_messages "
+                                                 "WHERE level_id = 2 ORDER BY id")] == list(range(25))
+        level_id, class_name, params, exception = reader.execute(
+            'SELECT level_id, class_name, params, exception_text FROM log_messages WHERE level_id = 5').fetchone()
+        assert (level_id, class_name) == (5, 'myapp.mymodule')
+        assert params == '{"ratio": "nan", "tags": ["a", "b"]}', "Values that are not JSON go as their text."
+        assert 'ValueError: bad row' in exception
+    finally:
+        dispatcher.close()
+        reader.close()
+
+    assert not dispatcher.write_message(make_message()), "Messages written after close are dropped."
+
+
+def test_http_bulk_dispatcher():
+    """
+    The http bulk dispatcher posts gzip NDJSON bodies on a keep-alive connection, retries the 429 and 5xx, and
+    drops the bodies the server rejects.
+    """
+    import gzip
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from alienprobe.dispatchers.http_bulk_dispatcher import HttpBulkDispatcher
+
+    requests = []
+    statuses = []
+
+    class BulkHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            requests.append((self.client_address, self.path, dict(self.headers), body))
+            status = statuses.pop(0) if statuses else 200
+            self.send_response(status)
+            if status == 429:
+                self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), BulkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    dispatcher = HttpBulkDispatcher()
+    dispatcher.config_dispatcher({'url': f'http://127.0.0.1:{server.server_port}/logs/_bulk?refresh=false',
+                                  'headers': {'Authorization': 'Bearer TOKEN'}, 'bulk_action': '{"index":{}}',
+                                  'body_max_records': 10, 'body_max_latency_ms': 60000, 'retry_min_ms': 1,
+                                  'max_retries': 2})
+    try:
+        statuses.extend([503, 429])
+        dispatcher.write_messages([make_message(params={'index': index}) for index in range(25)])
+        dispatcher.flush()
+        assert (dispatcher.sent_count, dispatcher.retry_count, dispatcher.in_flight_count) == (25, 2, 0)
+        assert len(requests) == 5, "Two full bodies (the first one tried 3 times), then the rest on flush."
+        assert len({client_address for client_address, _, _, _ in requests}) == 1, "One keep-alive connection."
+
+        client_address, path, headers, body = requests[-1]
+        assert path == '/logs/_bulk?refresh=false'
+        assert headers['Content-Encoding'] == 'gzip' and headers['Content-Type'] == 'application/x-ndjson'
+        assert headers['Authorization'] == 'Bearer TOKEN'
+        lines = gzip.decompress(body).decode().splitlines()
+        assert lines[0::2] == ['{"index":{}}'] * 5
+        assert [json.loads(line)['params']['index'] for line in lines[1::2]] == list(range(20, 25))
+
+        statuses.extend([400, 500, 500, 500])
+        dispatcher.write_message(make_message())
+        dispatcher.flush()
+        dispatcher.write_message(make_message())
+        dispatcher.flush()
+        assert (dispatcher.sent_count, dispatcher.dropped_count) == (25, 2), \
+            "A rejected body is dropped right away, a failing one once it is out of retries."
+    finally:
+        dispatcher.close()
+        server.shutdown()
+        server.server_close()
@@ -1,11 +1,16 @@
 """
 Test fixtures for alienlogger tests.  Sets up information for testing.
 """
+import asyncio
 import os
 from pathlib import Path
-from typing import Optional
+from typing import Optional, List, Sequence
 import pytest
 
+from alienprobe.dispatchers.async_base_dispatcher import AsyncBaseDispatcher
+from alienprobe.dispatchers.base_dispatcher import BaseDispatcher
+from alienprobe.message import Message
+
 
 class TestContext:
     """
@@ -37,6 +42,74 @@ class TestContext:
         self.log_config_path: Path = log_config_path
         assert self.log_config_path.exists(), f"Config File path for testing should exist!  {self.log_config_path}"
 
+class RecordingDispatcher(BaseDispatcher):
+    """
+    A dispatcher that keeps every message it receives, so tests can check what actually got dispatched.
+    """
+
+    """
+    The messages that were written to this dispatcher, in order.
+    """
+    messages: List[Message]
+
+    def __init__(self):
+        """
+        Constructor, starts with no messages.
+        """
+        self.messages = []
+
+    def config_dispatcher(self, config: dict):
+        """
+        Nothing to configure, we just record.
+        :param config: The configuration that we are using for this dispatcher.
+        """
+        pass
+
+    def write_message(self, message_object: Message) -> bool:
+        """
+        Records the message.
+        :param message_object: The message that was dispatched.
+        :return: True, always.
+        """
+        self.messages.append(message_object)
+        return True
+
+
+class RecordingAsyncDispatcher(AsyncBaseDispatcher):
+    """
+    An async dispatcher that keeps every message it receives, with a yield to the loop in every write, like a
+    network sink would.
+    """
+
+    """
+    The messages that were written to this dispatcher, in order.
+    """
+    messages: List[Message]
+
+    def __init__(self):
+        """
+        Constructor, starts with no messages.
+        """
+        self.messages = []
+
+    def config_dispatcher(self, config: dict):
+        """
+        Nothing to configure, we just record.
+        :param config: The configuration that we are using for this dispatcher.
+        """
+        pass
+
+    async def write_messages(self, batch: Sequence[Message]) -> int:
+        """
+        Records the messages.
+        :param batch: The messages that were dispatched.
+        :return: How many messages were recorded.
+        """
+        await asyncio.sleep(0)
+        self.messages.extend(batch)
+        return len(batch)
+
+
 def get_project_dir() -> Optional[Path]:
     """
     Figure out what is the project directory, to figure out the collateral path..
@@ -68,4 +141,34 @@ def test_context():
     project_dir = get_project_dir()
     config_file = project_dir.joinpath('testing/collateral/testing/test_alienlogger_config.toml')
     os.environ['ALIENLOGGER__CONFIG_FILE_PATH'] = str(config_file)
-    return TestContext(log_config_path=config_file)
\ No newline at end of file
+    return TestContext(log_config_path=config_file)
+
+
+def log_in_worker(worker_index: int, count: int = 50) -> int:
+    """
+    Logs from a worker process, through the global logger.  Importable, so that spawned workers can run it.
+    :param worker_index: Goes in the params of every message.
+    :param count: How many messages we log, the last one with an exception.
+    :return: How many messages were logged.
+    """
+    from alienprobe.alien_logger import get_logger
+
+    logger = get_logger()
+    for index in range(count - 1):
+        logger.info('worker', 'Worker message', {'worker': worker_index, 'index': index, 'tags': ['a', 'b']})
+    try:
+        raise ValueError(f"worker {worker_index} failed")
+    except ValueError as ex:
+        logger.error('worker', 'Worker failed', {'worker': worker_index, 'index': count - 1}, exception=ex)
+    return count
+
+
+def log_and_crash(count: int):
+    """
+    Logs from a worker process, then kills it, so it never gets to clean up.
+    :param count: How many messages we log before we die.
+    """
+    import signal
+
+    log_in_worker(worker_index=0, count=count)
+    os.kill(os.getpid(), signal.SIGKILL)
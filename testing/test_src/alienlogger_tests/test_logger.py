@@ -2,10 +2,15 @@
 Tests for the different logging capabilities.
 """
 import datetime
+import multiprocessing
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 
 from alienprobe.alien_logger import AlienLogger
 from alienprobe.log_levels import LogLevels
-from test_fixtures import test_context, TestContext
+from test_fixtures import test_context, TestContext, RecordingDispatcher, log_in_worker, log_and_crash
 
 
 def test_logger_init(test_context: TestContext):
@@ -114,3 +119,466 @@ def test_logging_object_str(test_context: TestContext):
             return f"{type(self).__name__}(age={self.age}, name={self.name})"
 
     logger.trace(__name__, 'Ensure objects get outputted', {"person": TestPerson()})
+
+
+def test_level_gating(test_context: TestContext):
+    """
+    Messages below the default log level must never reach a dispatcher, and the is_enabled/enabled_for
+    helpers must agree with what gets dispatched.
+    """
+    logger = AlienLogger()
+    recorder = RecordingDispatcher()
+    logger.dispatchers = {'recorder': recorder}
+    logger.default_log_level = LogLevels.INFO
+
+    assert not logger.is_enabled(LogLevels.DEBUG), "DEBUG should be gated at INFO."
+    assert logger.is_enabled(LogLevels.WARNING), "WARNING should pass at INFO."
+    assert not logger.enabled_for(__name__, LogLevels.TRACE), "TRACE should be gated at INFO."
+
+    logger.trace(__name__, 'Gated trace')
+    logger.debug(__name__, 'Gated debug')
+    logger.log_internal(LogLevels.DEBUG, __name__, 'Gated log_internal')
+    logger.info(__name__, 'Passed info')
+    logger.error(__name__, 'Passed error')
+    assert [m.message_static for m in recorder.messages] == ['Passed info', 'Passed error']
+
+    logger.default_log_level = LogLevels.TRACE
+    logger.trace(__name__, 'Passed trace')
+    assert recorder.messages[-1].message_static == 'Passed trace'
+
+
+def test_module_log_levels(test_context: TestContext):
+    """
+    The [log_levels] section sets levels per module, and the longest matching dotted prefix wins.
+    """
+    config_file = test_context.project_path.joinpath('testing/collateral/testing/test_alienlogger_levels_config.toml')
+    os.environ['ALIENLOGGER__CONFIG_FILE_PATH'] = str(config_file)
+    logger = AlienLogger()
+    recorder = RecordingDispatcher()
+    logger.dispatchers = {'recorder': recorder}
+
+    assert logger.is_enabled(LogLevels.TRACE), "Some module logs at TRACE, so TRACE is enabled somewhere."
+    assert not logger.enabled_for('otherapp', LogLevels.DEBUG), "Unconfigured modules use the default level."
+    assert logger.enabled_for('myapp.mymodule', LogLevels.DEBUG)
+    assert logger.enabled_for('myapp.mymodule.foomodule', LogLevels.DEBUG), "Sub modules inherit the prefix level."
+    assert not logger.enabled_for('myapp.mymodule.noisy.sub', LogLevels.WARNING), "Longest prefix wins."
+    assert logger.enabled_for('myapp.db.pool', LogLevels.TRACE), "Unquoted dotted keys work too."
+    assert not logger.enabled_for('myapp.mymodulex', LogLevels.DEBUG), "Prefixes match whole dotted parts."
+    assert not logger.enabled_for(logger, LogLevels.DEBUG), "Objects resolve by their class name."
+
+    logger.debug('otherapp', 'Gated debug')
+    logger.debug('myapp.mymodule.foomodule', 'Passed debug')
+    logger.trace('myapp.db', 'Passed trace')
+    assert [m.message_static for m in recorder.messages] == ['Passed debug', 'Passed trace']
+
+    logger.default_log_level = LogLevels.TRACE
+    assert logger.enabled_for('otherapp', LogLevels.TRACE), "Changing the default drops the resolved levels."
+
+
+def test_config_reload(test_context: TestContext, tmp_path):
+    """
+    Changing the config file applies the new levels, and only rebuilds the dispatchers whose section changed.
+    """
+    config_text = test_context.project_path.joinpath(
+        'testing/collateral/testing/test_alienlogger_levels_config.toml').read_text()
+    config_file = tmp_path.joinpath('reload_config.toml')
+    config_file.write_text(config_text)
+    os.environ['ALIENLOGGER__CONFIG_FILE_PATH'] = str(config_file)
+
+    logger = AlienLogger()
+    try:
+        null_dispatcher = logger.dispatchers['null']
+        assert not logger.enabled_for('otherapp', LogLevels.DEBUG)
+        assert not logger.check_config_changes(), "Nothing changed yet."
+
+        config_file.write_text(config_text.replace("default_log_level = 'info'", "default_log_level = 'debug'"))
+        assert logger.check_config_changes(), "The levels changed."
+        assert logger.enabled_for('otherapp', LogLevels.DEBUG), "The new default level should be applied."
+        assert logger.dispatchers['null'] is null_dispatcher, "An unchanged dispatcher is kept."
+        assert logger.reload_metrics.reload_count == 1
+        assert logger.reload_metrics.last_dispatchers_rebuilt == 0
+
+        config_file.write_text(config_text.replace("default_log_level = 'info'", "default_log_level = 'debug'")
+                               .replace("[null]\n", "[null]\nsome_setting = true\n"))
+        assert logger.check_config_changes()
+        assert logger.dispatchers['null'] is not null_dispatcher, "A changed dispatcher is rebuilt."
+        assert logger.reload_metrics.last_dispatchers_rebuilt == 1
+
+        config_file.write_text("this is not = = toml")
+        assert not logger.check_config_changes(), "A broken file keeps the previous config."
+        assert logger.reload_metrics.failed_reload_count == 1
+        assert logger.enabled_for('otherapp', LogLevels.DEBUG)
+    finally:
+        logger.stop_config_watcher()
+
+
+def test_failed_reload_closes_new_dispatchers(test_context: TestContext, tmp_path, monkeypatch):
+    """
+    A reload that fails half way closes the dispatchers it already built, and keeps the current ones open.  A changed
+    config_reload_seconds retunes the watcher.
+    """
+    closed = []
+    monkeypatch.setattr(RecordingDispatcher, 'close', lambda self: closed.append(self))
+
+    config_text = test_context.project_path.joinpath(
+        'testing/collateral/testing/test_alienlogger_levels_config.toml').read_text()
+    config_file = tmp_path.joinpath('reload_config.toml')
+    config_file.write_text(config_text)
+    os.environ['ALIENLOGGER__CONFIG_FILE_PATH'] = str(config_file)
+
+    logger = AlienLogger()
+    try:
+        null_dispatcher = logger.dispatchers['null']
+        broken_text = config_text.replace("dispatchers = ['null']", "dispatchers = ['null', 'recorder', 'broken']")
+        broken_text += "\n[recorder]\ndispatcher_class_name = 'test_fixtures.RecordingDispatcher'\n"
+        broken_text += "\n[broken]\ndispatcher_class_name = 'alienprobe.dispatchers.no_such.NoSuchDispatcher'\n"
+        config_file.write_text(broken_text)
+        assert not logger.check_config_changes(), "The broken dispatcher fails the reload."
+        assert logger.dispatchers == {'null': null_dispatcher}, "The current dispatchers stay."
+        assert len(closed) == 1 and isinstance(closed[0], RecordingDispatcher), "The one built in the pass is closed."
+
+        assert logger._config_watcher.interval_seconds == 60
+        config_file.write_text(config_text.replace("[common]\n", "[common]\nconfig_reload_seconds = 5\n"))
+        assert logger.check_config_changes()
+        assert logger._config_watcher.interval_seconds == 5, "A new reload interval is applied to the watcher."
+
+        config_file.write_text(config_text.replace("[common]\n", "[common]\nconfig_reload_seconds = 0\n"))
+        assert logger.check_config_changes()
+        assert logger._config_watcher is None, "A reload interval of 0 stops watching."
+    finally:
+        logger.stop_config_watcher()
+
+
+def test_config_watcher_checks_one_at_a_time(tmp_path, monkeypatch):
+    """
+    The watcher thread and check_config_changes() may check at the same time, a change is applied once.
+    """
+    import threading
+    import time
+    from alienprobe import config_watcher
+    from alienprobe.config_watcher import ConfigWatcher
+
+    config_file = tmp_path.joinpath('watched.toml')
+    config_file.write_text("value = 1\n")
+    applied = []
+
+    def on_change(config: dict):
+        applied.append(config['value'])
+
+    #
+    # A slow read and a slow parse, so that the checks would overlap.
+    #
+    loads = config_watcher.tomli.loads
+
+    def slow_open(*args, **kwargs):
+        time.sleep(0.02)
+        return open(*args, **kwargs)
+
+    def slow_loads(text: str) -> dict:
+        time.sleep(0.02)
+        return loads(text)
+
+    monkeypatch.setattr(config_watcher, 'open', slow_open, raising=False)
+    monkeypatch.setattr(config_watcher.tomli, 'loads', slow_loads)
+
+    watcher = ConfigWatcher(config_path=config_file, interval_seconds=60, on_change=on_change)
+    config_file.write_text("value = 2\n")
+    threads = [threading.Thread(target=watcher.check_now) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert applied == [2]
+
+
+def test_reload_replaces_serializers(test_context: TestContext, tmp_path):
+    """
+    A serializer taken out of the [serializers] section stops applying on the reload.
+    """
+    from alienprobe.dispatchers.message_template import CompiledMessageFormat
+    from alienprobe.serializers import DEFAULT_SERIALIZERS
+    from test_dispatchers import Money
+
+    config_text = test_context.project_path.joinpath(
+        'testing/collateral/testing/test_alienlogger_levels_config.toml').read_text()
+    config_file = tmp_path.joinpath('reload_config.toml')
+    config_file.write_text(config_text + "\n[serializers]\n"
+                           "\"test_dispatchers.Money\" = \"test_dispatchers.encode_money\"\n")
+    os.environ['ALIENLOGGER__CONFIG_FILE_PATH'] = str(config_file)
+
+    compiled = CompiledMessageFormat(message_format='[[LOG_PARAMS]]', exception_format='',
+                                     datetime_format='%Y', log_utc=True)
+    logger = AlienLogger()
+    try:
+        assert compiled.serializers.encode(Money('10', 'EUR')) == '"10 EUR"'
+
+        config_file.write_text(config_text)
+        assert logger.check_config_changes()
+        assert compiled.serializers.encode(Money('10', 'EUR')).startswith('"<'), "The removed serializer is gone."
+    finally:
+        logger.stop_config_watcher()
+        DEFAULT_SERIALIZERS.replace_config_encoders({})
+
+
+def test_lazy_params(test_context: TestContext):
+    """
+    Lazy params are only computed when the message passes the level gating and gets rendered, and only once for
+    every dispatcher.
+    """
+    from alienprobe.dispatchers.message_template import CompiledMessageFormat
+    from alienprobe.lazy import lazy
+
+    logger = AlienLogger()
+    recorder = RecordingDispatcher()
+    logger.dispatchers = {'recorder': recorder}
+    logger.default_log_level = LogLevels.INFO
+
+    calls = []
+
+    def expensive():
+        calls.append(1)
+        return 'computed'
+
+    logger.debug(__name__, 'Gated', {'value': lazy(expensive)})
+    logger.debug(__name__, 'Gated too', lambda: {'value': expensive()})
+    assert not calls, "Nothing is computed for a gated message."
+
+    logger.info(__name__, 'Lazy value', {'value': lazy(expensive), 'plain': 1, 'failing': lambda: 1 / 0})
+    logger.info(__name__, 'Lazy dict', lambda: {'value': expensive()})
+    assert not calls, "Nothing is computed until a dispatcher renders the message."
+
+    compiled = CompiledMessageFormat(message_format='[[LOG_PARAMS]]', exception_format='',
+                                     datetime_format='%Y', log_utc=True)
+    rendered = [compiled.render(msg_obj) for msg_obj in recorder.messages for _ in range(3)]
+    assert len(calls) == 2, "Each lazy value is computed once, however many times it is rendered."
+    assert rendered[0].startswith('value="computed" plain=1 failing="<lazy param failed: ZeroDivisionError')
+    assert rendered[3] == 'value="computed"'
+
+
+def test_callable_params_are_not_lazy(test_context: TestContext):
+    """
+    Only lazy(...), functions and lambdas are called.  A bound method, a partial or a callable object is a value.
+    """
+    import functools
+    from alienprobe.lazy import is_lazy, lazy
+
+    class Handler:
+        def __call__(self):
+            raise AssertionError("A callable object is not lazy.")
+
+        def handle(self):
+            raise AssertionError("A bound method is not lazy.")
+
+    handler = Handler()
+    assert is_lazy(lambda: 1) and is_lazy(lazy(handler.handle))
+    assert not is_lazy(handler) and not is_lazy(handler.handle) and not is_lazy(functools.partial(int, '1'))
+    assert not is_lazy(Handler) and not is_lazy(len)
+
+    logger = AlienLogger()
+    recorder = RecordingDispatcher()
+    logger.dispatchers = {'recorder': recorder}
+    logger.info(__name__, 'Callbacks', {'callback': handler.handle, 'handler': handler})
+    params = recorder.messages[-1].params
+    assert params['callback'] == handler.handle and params['handler'] is handler
+
+    try:
+        logger.info(__name__, 'Not a dict', functools.partial(dict, value=1))
+        assert False, "A partial is not a lazy params dict, wrap it in lazy(...)."
+    except ValueError:
+        pass
+
+
+def test_rate_limits(test_context: TestContext):
+    """
+    Every message key gets its own token bucket, with the budget of its module or level, and the suppressed messages
+    are summarized per key.
+    """
+    import time
+    from alienprobe.rate_limiter import SUMMARY_MESSAGE
+
+    config_file = test_context.project_path.joinpath(
+        'testing/collateral/testing/test_alienlogger_rate_limits_config.toml')
+    os.environ['ALIENLOGGER__CONFIG_FILE_PATH'] = str(config_file)
+    logger = AlienLogger()
+    recorder = RecordingDispatcher()
+    logger.dispatchers = {'recorder': recorder}
+
+    for url in ('http://a', 'http://b'):
+        for index in range(10):
+            logger.warn('myapp.web', 'Cannot connect', {'url': url, 'retry': index})
+    for index in range(5):
+        logger.error('myapp.web', 'Cannot connect')
+    for index in range(3):
+        logger.warning('myapp.poller.jobs', 'Poll failed')
+    assert [(m.message_static, m.params.get('url') if m.params else None) for m in recorder.messages] == \
+        [('Cannot connect', 'http://a')] * 3 + [('Cannot connect', 'http://b')] * 3 + \
+        [('Cannot connect', None)] * 5 + [('Poll failed', None)], "Burst of 3 per url, errors unlimited, 1 per poll."
+
+    time.sleep(0.15)
+    logger.warn('myapp.web', 'Cannot connect', {'url': 'http://a'})
+    assert len(recorder.messages) == 13, "The bucket refills at rate_per_second."
+
+    del recorder.messages[:]
+    logger.flush()
+    summaries = {(m.class_name, m.params['message'], m.params.get('url')): m.params['suppressed_count']
+                 for m in recorder.messages if m.message_static == SUMMARY_MESSAGE}
+    assert summaries == {('myapp.web', 'Cannot connect', 'http://a'): 7,
+                         ('myapp.web', 'Cannot connect', 'http://b'): 7,
+                         ('myapp.poller.jobs', 'Poll failed', None): 2}
+    assert all(m.level is LogLevels.WARNING for m in recorder.messages)
+
+    del recorder.messages[:]
+    logger.flush()
+    assert not recorder.messages, "A key is only summarized again once it suppressed more."
+
+    calls = []
+
+    def computed_url(url: str) -> str:
+        calls.append(url)
+        return url
+
+    for index in range(10):
+        logger.warn('myapp.lazy', 'Cannot connect', {'url': lambda: computed_url('http://c'), 'retry': index})
+    for index in range(10):
+        logger.warn('myapp.lazy', 'Cannot connect', lambda: {'url': computed_url('http://d')})
+    assert len(recorder.messages) == 6, "A lazy key param is keyed on its value, not on the new lambda of every call."
+    assert [m.params['url'] for m in recorder.messages] == ['http://c'] * 3 + ['http://d'] * 3
+    assert len(calls) == 20, "The value computed for the key is the one on the message, it is not computed again."
+    logger.flush()
+    summaries = {m.params.get('url'): m.params['suppressed_count']
+                 for m in recorder.messages if m.message_static == SUMMARY_MESSAGE}
+    assert summaries == {'http://c': 7, 'http://d': 7}
+
+
+def raise_from_depth(depth: int):
+    """
+    Raises a ValueError from depth nested calls.
+    """
+    if depth:
+        raise_from_depth(depth - 1)
+    raise ValueError('too deep')
+
+
+def test_exception_logged_again_after_reraise(test_context: TestContext):
+    """
+    An exception that is logged, re-raised and logged again higher up shows its traceback as it is at each log
+    call, and the dedup window applies per message, not per exception object.
+    """
+    from alienprobe.exception_text import EXCEPTION_TEXT_CACHE
+
+    logger = AlienLogger()
+    recorder = RecordingDispatcher()
+    logger.dispatchers = {'recorder': recorder}
+
+    def log_and_reraise():
+        try:
+            raise_from_depth(1)
+        except ValueError as ex:
+            logger.error(__name__, 'Inner failure', exception=ex)
+            raise
+
+    try:
+        log_and_reraise()
+    except ValueError as ex:
+        logger.error(__name__, 'Outer failure', exception=ex)
+
+    inner_text, outer_text = [m.exception_text for m in recorder.messages]
+    assert outer_text.count('\n  File ') == inner_text.count('\n  File ') + 1, "The outer log has one more frame."
+    assert 'test_exception_logged_again_after_reraise' in outer_text
+    assert 'test_exception_logged_again_after_reraise' not in inner_text
+
+    EXCEPTION_TEXT_CACHE.configure(dedup_seconds=60)
+    try:
+        del recorder.messages[:]
+        try:
+            raise_from_depth(0)
+        except ValueError as ex:
+            error = ex
+        logger.error(__name__, 'First', exception=error)
+        logger.error(__name__, 'Again', exception=error)
+        EXCEPTION_TEXT_CACHE.configure(dedup_seconds=60)
+        logger.error(__name__, 'After the window', exception=error)
+        first, again, after = [m.exception_text for m in recorder.messages]
+        assert first.startswith('[fingerprint ') and 'Traceback' in first
+        assert 'same stack trace as fingerprint' in again
+        assert after == first, "Once the window is over, the full stack trace is written again."
+    finally:
+        EXCEPTION_TEXT_CACHE.configure(dedup_seconds=0)
+
+
+def test_collector_message_encoding():
+    """
+    A message comes out of the collector encoding as it went in, apart from the types that have no binary form.
+    """
+    from alienprobe.collector import RemoteException, decode_message, encode_message, FRAME_HEADER
+    from alienprobe.message import Message
+
+    logged_at = datetime.datetime(2024, 1, 2, 3, 4, 5, 6000, tzinfo=datetime.timezone.utc)
+    params = {'text': 'caf\u00e9', 'small': -3, 'big': 2 ** 80, 'ratio': 0.5, 'flag': False, 'nothing': None,
+              'when': logged_at, 'day': logged_at.date(), 'nested': {'ids': [1, 2]}, 'pair': (1, 'x'),
+              'path': Path('/tmp/input.csv')}
+    try:
+        raise KeyError('missing')
+    except KeyError as ex:
+        error = ex
+    msg_obj = Message(level=LogLevels.WARNING, class_name=object(), message_static='Encoded', params=params,
+                      ex=error, instance_id='INSTANCE', machine_name='MACHINE')
+
+    frame = encode_message(msg_obj)
+    assert FRAME_HEADER.unpack_from(frame)[0] == len(frame) - FRAME_HEADER.size
+    decoded = decode_message(frame[FRAME_HEADER.size:])
+    assert decoded.level is LogLevels.WARNING
+    assert decoded.class_name == "<class 'object'>"
+    assert (decoded.message_static, decoded.instance_id, decoded.machine_name) == ('Encoded', 'INSTANCE', 'MACHINE')
+    assert (decoded.timestamp_ns, decoded.monotonic_ns) == (msg_obj.timestamp_ns, msg_obj.monotonic_ns)
+    assert decoded.params == dict(params, pair=[1, 'x'], path='/tmp/input.csv')
+    assert isinstance(decoded.ex, RemoteException) and str(decoded.ex) == "KeyError: 'missing'"
+    assert decoded.exception_text == msg_obj.exception_text and 'KeyError' in decoded.exception_text
+
+
+def test_collector_process_pool(test_context: TestContext):
+    """
+    The workers of a process pool send their messages to the collector, which dispatches them with its own
+    dispatchers.
+    """
+    logger = AlienLogger()
+    recorder = RecordingDispatcher()
+    logger.dispatchers = {'recorder': recorder}
+    logger.start_collector()
+    try:
+        with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn')) as pool:
+            assert list(pool.map(log_in_worker, range(4))) == [50] * 4
+    finally:
+        logger.stop_collector()
+
+    #
+    # The workers also send the 'Logger Initialized' of their own logger.
+    #
+    messages = [msg_obj for msg_obj in recorder.messages if msg_obj.class_name == 'worker']
+    assert len(messages) == 200, "Every message the workers logged is dispatched."
+    assert logger.instance_id not in {msg_obj.instance_id for msg_obj in messages}
+    for worker_index in range(4):
+        worker_messages = [msg_obj for msg_obj in messages if msg_obj.params['worker'] == worker_index]
+        assert [msg_obj.params['index'] for msg_obj in worker_messages] == list(range(50)), "In order per worker."
+        assert worker_messages[0].params['tags'] == ['a', 'b']
+        assert 'ValueError: worker' in worker_messages[-1].ex.text
+
+
+def test_collector_survives_worker_crash(test_context: TestContext):
+    """
+    What a worker sent before it was killed is still dispatched.
+    """
+    logger = AlienLogger()
+    recorder = RecordingDispatcher()
+    logger.dispatchers = {'recorder': recorder}
+    logger.start_collector()
+    try:
+        process = multiprocessing.get_context('spawn').Process(target=log_and_crash, args=(500,))
+        process.start()
+        process.join()
+        assert process.exitcode == -signal.SIGKILL
+    finally:
+        logger.stop_collector()
+
+    assert [msg_obj.params['index'] for msg_obj in recorder.messages if msg_obj.class_name == 'worker'] == \
+        list(range(500))